@@ -7,9 +7,9 @@ import sys
 # Add the app directory to the path
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from app.config import settings
-from app.database import Base
-from app.models import user, chat_room, message, analytics
+from app.core.config import settings
+from app.db.database import Base
+from app import models  # noqa: F401  (registers every table on Base.metadata)
 
 # this is the Alembic Config object
 config = context.config
@@ -19,7 +19,7 @@ if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
 # Set the database URL from settings
-config.set_main_option("sqlalchemy.url", settings.database_url)
+config.set_main_option("sqlalchemy.url", settings.DATABASE_URL)
 
 # Add your model's MetaData object here for 'autogenerate' support
 target_metadata = Base.metadata
@@ -0,0 +1,73 @@
+"""chat history indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+
+Adds the keyset pagination indexes and makes chat_sessions.room_id unique.
+Duplicate rooms are merged into the oldest session with the same room_id
+(messages are moved over) before the unique index is built.
+
+User-visible: the duplicate rooms disappear, and the room list is now ordered
+by (created_at, id) (the new ix_chat_sessions_user_id_created_at_id index)
+instead of updated_at. See "Upgrading an existing database" in the README.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def _existing_indexes(table: str) -> set:
+    return {ix["name"] for ix in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade() -> None:
+    # Merge duplicate rooms into the oldest session per room_id
+    op.execute(
+        """
+        UPDATE chat_messages
+        SET session_id = (
+            SELECT MIN(keep.id) FROM chat_sessions keep
+            WHERE keep.room_id = (
+                SELECT dup.room_id FROM chat_sessions dup WHERE dup.id = chat_messages.session_id
+            )
+        )
+        WHERE session_id NOT IN (SELECT MIN(id) FROM chat_sessions GROUP BY room_id)
+        """
+    )
+    op.execute("DELETE FROM chat_sessions WHERE id NOT IN (SELECT MIN(id) FROM chat_sessions GROUP BY room_id)")
+
+    session_indexes = _existing_indexes("chat_sessions")
+    if "ix_chat_sessions_room_id" not in session_indexes:
+        op.create_index("ix_chat_sessions_room_id", "chat_sessions", ["room_id"], unique=True)
+    if "ix_chat_sessions_user_id_created_at_id" not in session_indexes:
+        op.create_index("ix_chat_sessions_user_id_created_at_id", "chat_sessions", ["user_id", "created_at", "id"])
+
+    if "ix_chat_messages_session_id_created_at_id" not in _existing_indexes("chat_messages"):
+        if op.get_bind().dialect.name == "postgresql":
+            # chat_messages is the largest table: build without blocking writes
+            with op.get_context().autocommit_block():
+                op.create_index(
+                    "ix_chat_messages_session_id_created_at_id",
+                    "chat_messages",
+                    ["session_id", "created_at", "id"],
+                    postgresql_concurrently=True,
+                )
+        else:
+            op.create_index(
+                "ix_chat_messages_session_id_created_at_id",
+                "chat_messages",
+                ["session_id", "created_at", "id"],
+            )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_chat_messages_session_id_created_at_id", table_name="chat_messages")
+    op.drop_index("ix_chat_sessions_user_id_created_at_id", table_name="chat_sessions")
+    op.drop_index("ix_chat_sessions_room_id", table_name="chat_sessions")
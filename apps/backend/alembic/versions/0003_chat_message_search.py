@@ -0,0 +1,78 @@
+"""chat message full-text search
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+
+PostgreSQL: a stored generated ``content_tsv`` column with a GIN index, built
+concurrently. Adding a stored generated column rewrites chat_messages under an
+exclusive lock, so on large tables run this in a maintenance window.
+
+SQLite: an external-content FTS5 table over chat_messages.content, kept in
+sync by triggers and backfilled from the existing rows.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        columns = {c["name"] for c in sa.inspect(bind).get_columns("chat_messages")}
+        if "content_tsv" not in columns:
+            op.execute(
+                "ALTER TABLE chat_messages ADD COLUMN content_tsv tsvector "
+                "GENERATED ALWAYS AS (to_tsvector('english', content)) STORED"
+            )
+        with op.get_context().autocommit_block():
+            op.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chat_messages_content_tsv "
+                "ON chat_messages USING gin (content_tsv)"
+            )
+        return
+
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5("
+        "content, content='chat_messages', content_rowid='id', tokenize='porter unicode61')"
+    )
+    op.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts(rowid, content) VALUES (new.id, new.content);
+        END
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update AFTER UPDATE OF content ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO chat_messages_fts(rowid, content) VALUES (new.id, new.content);
+        END
+        """
+    )
+    op.execute("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP INDEX IF EXISTS ix_chat_messages_content_tsv")
+        op.execute("ALTER TABLE chat_messages DROP COLUMN IF EXISTS content_tsv")
+        return
+
+    for trigger in ("chat_messages_fts_insert", "chat_messages_fts_delete", "chat_messages_fts_update"):
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    op.execute("DROP TABLE IF EXISTS chat_messages_fts")
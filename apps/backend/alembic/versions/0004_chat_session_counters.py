@@ -0,0 +1,170 @@
+"""chat session counters
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+
+Denormalized per-room summary on chat_sessions (message_count, total_tokens,
+last_message_at, last_message_preview), kept up to date by triggers on
+chat_messages so every writer (ORM inserts, batched inserts, COPY, imports)
+maintains it. Deletes decrement the counters; the preview is left as is.
+
+PostgreSQL uses statement-level triggers with transition tables, so a batch
+of N rows costs one UPDATE per affected room rather than N. Rooms are locked
+in id order first so concurrent batches cannot deadlock. SQLite uses
+row-level triggers.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+PREVIEW_CHARS = 200
+
+POSTGRES_FUNCTIONS = f"""
+CREATE OR REPLACE FUNCTION chat_sessions_count_inserted() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM 1 FROM chat_sessions
+    WHERE id IN (SELECT DISTINCT session_id FROM new_rows)
+    ORDER BY id FOR UPDATE;
+
+    UPDATE chat_sessions s SET
+        message_count = s.message_count + agg.n,
+        total_tokens = s.total_tokens + agg.tokens,
+        last_message_at = CASE WHEN s.last_message_at IS NULL OR agg.last_at >= s.last_message_at
+                               THEN agg.last_at ELSE s.last_message_at END,
+        last_message_preview = CASE WHEN s.last_message_at IS NULL OR agg.last_at >= s.last_message_at
+                                    THEN agg.preview ELSE s.last_message_preview END
+    FROM (
+        SELECT DISTINCT ON (session_id)
+            session_id,
+            count(*) OVER w AS n,
+            sum(coalesce(tokens_used, 0)) OVER w AS tokens,
+            created_at AS last_at,
+            left(content, {PREVIEW_CHARS}) AS preview
+        FROM new_rows
+        WINDOW w AS (PARTITION BY session_id)
+        ORDER BY session_id, created_at DESC, id DESC
+    ) agg
+    WHERE s.id = agg.session_id;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION chat_sessions_count_deleted() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM 1 FROM chat_sessions
+    WHERE id IN (SELECT DISTINCT session_id FROM old_rows)
+    ORDER BY id FOR UPDATE;
+
+    UPDATE chat_sessions s SET
+        message_count = greatest(s.message_count - agg.n, 0),
+        total_tokens = greatest(s.total_tokens - agg.tokens, 0)
+    FROM (
+        SELECT session_id, count(*) AS n, sum(coalesce(tokens_used, 0)) AS tokens
+        FROM old_rows GROUP BY session_id
+    ) agg
+    WHERE s.id = agg.session_id;
+    RETURN NULL;
+END
+$$;
+"""
+
+SQLITE_INSERT_TRIGGER = f"""
+CREATE TRIGGER IF NOT EXISTS chat_messages_counters_insert AFTER INSERT ON chat_messages BEGIN
+    UPDATE chat_sessions SET
+        message_count = message_count + 1,
+        total_tokens = total_tokens + coalesce(new.tokens_used, 0),
+        last_message_at = CASE WHEN last_message_at IS NULL OR new.created_at >= last_message_at
+                               THEN new.created_at ELSE last_message_at END,
+        last_message_preview = CASE WHEN last_message_at IS NULL OR new.created_at >= last_message_at
+                                    THEN substr(new.content, 1, {PREVIEW_CHARS}) ELSE last_message_preview END
+    WHERE id = new.session_id;
+END
+"""
+
+SQLITE_DELETE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS chat_messages_counters_delete AFTER DELETE ON chat_messages BEGIN
+    UPDATE chat_sessions SET
+        message_count = max(message_count - 1, 0),
+        total_tokens = max(total_tokens - coalesce(old.tokens_used, 0), 0)
+    WHERE id = old.session_id;
+END
+"""
+
+
+def upgrade() -> None:
+    op.add_column("chat_sessions", sa.Column("message_count", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("chat_sessions", sa.Column("total_tokens", sa.BigInteger(), nullable=False, server_default="0"))
+    op.add_column("chat_sessions", sa.Column("last_message_at", sa.DateTime(timezone=True), nullable=True))
+    op.add_column("chat_sessions", sa.Column("last_message_preview", sa.String(PREVIEW_CHARS), nullable=True))
+
+    if op.get_bind().dialect.name == "postgresql":
+        # Backfill before the triggers exist so nothing is counted twice
+        op.execute(
+            f"""
+            UPDATE chat_sessions s SET
+                message_count = agg.n,
+                total_tokens = agg.tokens,
+                last_message_at = agg.last_at,
+                last_message_preview = agg.preview
+            FROM (
+                SELECT DISTINCT ON (session_id)
+                    session_id,
+                    count(*) OVER w AS n,
+                    sum(coalesce(tokens_used, 0)) OVER w AS tokens,
+                    created_at AS last_at,
+                    left(content, {PREVIEW_CHARS}) AS preview
+                FROM chat_messages
+                WINDOW w AS (PARTITION BY session_id)
+                ORDER BY session_id, created_at DESC, id DESC
+            ) agg
+            WHERE s.id = agg.session_id
+            """
+        )
+        op.execute(POSTGRES_FUNCTIONS)
+        op.execute(
+            "CREATE TRIGGER chat_messages_counters_insert AFTER INSERT ON chat_messages "
+            "REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION chat_sessions_count_inserted()"
+        )
+        op.execute(
+            "CREATE TRIGGER chat_messages_counters_delete AFTER DELETE ON chat_messages "
+            "REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION chat_sessions_count_deleted()"
+        )
+        return
+
+    op.execute(
+        f"""
+        UPDATE chat_sessions SET
+            message_count = (SELECT count(*) FROM chat_messages m WHERE m.session_id = chat_sessions.id),
+            total_tokens = (SELECT coalesce(sum(m.tokens_used), 0) FROM chat_messages m WHERE m.session_id = chat_sessions.id),
+            last_message_at = (SELECT max(m.created_at) FROM chat_messages m WHERE m.session_id = chat_sessions.id),
+            last_message_preview = (
+                SELECT substr(m.content, 1, {PREVIEW_CHARS}) FROM chat_messages m
+                WHERE m.session_id = chat_sessions.id
+                ORDER BY m.created_at DESC, m.id DESC LIMIT 1
+            )
+        """
+    )
+    op.execute(SQLITE_INSERT_TRIGGER)
+    op.execute(SQLITE_DELETE_TRIGGER)
+
+
+def downgrade() -> None:
+    postgres = op.get_bind().dialect.name == "postgresql"
+    for trigger in ("chat_messages_counters_insert", "chat_messages_counters_delete"):
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}" + (" ON chat_messages" if postgres else ""))
+    if postgres:
+        op.execute("DROP FUNCTION IF EXISTS chat_sessions_count_inserted()")
+        op.execute("DROP FUNCTION IF EXISTS chat_sessions_count_deleted()")
+
+    with op.batch_alter_table("chat_sessions") as batch:
+        batch.drop_column("last_message_preview")
+        batch.drop_column("last_message_at")
+        batch.drop_column("total_tokens")
+        batch.drop_column("message_count")
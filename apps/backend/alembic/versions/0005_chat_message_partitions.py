@@ -0,0 +1,152 @@
+"""monthly chat_messages partitions
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+
+PostgreSQL: chat_messages becomes a table range-partitioned by created_at,
+one partition per month (chat_messages_pYYYYMM) plus a default partition for
+anything outside them. ``chat_messages_create_partition(month)`` creates a
+month's partition and is called ahead of time by the retention job
+(app/services/retention.py). The primary key becomes (id, created_at) because
+a partitioned table's unique constraints must include the partition key; ids
+still come from the same sequence.
+
+The existing rows are copied into the new table, which rewrites chat_messages
+under an exclusive lock: on large tables run this in a maintenance window.
+
+SQLite has no partitioning; the retention job deletes expired rows instead.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+COLUMNS = "id, session_id, content, sender, model, tokens_used, response_time_ms, created_at"
+
+CREATE_PARTITION_FUNCTION = """
+CREATE OR REPLACE FUNCTION chat_messages_create_partition(month date) RETURNS text LANGUAGE plpgsql AS $$
+DECLARE
+    first_day date := date_trunc('month', month)::date;
+    name text := format('chat_messages_p%s', to_char(first_day, 'YYYYMM'));
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF chat_messages FOR VALUES FROM (%L) TO (%L)',
+        name,
+        first_day::timestamp AT TIME ZONE 'UTC',
+        (first_day + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+    );
+    RETURN name;
+END
+$$;
+"""
+
+
+def _create_counter_triggers() -> None:
+    # Functions from 0004; the triggers belong to the table and are recreated with it
+    op.execute(
+        "CREATE TRIGGER chat_messages_counters_insert AFTER INSERT ON chat_messages "
+        "REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION chat_sessions_count_inserted()"
+    )
+    op.execute(
+        "CREATE TRIGGER chat_messages_counters_delete AFTER DELETE ON chat_messages "
+        "REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION chat_sessions_count_deleted()"
+    )
+
+
+def _create_indexes() -> None:
+    op.execute("CREATE INDEX ix_chat_messages_id ON chat_messages (id)")
+    op.execute(
+        "CREATE INDEX ix_chat_messages_session_id_created_at_id ON chat_messages (session_id, created_at, id)"
+    )
+    op.execute("CREATE INDEX ix_chat_messages_content_tsv ON chat_messages USING gin (content_tsv)")
+
+
+def _retire_current_table(new_name: str) -> None:
+    """Rename chat_messages out of the way and free the names the new table needs"""
+    op.execute(f"ALTER TABLE chat_messages RENAME TO {new_name}")
+    op.execute(f"ALTER TABLE {new_name} RENAME CONSTRAINT chat_messages_pkey TO {new_name}_pkey")
+    for index in ("ix_chat_messages_id", "ix_chat_messages_session_id_created_at_id", "ix_chat_messages_content_tsv"):
+        op.execute(f"DROP INDEX IF EXISTS {index}")
+    for trigger in ("chat_messages_counters_insert", "chat_messages_counters_delete"):
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {new_name}")
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    _retire_current_table("chat_messages_unpartitioned")
+    op.execute(
+        """
+        CREATE TABLE chat_messages (
+            id integer NOT NULL DEFAULT nextval('chat_messages_id_seq'),
+            session_id integer NOT NULL REFERENCES chat_sessions (id),
+            content text NOT NULL,
+            sender varchar NOT NULL,
+            model varchar,
+            tokens_used integer,
+            response_time_ms double precision,
+            created_at timestamptz NOT NULL DEFAULT now(),
+            content_tsv tsvector GENERATED ALWAYS AS (to_tsvector('english', content)) STORED,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute("ALTER SEQUENCE chat_messages_id_seq OWNED BY chat_messages.id")
+    op.execute("CREATE TABLE chat_messages_default PARTITION OF chat_messages DEFAULT")
+    op.execute(CREATE_PARTITION_FUNCTION)
+    # Every month that has data, through the next three
+    op.execute(
+        """
+        SELECT chat_messages_create_partition(month::date)
+        FROM generate_series(
+            date_trunc('month', coalesce((SELECT min(created_at) FROM chat_messages_unpartitioned), now()) AT TIME ZONE 'UTC'),
+            date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months',
+            interval '1 month'
+        ) AS month
+        """
+    )
+    # Copy before the counter triggers exist: chat_sessions already counts these rows
+    op.execute(
+        f"""
+        INSERT INTO chat_messages ({COLUMNS})
+        SELECT id, session_id, content, sender, model, tokens_used, response_time_ms, coalesce(created_at, now())
+        FROM chat_messages_unpartitioned
+        """
+    )
+    op.execute("DROP TABLE chat_messages_unpartitioned")
+    _create_indexes()
+    _create_counter_triggers()
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    _retire_current_table("chat_messages_partitioned")
+    op.execute(
+        """
+        CREATE TABLE chat_messages (
+            id integer NOT NULL DEFAULT nextval('chat_messages_id_seq') PRIMARY KEY,
+            session_id integer NOT NULL REFERENCES chat_sessions (id),
+            content text NOT NULL,
+            sender varchar NOT NULL,
+            model varchar,
+            tokens_used integer,
+            response_time_ms double precision,
+            created_at timestamptz DEFAULT now(),
+            content_tsv tsvector GENERATED ALWAYS AS (to_tsvector('english', content)) STORED
+        )
+        """
+    )
+    op.execute("ALTER SEQUENCE chat_messages_id_seq OWNED BY chat_messages.id")
+    op.execute(f"INSERT INTO chat_messages ({COLUMNS}) SELECT {COLUMNS} FROM chat_messages_partitioned")
+    op.execute("DROP TABLE chat_messages_partitioned")
+    op.execute("DROP FUNCTION IF EXISTS chat_messages_create_partition(date)")
+    _create_indexes()
+    _create_counter_triggers()
@@ -1,21 +1,21 @@
 from typing import Generator, Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from ..db.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..db.database import get_async_db
 from ..services.auth_service import auth_service
-from ..models.user import User
+from ..schemas.user import CurrentUser
 
 security = HTTPBearer()
 
 
-def get_current_user(
-    db: Session = Depends(get_db),
+async def get_current_user(
+    db: AsyncSession = Depends(get_async_db),
     credentials: HTTPAuthorizationCredentials = Depends(security)
-) -> User:
-    """Get current authenticated user"""
+) -> CurrentUser:
+    """Get current authenticated user (served from the auth cache when possible)"""
     token = credentials.credentials
-    user = auth_service.get_current_user(db, token)
+    user = await auth_service.async_get_current_user(db, token)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -26,8 +26,8 @@ def get_current_user(
 
 
 def get_current_active_user(
-    current_user: User = Depends(get_current_user),
-) -> User:
+    current_user: CurrentUser = Depends(get_current_user),
+) -> CurrentUser:
     """Get current active user"""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
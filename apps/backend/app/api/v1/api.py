@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from .endpoints import auth, chat, health, websocket
+from .endpoints import auth, chat, health, metrics, websocket
 
 api_router = APIRouter()
 
@@ -7,4 +7,5 @@ api_router = APIRouter()
 api_router.include_router(auth.router, prefix="/auth", tags=["authentication"])
 api_router.include_router(chat.router, prefix="/chat", tags=["chat"])
 api_router.include_router(health.router, tags=["health"])
+api_router.include_router(metrics.router, tags=["metrics"])
 api_router.include_router(websocket.router, tags=["websocket"])
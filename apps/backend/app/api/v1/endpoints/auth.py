@@ -1,23 +1,32 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from ....db.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from ....db.database import get_async_db
 from ....services.auth_service import auth_service
 from ....schemas.auth import Token, LoginRequest
-from ....schemas.user import User, UserCreate
-from ....crud.user import user as user_crud
+from ....schemas.user import User, UserCreate, CurrentUser
+from ....crud.user import async_user as user_crud
+from ....core.security import PasswordHasherBusy
 from ....api.deps import get_current_active_user
 
 router = APIRouter()
 
 
+def _hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many authentication requests, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+
 @router.post("/register", response_model=User, status_code=status.HTTP_201_CREATED)
-def register(
+async def register(
     user_in: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Register new user"""
     # Check if email already exists
-    existing_user = user_crud.get_by_email(db, email=user_in.email)
+    existing_user = await user_crud.get_by_email(db, email=user_in.email)
     if existing_user:
         raise HTTPException(
             status_code=400,
@@ -25,24 +34,30 @@ def register(
         )
     
     # Check if username already exists
-    existing_username = user_crud.get_by_username(db, username=user_in.username)
+    existing_username = await user_crud.get_by_username(db, username=user_in.username)
     if existing_username:
         raise HTTPException(
             status_code=400,
             detail="The user with this username already exists"
         )
     
-    user = auth_service.create_user(db, user_in)
+    try:
+        user = await auth_service.async_create_user(db, user_in)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
     return user
 
 
 @router.post("/login", response_model=Token)
-def login(
+async def login(
     login_data: LoginRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Login user and return access token"""
-    user = auth_service.authenticate_user(db, login_data.email, login_data.password)
+    try:
+        user = await auth_service.async_authenticate_user(db, login_data.email, login_data.password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -58,8 +73,12 @@ def login(
 
 
 @router.get("/me", response_model=User)
-def read_users_me(
-    current_user: User = Depends(get_current_active_user)
+async def read_users_me(
+    current_user: CurrentUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get current user info"""
-    return current_user
+    user = await user_crud.get(db, id=current_user.id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
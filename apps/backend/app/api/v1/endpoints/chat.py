@@ -1,30 +1,226 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
-from ....db.database import get_db
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+from datetime import datetime
+import asyncio
+import re
+from ....db.database import get_db, get_async_db
 from ...deps import get_current_active_user
+from ....core.config import settings
+from ....core.serialization import dumps
 from ....services.ai_service import ai_service
-from ....models.user import User
-from ....schemas.chat import ChatRequest, ChatResponse, ChatSession, ChatSessionCreate
-from ....crud.chat import chat_session
+from ....services.context_builder import context_builder
+from ....services.message_sink import message_sink
+from ....services.history import HistoryImportError, RoomAccessError, gzip_stream, history_transfer
+from ....schemas.user import CurrentUser
+from ....schemas.chat import (
+    ChatRequest, ChatResponse, ChatBatchRequest, ChatSession, ChatSessionCreate, ChatMessageCreate,
+    ChatMessagePage, ChatSessionPage, ChatSearchPage, ChatImportResult
+)
+from ....crud.chat import chat_session, async_chat_session, async_chat_message
+from ....crud.pagination import decode_cursor, decode_rank_cursor, encode_rank_cursor, next_cursor
+from ....crud.search import async_chat_search
 
 router = APIRouter()
 
 
-@router.get("/rooms", response_model=List[ChatSession])
-def get_all_rooms(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+def _parse_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _room_context(
+    chat_request: ChatRequest,
+    current_user: CurrentUser,
+    db: AsyncSession
+) -> Tuple[Optional[int], Optional[List[Dict[str, str]]]]:
+    """Resolve ``chat_request.room_id`` to its session id and conversation context"""
+    if chat_request.room_id is None:
+        return None, None
+
+    room = await async_chat_session.get_by_room_id(db, room_id=chat_request.room_id)
+    if not room:
+        raise HTTPException(status_code=404, detail="Room not found")
+    if room.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this room")
+
+    return room.id, await _conversation_context(room.id, chat_request)
+
+
+async def _conversation_context(session_id: int, chat_request: ChatRequest) -> Optional[List[Dict[str, str]]]:
+    if not settings.AI_CONTEXT_ENABLED:
+        return None
+    return await context_builder.build(session_id, chat_request.model, chat_request.message)
+
+
+async def _save_exchange(session_id: int, chat_request: ChatRequest, ai_response: Dict):
+    await message_sink.submit(ChatMessageCreate(
+        session_id=session_id,
+        content=chat_request.message,
+        sender="user"
+    ))
+    await message_sink.submit(ChatMessageCreate(
+        session_id=session_id,
+        content=ai_response["response"],
+        sender="ai",
+        model=ai_response["model"],
+        tokens_used=ai_response.get("tokens_used"),
+        response_time_ms=ai_response.get("response_time_ms")
+    ))
+
+
+@router.get("/rooms", response_model=ChatSessionPage)
+async def get_all_rooms(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user: CurrentUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get chat rooms (sessions) for current user, newest first, one page at a time.
+
+    Each room carries its message count, token total and last-message preview,
+    read from counters on chat_sessions so the page costs a single indexed query.
+    """
+    rooms = await async_chat_session.get_user_sessions_page(
+        db, user_id=current_user.id, limit=limit, before=_parse_cursor(cursor)
+    )
+    return {"items": rooms[:limit], "next_cursor": next_cursor(rooms, limit)}
+
+
+@router.get("/search", response_model=ChatSearchPage)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: CurrentUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Full-text search over the current user's rooms, best match first, one page at a time"""
+    after = None
+    if cursor is not None:
+        try:
+            after = decode_rank_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    hits = await async_chat_search.search(db, user_id=current_user.id, query=q, limit=limit, after=after)
+    items = [
+        {
+            "message_id": hit.id,
+            "room_id": hit.room_id,
+            "sender": hit.sender,
+            "created_at": hit.created_at,
+            "snippet": hit.snippet,
+            "rank": hit.rank
+        }
+        for hit in hits[:limit]
+    ]
+    cursor_out = encode_rank_cursor(hits[limit - 1].rank, hits[limit - 1].id) if len(hits) > limit else None
+    return {"items": items, "next_cursor": cursor_out}
+
+
+@router.get("/rooms/{room_id}/messages", response_model=ChatMessagePage)
+async def get_room_messages(
+    room_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user: CurrentUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get a room's message history, newest first, one page at a time"""
+    room = await async_chat_session.get_by_room_id(db, room_id=room_id)
+    if not room:
+        raise HTTPException(status_code=404, detail="Room not found")
+    
+    if room.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to read this room")
+    
+    messages = await async_chat_message.get_session_messages_page(
+        db, session_id=room.id, limit=limit, before=_parse_cursor(cursor)
+    )
+    return {"items": messages[:limit], "next_cursor": next_cursor(messages, limit)}
+
+
+def _export_response(chunks: AsyncIterator[bytes], name: str, gzip: bool) -> StreamingResponse:
+    filename = re.sub(r"[^\w.-]", "_", name) + (".ndjson.gz" if gzip else ".ndjson")
+    return StreamingResponse(
+        gzip_stream(chunks) if gzip else chunks,
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+async def _import(request: Request, user_id: int, room_id: Optional[str] = None) -> Dict:
+    try:
+        return await history_transfer.import_ndjson(request.stream(), user_id=user_id, room_id=room_id)
+    except HistoryImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RoomAccessError as e:
+        raise HTTPException(status_code=403, detail=f"Not authorized to import into room {e}")
+
+
+@router.get("/export")
+async def export_history(
+    gzip: bool = False,
+    current_user: CurrentUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Stream all of the current user's rooms as NDJSON (gzip-compressed with ``gzip=true``)"""
+    rooms = await async_chat_session.get_user_sessions(db, user_id=current_user.id)
+    refs = [(room.id, room.room_id, room.created_at) for room in rooms]
+    # The export reads on its own connection; don't hold this one idle in a transaction meanwhile
+    await db.close()
+    return _export_response(history_transfer.export_rooms(refs), f"chat-history-{current_user.username}", gzip)
+
+
+@router.post("/import", response_model=ChatImportResult)
+async def import_history(
+    request: Request,
+    current_user: CurrentUser = Depends(get_current_active_user)
+):
+    """Import an NDJSON export (gzip accepted), creating rooms that don't exist yet"""
+    return await _import(request, current_user.id)
+
+
+@router.get("/rooms/{room_id}/export")
+async def export_room(
+    room_id: str,
+    gzip: bool = False,
+    current_user: CurrentUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Stream a room's history as NDJSON, oldest first (gzip-compressed with ``gzip=true``)"""
+    room = await async_chat_session.get_by_room_id(db, room_id=room_id)
+    if not room:
+        raise HTTPException(status_code=404, detail="Room not found")
+    if room.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to read this room")
+    ref = (room.id, room.room_id, room.created_at)
+    await db.close()
+    return _export_response(history_transfer.export_rooms([ref]), room_id, gzip)
+
+
+@router.post("/rooms/{room_id}/import", response_model=ChatImportResult)
+async def import_room(
+    room_id: str,
+    request: Request,
+    current_user: CurrentUser = Depends(get_current_active_user)
 ):
-    """Get all chat rooms (sessions) for current user"""
-    rooms = chat_session.get_user_sessions(db, user_id=current_user.id)
-    return rooms
+    """Append the messages of an NDJSON upload (gzip accepted) to a room, creating it if needed"""
+    return await _import(request, current_user.id, room_id)
 
 
 @router.post("/rooms", response_model=ChatSession, status_code=201)
 def create_room(
     room_data: ChatSessionCreate,
-    current_user: User = Depends(get_current_active_user),
+    current_user: CurrentUser = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """Create a new chat room (session)"""
@@ -33,14 +229,18 @@ def create_room(
     if existing_room:
         raise HTTPException(status_code=400, detail="Room with this ID already exists")
     
-    new_room = chat_session.create(db, user_id=current_user.id, room_id=room_data.room_id)
+    try:
+        new_room = chat_session.create(db, user_id=current_user.id, room_id=room_data.room_id)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Room with this ID already exists")
     return new_room
 
 
 @router.delete("/rooms/{room_id}", status_code=204)
 def delete_room(
     room_id: str,
-    current_user: User = Depends(get_current_active_user),
+    current_user: CurrentUser = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """Delete a chat room (session)"""
@@ -52,25 +252,152 @@ def delete_room(
         raise HTTPException(status_code=403, detail="Not authorized to delete this room")
     
     chat_session.delete(db, id=room.id)
+    context_builder.forget(room.id)
     return None
 
 
 @router.post("/message", response_model=ChatResponse)
 async def send_message(
     chat_request: ChatRequest,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Send message to AI and get response"""
+    """Send message to AI and get response.
+
+    With ``room_id`` the room's history is sent along and the exchange is saved to it.
+    """
+    session_id, context = await _room_context(chat_request, current_user, db)
+    # The upstream call can take seconds; don't hold a pooled connection meanwhile
+    await db.close()
     try:
         # Generate AI response
         ai_response = await ai_service.generate_response(
             message=chat_request.message,
             model=chat_request.model,
-            temperature=chat_request.temperature
+            temperature=chat_request.temperature,
+            use_cache=chat_request.cache,
+            context=context
         )
         
+        if session_id is not None:
+            await _save_exchange(session_id, chat_request, ai_response)
         return ChatResponse(**ai_response)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/batch")
+async def send_batch(
+    batch: ChatBatchRequest,
+    current_user: CurrentUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Answer many prompts concurrently, streaming NDJSON results as they finish.
+
+    Each line is ``{"index", "status": 200, "response": ChatResponse}`` or
+    ``{"index", "status", "detail"}`` for an item that failed; one item's
+    failure does not affect the others. At most ``concurrency`` items (capped
+    by ``CHAT_BATCH_CONCURRENCY``) are in flight at once.
+    """
+    if len(batch.items) > settings.CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch holds at most {settings.CHAT_BATCH_MAX_ITEMS} items"
+        )
+
+    # Every distinct room in one query, before any generation starts
+    room_ids = sorted({item.room_id for item in batch.items if item.room_id is not None})
+    rooms: Dict[str, Union[int, HTTPException]] = {
+        room_id: HTTPException(status_code=404, detail="Room not found") for room_id in room_ids
+    }
+    for room in await async_chat_session.get_by_room_ids(db, room_ids):
+        rooms[room.room_id] = room.id if room.user_id == current_user.id else HTTPException(
+            status_code=403, detail="Not authorized to access this room"
+        )
+    # Items build their context on their own connections; don't hold this one meanwhile
+    await db.close()
+
+    concurrency = min(batch.concurrency or settings.CHAT_BATCH_CONCURRENCY, settings.CHAT_BATCH_CONCURRENCY)
+    return StreamingResponse(
+        _batch_results(batch.items, rooms, concurrency),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _batch_results(
+    items: List[ChatRequest],
+    rooms: Dict[str, Union[int, HTTPException]],
+    concurrency: int
+) -> AsyncIterator[str]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(index: int, chat_request: ChatRequest) -> Dict[str, Any]:
+        try:
+            session_id = rooms[chat_request.room_id] if chat_request.room_id is not None else None
+            if isinstance(session_id, HTTPException):
+                raise session_id
+            async with semaphore:
+                context = await _conversation_context(session_id, chat_request) if session_id is not None else None
+                ai_response = await ai_service.generate_response(
+                    message=chat_request.message,
+                    model=chat_request.model,
+                    temperature=chat_request.temperature,
+                    use_cache=chat_request.cache,
+                    context=context
+                )
+            if session_id is not None:
+                await _save_exchange(session_id, chat_request, ai_response)
+            return {"index": index, "status": 200, "response": ChatResponse(**ai_response).model_dump()}
+        except HTTPException as e:
+            return {"index": index, "status": e.status_code, "detail": e.detail}
+        except Exception as e:
+            return {"index": index, "status": 500, "detail": str(e)}
+
+    tasks = [asyncio.create_task(answer(index, item)) for index, item in enumerate(items)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield dumps(await finished) + "\n"
+    finally:
+        # Client went away: stop generating answers nobody will read
+        for task in tasks:
+            task.cancel()
+
+
+@router.post("/message/stream")
+async def stream_message(
+    chat_request: ChatRequest,
+    current_user: CurrentUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Send message to AI and stream the response as Server-Sent Events.
+
+    Emits ``delta`` events with incremental text and a final ``done`` event
+    whose data matches ``ChatResponse``.
+    """
+    session_id, context = await _room_context(chat_request, current_user, db)
+    # Nothing below reads the database; release the connection for the length of the stream
+    await db.close()
+
+    async def event_stream():
+        async for event in ai_service.stream_response(
+            message=chat_request.message,
+            model=chat_request.model,
+            temperature=chat_request.temperature,
+            use_cache=chat_request.cache,
+            context=context
+        ):
+            if event["type"] == "delta":
+                data = {"content": event["content"]}
+            else:
+                data = ChatResponse(**event).model_dump()
+                if session_id is not None:
+                    await _save_exchange(session_id, chat_request, event)
+            yield f"event: {event['type']}\ndata: {dumps(data)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
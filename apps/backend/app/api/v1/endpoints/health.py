@@ -1,4 +1,6 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request, Response, status
+from ....services.ai_service import ai_service
+from ....core.rate_limit import rate_limiter
 
 router = APIRouter()
 
@@ -7,3 +9,35 @@ router = APIRouter()
 def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "message": "AI Chatbot API is running"}
+
+
+@router.get("/ready")
+def readiness_check(request: Request, response: Response):
+    """Readiness probe: 503 until startup warmup (database, AI pool) is done, and again while shutting down"""
+    ready = getattr(request.app.state, "ready", False)
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"ready": ready, "warmup_ms": getattr(request.app.state, "warmup_ms", None)}
+
+
+@router.get("/health/cache")
+def cache_stats():
+    """AI completion cache hit/miss counters"""
+    if ai_service.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **ai_service.cache.stats()}
+
+
+@router.get("/health/upstream")
+def upstream_stats():
+    """Upstream AI concurrency limit, plus retries, hedges and circuit state per model"""
+    return {
+        "concurrency": ai_service.limiter.stats(),
+        "models": ai_service.policies.stats()
+    }
+
+
+@router.get("/health/rate-limit")
+def rate_limit_stats():
+    """Allowed/limited request counters of the rate limiter"""
+    return rate_limiter.stats()
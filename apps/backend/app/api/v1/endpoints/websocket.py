@@ -1,135 +1,356 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
-from sqlalchemy.orm import Session
-from typing import Optional
-import json
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
+from sqlalchemy.exc import IntegrityError
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import logging
+import uuid
 from datetime import datetime
 
-from ....db.database import get_db
+from ....db.database import AsyncSessionLocal
 from ....core.websocket_manager import manager
-from ....core.security import verify_token
-from ....crud.user import user as user_crud
-from ....crud.chat import chat_session, chat_message
+from ....services.auth_service import auth_service
+from ....crud.chat import async_chat_session as chat_session
 from ....schemas.chat import ChatMessageCreate
 from ....services.ai_service import ai_service
+from ....services.message_sink import message_sink
+from ....services.context_builder import context_builder
+from ....core.config import settings
+from ....core.rate_limit import rate_limiter, retry_after_header
+from ....core.serialization import decode_frame, negotiate_subprotocol
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+class InvalidFrame(ValueError):
+    """A client frame that is not an encoded object"""
+
+
+async def _receive_message(websocket: WebSocket, protocol: Optional[str]) -> Dict[str, Any]:
+    """Next client message, from a text (JSON) or binary (msgpack) frame"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    data = message.get("bytes")
+    if data is None:
+        data = message.get("text")
+    try:
+        decoded = decode_frame(data, protocol)
+    except Exception as e:
+        raise InvalidFrame("Message is not valid JSON or msgpack") from e
+    if not isinstance(decoded, dict):
+        raise InvalidFrame("Message must be an object")
+    return decoded
+
+
+class TurnQueue:
+    """Chat turns of one connection, answered one at a time by a worker task.
+
+    The receive loop only enqueues turns, so the socket keeps reading pings,
+    follow-ups and cancels while a reply is being generated. Turns run in
+    order because each reply becomes context for the next. ``cancel`` drops
+    queued turns and cancels the running one, which aborts its upstream call.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, Dict[str, Any]], Awaitable[None]],
+        on_cancelled: Callable[[str], Awaitable[None]],
+        max_pending: int = 4
+    ):
+        self.handler = handler
+        self.on_cancelled = on_cancelled
+        self.max_pending = max_pending
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._current: Optional[Tuple[str, asyncio.Task]] = None
+        self._worker = asyncio.create_task(self._run())
+
+    @property
+    def depth(self) -> int:
+        """Turns ahead of a newly submitted one"""
+        return len(self._pending) + (self._current is not None)
+
+    def submit(self, turn_id: str, data: Dict[str, Any]) -> bool:
+        if len(self._pending) >= self.max_pending:
+            return False
+        self._pending[turn_id] = data
+        self._queue.put_nowait(turn_id)
+        return True
+
+    async def cancel(self, turn_id: Optional[str] = None):
+        """Cancel ``turn_id``, or the running turn and everything queued when None"""
+        if turn_id is None:
+            queued = list(self._pending)
+        else:
+            queued = [turn_id] if turn_id in self._pending else []
+        for queued_id in queued:
+            del self._pending[queued_id]
+            await self.on_cancelled(queued_id)
+        if self._current is not None and turn_id in (None, self._current[0]):
+            # on_cancelled follows once the task has unwound, after its last frame
+            self._current[1].cancel()
+
+    async def _run(self):
+        while True:
+            turn_id = await self._queue.get()
+            data = self._pending.pop(turn_id, None)
+            if data is None:
+                continue  # cancelled while queued
+            task = asyncio.create_task(self.handler(turn_id, data))
+            self._current = (turn_id, task)
+            try:
+                await asyncio.wait({task})
+            finally:
+                self._current = None
+                if not task.done():
+                    # The worker itself is going away (disconnect)
+                    task.cancel()
+            if task.cancelled():
+                await self.on_cancelled(turn_id)
+            elif task.exception() is not None:
+                logger.error("Chat turn %s failed", turn_id, exc_info=task.exception())
+
+    async def close(self):
+        """Stop the worker and abandon every queued and running turn"""
+        current = self._current[1] if self._current is not None else None
+        self._pending.clear()
+        self._worker.cancel()
+        if current is not None:
+            current.cancel()
+        await asyncio.gather(self._worker, *([current] if current else []), return_exceptions=True)
 
 
 @router.websocket("/ws/{room_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     room_id: str,
-    token: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    token: Optional[str] = Query(None)
 ):
-    """WebSocket endpoint for real-time chat"""
+    """WebSocket endpoint for real-time chat.
+
+    Clients may request the ``msgpack`` subprotocol for binary frames; the
+    default is JSON text frames.
+
+    Client messages: ``{"message", "id"?, "model"?, "temperature"?, "cache"?,
+    "stream"?}`` queues a chat turn (acknowledged with ``queued``),
+    ``{"type": "cancel", "id"?}`` cancels that turn, or the running one and
+    everything queued, and ``{"type": "ping"}`` is answered with ``pong``.
+    """
     
     # Verify token
     if not token:
         await websocket.close(code=4001, reason="Missing token")
         return
     
-    payload = verify_token(token)
-    if not payload:
-        await websocket.close(code=4001, reason="Invalid token")
-        return
-    
-    user_id = payload.get("sub")
-    if not user_id:
-        await websocket.close(code=4001, reason="Invalid token payload")
-        return
-    
-    # Get user
-    user = user_crud.get(db, id=int(user_id))
-    if not user:
-        await websocket.close(code=4001, reason="User not found")
-        return
-    
-    # Get or create chat session
-    session = chat_session.get_by_room_id(db, room_id=room_id)
-    if not session:
-        session = chat_session.create(db, user_id=user.id, room_id=room_id)
+    # Short-lived DB sessions: never keep a pooled connection checked out while the socket idles
+    async with AsyncSessionLocal() as db:
+        # Resolve user (cached token payload and user snapshot)
+        user = await auth_service.async_get_current_user(db, token)
+        if not user:
+            await websocket.close(code=4001, reason="Invalid token")
+            return
+        
+        # Get or create chat session
+        session = await chat_session.get_by_room_id(db, room_id=room_id)
+        if not session:
+            try:
+                session = await chat_session.create(db, user_id=user.id, room_id=room_id)
+            except IntegrityError:
+                # Another connection created the room first (room_id is unique)
+                await db.rollback()
+                session = await chat_session.get_by_room_id(db, room_id=room_id)
     
     # Connect to room
-    await manager.connect(websocket, room_id)
+    protocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+    await manager.connect(websocket, room_id, subprotocol=protocol)
+
+    async def answer(turn_id: str, message_data: Dict[str, Any]):
+        user_message = message_data.get("message", "")
+        model = message_data.get("model", "mistral-small-latest")
+        temperature = message_data.get("temperature", 0.7)
+        use_cache = message_data.get("cache")
+        
+        # History of the room, read before the new message is queued
+        context = None
+        if settings.AI_CONTEXT_ENABLED:
+            context = await context_builder.build(session.id, model, user_message)
+        
+        # Save user message to database
+        user_msg = ChatMessageCreate(
+            session_id=session.id,
+            content=user_message,
+            sender="user"
+        )
+        await message_sink.submit(user_msg)
+        
+        # Broadcast user message to room
+        await manager.broadcast_to_room({
+            "type": "user",
+            "id": turn_id,
+            "message": user_message,
+            "username": user.username,
+            "timestamp": datetime.utcnow()
+        }, room_id)
+        
+        # Generate AI response
+        stream_id = None
+        try:
+            if message_data.get("stream", False):
+                # Forward tokens as they arrive, then fall through with the assembled reply
+                stream_id = uuid.uuid4().hex
+                ai_response = None
+                async for event in ai_service.stream_response(
+                    message=user_message,
+                    model=model,
+                    temperature=temperature,
+                    use_cache=use_cache,
+                    context=context
+                ):
+                    if event["type"] == "delta":
+                        await manager.broadcast_to_room({
+                            "type": "ai_delta",
+                            "id": turn_id,
+                            "stream_id": stream_id,
+                            "message": event["content"],
+                            "model": model,
+                            "timestamp": datetime.utcnow()
+                        }, room_id)
+                    else:
+                        ai_response = event
+            else:
+                ai_response = await ai_service.generate_response(
+                    message=user_message,
+                    model=model,
+                    temperature=temperature,
+                    use_cache=use_cache,
+                    context=context
+                )
+            
+            # Save AI message to database
+            ai_msg = ChatMessageCreate(
+                session_id=session.id,
+                content=ai_response["response"],
+                sender="ai",
+                model=model,
+                tokens_used=ai_response.get("tokens_used"),
+                response_time_ms=ai_response.get("response_time_ms")
+            )
+            await message_sink.submit(ai_msg)
+            
+            # Broadcast AI response to room
+            ai_frame = {
+                "type": "ai",
+                "id": turn_id,
+                "message": ai_response["response"],
+                "model": model,
+                "timestamp": datetime.utcnow()
+            }
+            if stream_id:
+                ai_frame["stream_id"] = stream_id
+            await manager.broadcast_to_room(ai_frame, room_id)
+            
+        except asyncio.CancelledError:
+            if stream_id:
+                # Other members saw the deltas; tell them this stream ends here
+                await manager.broadcast_to_room({
+                    "type": "ai_cancelled",
+                    "id": turn_id,
+                    "stream_id": stream_id,
+                    "timestamp": datetime.utcnow()
+                }, room_id)
+            raise
+        except Exception as e:
+            await manager.send_personal_message(
+                {
+                    "type": "error",
+                    "id": turn_id,
+                    "message": f"AI error: {str(e)}",
+                    "timestamp": datetime.utcnow()
+                },
+                websocket
+            )
+
+    async def cancelled(turn_id: str):
+        await manager.send_personal_message(
+            {"type": "cancelled", "id": turn_id, "timestamp": datetime.utcnow()},
+            websocket
+        )
+
+    turns = TurnQueue(answer, cancelled, max_pending=settings.WS_MAX_PENDING_MESSAGES)
     
     try:
         # Send welcome message
         await manager.send_personal_message(
-            json.dumps({
+            {
                 "type": "system",
                 "message": f"Connected to room: {room_id}",
-                "timestamp": datetime.utcnow().isoformat()
-            }),
+                "timestamp": datetime.utcnow()
+            },
             websocket
         )
         
         while True:
-            # Receive message from client
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            
-            user_message = message_data.get("message", "")
-            model = message_data.get("model", "mistral-small-latest")
-            temperature = message_data.get("temperature", 0.7)
-            
-            # Save user message to database
-            user_msg = ChatMessageCreate(
-                session_id=session.id,
-                content=user_message,
-                sender="user"
-            )
-            chat_message.create(db, obj_in=user_msg)
-            
-            # Broadcast user message to room
-            await manager.broadcast_to_room({
-                "type": "user",
-                "message": user_message,
-                "username": user.username,
-                "timestamp": datetime.utcnow().isoformat()
-            }, room_id)
-            
-            # Generate AI response
+            # Receive message from client; a bad frame is answered, not fatal
             try:
-                ai_response = await ai_service.generate_response(
-                    message=user_message,
-                    model=model,
-                    temperature=temperature
+                message_data = await _receive_message(websocket, protocol)
+            except InvalidFrame as e:
+                await manager.send_personal_message(
+                    {"type": "error", "message": str(e), "timestamp": datetime.utcnow()},
+                    websocket
                 )
-                
-                # Save AI message to database
-                ai_msg = ChatMessageCreate(
-                    session_id=session.id,
-                    content=ai_response["response"],
-                    sender="ai",
-                    model=model,
-                    tokens_used=ai_response.get("tokens_used"),
-                    response_time_ms=ai_response.get("response_time_ms")
+                continue
+            kind = message_data.get("type", "message")
+            
+            if kind == "ping":
+                await manager.send_personal_message({"type": "pong", "timestamp": datetime.utcnow()}, websocket)
+                continue
+            if kind == "cancel":
+                turn_id = message_data.get("id")
+                await turns.cancel(str(turn_id) if turn_id is not None else None)
+                continue
+            
+            # Same token bucket as the user's HTTP requests
+            limit = await rate_limiter.check(f"user:{user.id}", scope="ws")
+            if not limit.allowed:
+                await manager.send_personal_message(
+                    {
+                        "type": "error",
+                        "message": "Rate limit exceeded, slow down",
+                        "retry_after": int(retry_after_header(limit.retry_after)),
+                        "timestamp": datetime.utcnow()
+                    },
+                    websocket
                 )
-                chat_message.create(db, obj_in=ai_msg)
-                
-                # Broadcast AI response to room
-                await manager.broadcast_to_room({
-                    "type": "ai",
-                    "message": ai_response["response"],
-                    "model": model,
-                    "timestamp": datetime.utcnow().isoformat()
-                }, room_id)
-                
-            except Exception as e:
+                continue
+            
+            turn_id = str(message_data.get("id") or uuid.uuid4().hex)
+            ahead = turns.depth
+            if not turns.submit(turn_id, message_data):
                 await manager.send_personal_message(
-                    json.dumps({
+                    {
                         "type": "error",
-                        "message": f"AI error: {str(e)}",
-                        "timestamp": datetime.utcnow().isoformat()
-                    }),
+                        "id": turn_id,
+                        "message": "Too many messages waiting for a reply",
+                        "timestamp": datetime.utcnow()
+                    },
                     websocket
                 )
+                continue
+            await manager.send_personal_message(
+                {"type": "queued", "id": turn_id, "ahead": ahead, "timestamp": datetime.utcnow()},
+                websocket
+            )
     
     except WebSocketDisconnect:
-        manager.disconnect(websocket, room_id)
+        pass
+    finally:
+        # Nobody is left to read these replies: free their upstream slots now
+        await turns.close()
+        # Whatever ended the loop, release the connection's writer and room subscription
+        await manager.disconnect(websocket, room_id)
         await manager.broadcast_to_room({
             "type": "system",
             "message": f"User {user.username} left the room",
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": datetime.utcnow()
         }, room_id)
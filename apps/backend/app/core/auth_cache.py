@@ -0,0 +1,121 @@
+import threading
+import time
+from typing import Any, Dict, Optional
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from .cache import LRUCache
+from .config import settings
+from .security import verify_token
+from ..models.user import User
+from ..schemas.user import CurrentUser
+
+
+class AuthCache:
+    """Bounded TTL caches for verified token payloads and user snapshots.
+
+    Entries are process-local, so a change made on another worker becomes
+    visible here after at most ``user_ttl`` seconds; changes made through this
+    process' ORM are invalidated immediately.
+    """
+
+    def __init__(self, token_ttl: float, user_ttl: float, max_entries: int):
+        self.token_ttl = token_ttl
+        self.user_ttl = user_ttl
+        self._lock = threading.Lock()
+        self._tokens = LRUCache(max_entries=max_entries, ttl=token_ttl)
+        self._users = LRUCache(max_entries=max_entries, ttl=user_ttl)
+        self.token_hits = 0
+        self.token_misses = 0
+        self.user_hits = 0
+        self.user_misses = 0
+
+    def verify_token(self, token: str) -> Optional[Dict[str, Any]]:
+        """Verify a JWT, reusing the decoded payload of recently seen tokens."""
+        with self._lock:
+            payload = self._tokens.get(token)
+        if payload is not None:
+            self.token_hits += 1
+            return payload
+
+        self.token_misses += 1
+        payload = verify_token(token)
+        if payload:
+            # Never keep a token cached past its own expiry
+            ttl = self.token_ttl
+            if "exp" in payload:
+                ttl = min(ttl, payload["exp"] - time.time())
+            if ttl > 0:
+                with self._lock:
+                    self._tokens.set(token, payload, ttl=ttl)
+        return payload
+
+    def get_user(self, user_id: int) -> Optional[CurrentUser]:
+        with self._lock:
+            snapshot = self._users.get(user_id)
+        if snapshot is None:
+            self.user_misses += 1
+        else:
+            self.user_hits += 1
+        return snapshot
+
+    def set_user(self, user: User) -> CurrentUser:
+        snapshot = CurrentUser.model_validate(user)
+        with self._lock:
+            self._users.set(snapshot.id, snapshot)
+        return snapshot
+
+    def invalidate_user(self, user_id: int):
+        """Drop the cached snapshot of a user (call when a user is updated or deactivated)."""
+        with self._lock:
+            self._users.delete(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "token_hits": self.token_hits,
+            "token_misses": self.token_misses,
+            "user_hits": self.user_hits,
+            "user_misses": self.user_misses
+        }
+
+
+auth_cache = AuthCache(
+    token_ttl=settings.AUTH_TOKEN_CACHE_TTL,
+    user_ttl=settings.AUTH_USER_CACHE_TTL,
+    max_entries=settings.AUTH_CACHE_MAX_ENTRIES
+)
+
+
+def invalidate_user(user_id: int):
+    auth_cache.invalidate_user(user_id)
+
+
+# Mapper events fire during flush, before the change is visible to other
+# connections. Remember the ids on the session and only invalidate once the
+# transaction commits, otherwise a concurrent miss could re-cache the old row.
+_PENDING_KEY = "auth_cache_invalidate_user_ids"
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _collect_changed_user(mapper, connection, target: User):
+    session = object_session(target)
+    if session is None:
+        invalidate_user(target.id)
+        return
+    session.info.setdefault(_PENDING_KEY, set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session: Session):
+    for user_id in session.info.pop(_PENDING_KEY, ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back_users(session: Session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
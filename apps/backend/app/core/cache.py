@@ -0,0 +1,203 @@
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+from .serialization import dumps_bytes, loads
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """In-process LRU cache bounded by entry count and total size, with per-entry TTL."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.current_bytes = 0
+        # {key: (value, expires_at, size)}
+        self._data: "OrderedDict[Hashable, Tuple[Any, Optional[float], int]]" = OrderedDict()
+
+    @staticmethod
+    def _sizeof(value: Any) -> int:
+        if isinstance(value, (bytes, bytearray, str)):
+            return len(value)
+        return sys.getsizeof(value)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at, _ = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.delete(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        size = self._sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Never cache something that would evict the whole cache
+            self.delete(key)
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        self.delete(key)
+        self._data[key] = (value, expires_at, size)
+        self.current_bytes += size
+        self._evict()
+
+    def delete(self, key: Hashable) -> bool:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return False
+        self.current_bytes -= entry[2]
+        return True
+
+    def clear(self):
+        self._data.clear()
+        self.current_bytes = 0
+
+    def _evict(self):
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self.current_bytes > self.max_bytes)
+        ):
+            _, (_, _, size) = self._data.popitem(last=False)
+            self.current_bytes -= size
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+
+class MemoryCacheBackend:
+    """Async cache backend storing encoded values in a process-local LRUCache"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None):
+        self._cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        self._cache.set(key, value, ttl=ttl)
+
+    async def delete(self, key: str):
+        self._cache.delete(key)
+
+    async def close(self):
+        self._cache.clear()
+
+
+class RedisCacheBackend:
+    """Shared cache backend on Redis that degrades to an in-memory cache when Redis is unavailable"""
+
+    name = "redis"
+
+    def __init__(self, url: str, fallback: MemoryCacheBackend):
+        import redis.asyncio as aioredis
+
+        self._redis = aioredis.from_url(url)
+        self._errors = (aioredis.RedisError, OSError)
+        self.fallback = fallback
+        self.degraded = False
+
+    def _mark_degraded(self, error: Exception):
+        if not self.degraded:
+            logger.warning("Redis cache unavailable, using in-memory fallback: %s", error)
+        self.degraded = True
+
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            value = await self._redis.get(key)
+        except self._errors as e:
+            self._mark_degraded(e)
+            return await self.fallback.get(key)
+        self.degraded = False
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        try:
+            await self._redis.set(key, value, px=int(ttl * 1000) if ttl else None)
+        except self._errors as e:
+            self._mark_degraded(e)
+            await self.fallback.set(key, value, ttl=ttl)
+
+    async def delete(self, key: str):
+        try:
+            await self._redis.delete(key)
+        except self._errors as e:
+            self._mark_degraded(e)
+        await self.fallback.delete(key)
+
+    async def close(self):
+        await self._redis.aclose()
+        await self.fallback.close()
+
+
+def create_cache_backend(
+    backend: str,
+    redis_url: Optional[str] = None,
+    max_entries: int = 1024,
+    max_bytes: Optional[int] = None
+):
+    """Build a cache backend by name ("memory" or "redis")"""
+    memory = MemoryCacheBackend(max_entries=max_entries, max_bytes=max_bytes)
+    if backend == "redis":
+        try:
+            return RedisCacheBackend(redis_url, fallback=memory)
+        except ImportError:
+            logger.warning("The 'redis' package is not installed, using the in-memory cache")
+    return memory
+
+
+class ResponseCache:
+    """JSON response cache on top of a pluggable backend, with hit/miss counters"""
+
+    def __init__(self, backend, ttl: Optional[float] = None, prefix: str = ""):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = await self.backend.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return loads(raw)
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        await self.backend.set(self.prefix + key, dumps_bytes(value), ttl=self.ttl)
+        self.stores += 1
+
+    async def close(self):
+        await self.backend.close()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "degraded": getattr(self.backend, "degraded", False),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,161 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+
+class LimiterOverloaded(Exception):
+    """Raised when a request is shed: the wait queue is full or its deadline passed"""
+
+
+class _Slot:
+    __slots__ = ("limiter", "started", "latency")
+
+    def __init__(self, limiter: "AIMDLimiter"):
+        self.limiter = limiter
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+
+    def mark_first_byte(self):
+        """Measure latency up to now (e.g. response headers of a stream) instead of up to release"""
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+    def finish(self, exc: Optional[BaseException] = None):
+        latency = self.latency if self.latency is not None else time.monotonic() - self.started
+        if exc is None:
+            self.limiter.release(latency, overloaded=False)
+        elif not isinstance(exc, Exception):
+            # Cancelled or closed by the caller: says nothing about the upstream
+            self.limiter.release(latency, overloaded=None)
+        else:
+            self.limiter.release(latency, overloaded=self.limiter.is_overload(exc))
+
+
+class AIMDLimiter:
+    """Adaptive concurrency limit: additive increase, multiplicative decrease.
+
+    Every success faster than ``latency_target`` grows the limit by
+    ``1 / limit``, i.e. by one slot per window of successful calls. A call that
+    ``is_overload`` classifies as a sign of upstream distress (timeouts, 429,
+    5xx) multiplies the limit by ``backoff``, at most once per ``cooldown`` so
+    one burst of failures counts as a single signal.
+
+    Callers beyond the limit wait in a FIFO queue of at most ``max_queue``
+    entries for up to ``queue_timeout`` seconds; anything more is rejected
+    immediately with ``LimiterOverloaded``.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 16,
+        min_limit: int = 1,
+        max_limit: int = 100,
+        latency_target: float = 5.0,
+        backoff: float = 0.5,
+        cooldown: float = 1.0,
+        max_queue: int = 100,
+        queue_timeout: float = 5.0,
+        is_overload: Callable[[BaseException], bool] = lambda exc: isinstance(exc, asyncio.TimeoutError)
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.is_overload = is_overload
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        self.shed = 0
+        self.queue_timeouts = 0
+        self.decreases = 0
+
+    @property
+    def capacity(self) -> int:
+        return max(self.min_limit, int(math.floor(self.limit)))
+
+    def slot(self, timeout: Optional[float] = None) -> "_Acquire":
+        """``async with limiter.slot() as slot:`` runs the block within the limit"""
+        return _Acquire(self, timeout)
+
+    async def acquire(self, timeout: Optional[float] = None) -> _Slot:
+        if self.in_flight < self.capacity and not self._waiters:
+            self.in_flight += 1
+            return _Slot(self)
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            raise LimiterOverloaded("upstream concurrency queue is full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        timeout = self.queue_timeout if timeout is None else timeout
+        try:
+            # asyncio.wait rather than wait_for: a slot granted at the deadline must not leak
+            await asyncio.wait({waiter}, timeout=timeout)
+        except asyncio.CancelledError:
+            if waiter.done():
+                # Granted while we were being cancelled: hand the slot back
+                self._release_slot()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+
+        if not waiter.done():
+            waiter.cancel()
+            self._waiters.remove(waiter)
+            self.queue_timeouts += 1
+            raise LimiterOverloaded("timed out waiting for upstream capacity")
+        return _Slot(self)
+
+    def release(self, latency: float, overloaded: Optional[bool]):
+        """Return a slot and adapt the limit (``overloaded=None`` leaves it unchanged)"""
+        if overloaded:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                self._last_decrease = now
+                self.decreases += 1
+        elif overloaded is False and latency <= self.latency_target:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        self._release_slot()
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.capacity:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "shed": self.shed,
+            "queue_timeouts": self.queue_timeouts,
+            "decreases": self.decreases
+        }
+
+
+class _Acquire:
+    __slots__ = ("limiter", "timeout", "slot")
+
+    def __init__(self, limiter: AIMDLimiter, timeout: Optional[float]):
+        self.limiter = limiter
+        self.timeout = timeout
+        self.slot: Optional[_Slot] = None
+
+    async def __aenter__(self) -> _Slot:
+        self.slot = await self.limiter.acquire(self.timeout)
+        return self.slot
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.slot.finish(exc)
+        return False
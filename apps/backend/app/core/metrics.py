@@ -0,0 +1,290 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Seconds; covers sub-millisecond cache hits up to the 30s upstream timeout
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """Gauge read from ``callback`` at scrape time, so it is never out of date"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name} {_format_value(self.callback())}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # {labels: [per-bucket counts (+Inf last), sum, count]}
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels: str) -> int:
+        series = self._values.get(self._key(labels))
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Minimal Prometheus text-format registry (no client library dependency)"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, documentation, callback))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Upstream AI provider
+upstream_request_duration = registry.histogram(
+    "ai_upstream_request_duration_seconds",
+    "Duration of upstream completion attempts",
+    labels=("model", "status")
+)
+upstream_tokens = registry.counter(
+    "ai_upstream_tokens_total",
+    "Tokens reported by the upstream provider",
+    labels=("model",)
+)
+
+# Database
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds",
+    "Duration of SQL statements",
+    labels=("operation",)
+)
+db_commit_duration = registry.histogram(
+    "db_commit_duration_seconds",
+    "Duration of database commits"
+)
+
+# WebSockets (connection and room gauges are registered by ConnectionManager)
+ws_broadcast_fanout = registry.histogram(
+    "ws_broadcast_fanout",
+    "Local sockets a room message was delivered to",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 1000)
+)
+ws_send_duration = registry.histogram(
+    "ws_send_duration_seconds",
+    "Time from enqueueing a frame to the socket accepting it"
+)
+ws_dropped_messages = registry.counter(
+    "ws_dropped_messages_total",
+    "Frames dropped from full per-connection send queues"
+)
+ws_evicted_connections = registry.counter(
+    "ws_evicted_connections_total",
+    "Slow or broken sockets disconnected by the server"
+)
+
+# HTTP
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Duration of HTTP requests",
+    labels=("method", "route", "status")
+)
+
+
+def _statement_operation(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "other"
+    return word if word in ("select", "insert", "update", "delete", "copy") else "other"
+
+
+def instrument_engine(engine: Engine):
+    """Time statements and commits of ``engine`` (pass ``async_engine.sync_engine`` for async engines)"""
+    if getattr(engine, "_metrics_instrumented", False):
+        return
+    engine._metrics_instrumented = True
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        db_query_duration.observe(time.perf_counter() - started, operation=_statement_operation(statement))
+
+    @event.listens_for(engine, "commit")
+    def _commit(conn):
+        conn.info["commit_started"] = time.perf_counter()
+
+    # There is no after-commit event: a commit has finished by the time its
+    # connection begins again, is returned to the pool, or reports the failure
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        _commit_finished(conn.info)
+
+    @event.listens_for(engine, "reset")
+    def _reset(dbapi_connection, connection_record, reset_state):
+        _commit_finished(connection_record.info)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        conn = context.connection
+        if conn is None:
+            return
+        # A failed statement never reaches after_cursor_execute
+        if context.statement is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+        _commit_finished(conn.info)
+
+
+def _commit_finished(info: dict):
+    started = info.pop("commit_started", None)
+    if started is not None:
+        db_commit_duration.observe(time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording HTTP latency by route template (not raw path)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status["code"])
+            )
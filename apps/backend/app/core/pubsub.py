@@ -0,0 +1,179 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Called with (room_id, payload) for every message published to a subscribed room
+MessageHandler = Callable[[str, str], Awaitable[None]]
+
+
+class InMemoryBroker:
+    """Process-local message bus shared by ``InMemoryPubSub`` instances"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set["InMemoryPubSub"]] = {}
+
+    def subscribe(self, room_id: str, pubsub: "InMemoryPubSub"):
+        self._subscribers.setdefault(room_id, set()).add(pubsub)
+
+    def unsubscribe(self, room_id: str, pubsub: "InMemoryPubSub"):
+        subscribers = self._subscribers.get(room_id)
+        if subscribers is None:
+            return
+        subscribers.discard(pubsub)
+        if not subscribers:
+            del self._subscribers[room_id]
+
+    async def publish(self, room_id: str, payload: str) -> int:
+        subscribers = list(self._subscribers.get(room_id, ()))
+        for pubsub in subscribers:
+            await pubsub.handler(room_id, payload)
+        return len(subscribers)
+
+
+default_broker = InMemoryBroker()
+
+
+class InMemoryPubSub:
+    """Pub/sub backend for a single process (single-node deployments and tests)"""
+
+    name = "memory"
+
+    def __init__(self, handler: MessageHandler, broker: Optional[InMemoryBroker] = None):
+        self.handler = handler
+        self.broker = broker if broker is not None else default_broker
+        self.published = 0
+
+    async def subscribe(self, room_id: str):
+        self.broker.subscribe(room_id, self)
+
+    async def unsubscribe(self, room_id: str):
+        self.broker.unsubscribe(room_id, self)
+
+    async def publish(self, room_id: str, payload: str):
+        self.published += 1
+        await self.broker.publish(room_id, payload)
+
+    async def close(self):
+        for room_id in list(self.broker._subscribers):
+            self.broker.unsubscribe(room_id, self)
+
+
+class RedisPubSub:
+    """Pub/sub backend on Redis channels, one channel per room.
+
+    A single reader task per process receives messages for every room that
+    has local sockets and hands them to ``handler``. If Redis is unreachable,
+    published messages are still delivered to local sockets.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, handler: MessageHandler, channel_prefix: str = "ws:room:"):
+        import redis.asyncio as aioredis
+
+        self._redis = aioredis.from_url(url)
+        self._errors = (aioredis.RedisError, OSError)
+        self.handler = handler
+        self.channel_prefix = channel_prefix
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._rooms: Set[str] = set()
+        self._reader: Optional[asyncio.Task] = None
+        self.published = 0
+        self.degraded = False
+
+    def _channel(self, room_id: str) -> str:
+        return self.channel_prefix + room_id
+
+    def _mark_degraded(self, error: Exception):
+        if not self.degraded:
+            logger.warning("Redis pub/sub unavailable, delivering to local sockets only: %s", error)
+        self.degraded = True
+
+    async def subscribe(self, room_id: str):
+        self._rooms.add(room_id)
+        try:
+            await self._pubsub.subscribe(self._channel(room_id))
+        except self._errors as e:
+            self._mark_degraded(e)
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read())
+
+    async def unsubscribe(self, room_id: str):
+        self._rooms.discard(room_id)
+        try:
+            await self._pubsub.unsubscribe(self._channel(room_id))
+        except self._errors as e:
+            self._mark_degraded(e)
+
+    async def publish(self, room_id: str, payload: str):
+        self.published += 1
+        try:
+            await self._redis.publish(self._channel(room_id), payload)
+        except self._errors as e:
+            self._mark_degraded(e)
+            if room_id in self._rooms:
+                await self.handler(room_id, payload)
+            return
+        self.degraded = False
+
+    async def _read(self):
+        prefix_length = len(self.channel_prefix)
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    if not self._rooms:
+                        await asyncio.sleep(0.1)
+                        continue
+                    # Reconnected after an outage: restore the local rooms' subscriptions
+                    await self._pubsub.subscribe(*(self._channel(room) for room in self._rooms))
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except self._errors as e:
+                self._mark_degraded(e)
+                await asyncio.sleep(1.0)
+                continue
+
+            if message is None or message.get("type") != "message":
+                continue
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            data = message["data"]
+            if isinstance(data, bytes):
+                data = data.decode("utf-8")
+            try:
+                await self.handler(channel[prefix_length:], data)
+            except Exception:
+                logger.exception("Failed to deliver pub/sub message for %s", channel)
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+        try:
+            await self._pubsub.aclose()
+            await self._redis.aclose()
+        except self._errors:
+            pass
+
+
+def create_pubsub(
+    backend: str,
+    handler: MessageHandler,
+    redis_url: Optional[str] = None,
+    broker: Optional[InMemoryBroker] = None
+):
+    """Build a pub/sub backend by name ("memory" or "redis")"""
+    if backend == "redis":
+        try:
+            return RedisPubSub(redis_url, handler)
+        except ImportError:
+            logger.warning("The 'redis' package is not installed, using in-process pub/sub")
+    return InMemoryPubSub(handler, broker=broker)
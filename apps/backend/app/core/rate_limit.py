@@ -0,0 +1,218 @@
+import json
+import logging
+import math
+import time
+from typing import Any, Dict, NamedTuple, Optional
+from .cache import LRUCache
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Paths that are never limited: load balancer probes, metrics scrapes and API docs
+EXEMPT_PATH_PREFIXES = ("/api/v1/health", "/api/v1/ready", "/api/v1/metrics", "/docs", "/redoc", "/api/v1/openapi.json")
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: float
+
+
+class MemoryRateLimitBackend:
+    """Token buckets kept in process memory (one bucket set per worker)"""
+
+    name = "memory"
+
+    def __init__(self, max_keys: int = 100000):
+        # {key: (tokens, updated_at)}; idle buckets are full again, so evicting them is harmless
+        self._buckets = LRUCache(max_entries=max_keys)
+
+    async def acquire(self, key: str, capacity: int, refill_rate: float, cost: int = 1) -> RateLimitResult:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key) or (float(capacity), now)
+        tokens = min(float(capacity), tokens + (now - updated_at) * refill_rate)
+
+        if tokens >= cost:
+            tokens -= cost
+            self._buckets.set(key, (tokens, now))
+            return RateLimitResult(True, int(tokens), 0.0)
+
+        self._buckets.set(key, (tokens, now))
+        return RateLimitResult(False, 0, (cost - tokens) / refill_rate)
+
+    async def close(self):
+        self._buckets.clear()
+
+
+# KEYS[1] bucket key; ARGV: capacity, refill rate (tokens/s), cost
+# Uses the Redis server clock so every worker agrees on elapsed time.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisRateLimitBackend:
+    """Token buckets shared by every worker, updated atomically by a Lua script.
+
+    Falls back to per-process buckets while Redis is unreachable, so an outage
+    loosens the limit instead of rejecting every request.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, fallback: MemoryRateLimitBackend, prefix: str = "ratelimit:"):
+        import redis.asyncio as aioredis
+
+        self._redis = aioredis.from_url(url)
+        self._errors = (aioredis.RedisError, OSError)
+        self._script = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.fallback = fallback
+        self.prefix = prefix
+        self.degraded = False
+
+    async def acquire(self, key: str, capacity: int, refill_rate: float, cost: int = 1) -> RateLimitResult:
+        try:
+            allowed, tokens = await self._script(keys=[self.prefix + key], args=[capacity, refill_rate, cost])
+        except self._errors as e:
+            if not self.degraded:
+                logger.warning("Redis rate limiter unavailable, using per-process buckets: %s", e)
+            self.degraded = True
+            return await self.fallback.acquire(key, capacity, refill_rate, cost)
+
+        self.degraded = False
+        tokens = float(tokens)
+        if allowed:
+            return RateLimitResult(True, int(tokens), 0.0)
+        return RateLimitResult(False, 0, (cost - tokens) / refill_rate)
+
+    async def close(self):
+        await self._redis.aclose()
+        await self.fallback.close()
+
+
+def create_rate_limit_backend(backend: str, redis_url: Optional[str] = None):
+    """Build a rate limit backend by name ("memory" or "redis")"""
+    memory = MemoryRateLimitBackend()
+    if backend == "redis":
+        try:
+            return RedisRateLimitBackend(redis_url, fallback=memory)
+        except ImportError:
+            logger.warning("The 'redis' package is not installed, using in-memory rate limiting")
+    return memory
+
+
+class RateLimiter:
+    """Token-bucket limiter: ``requests`` per ``window`` seconds, refilled continuously"""
+
+    def __init__(self, backend, requests: int, window: float, enabled: bool = True):
+        self.backend = backend
+        self.capacity = requests
+        self.refill_rate = requests / window
+        self.enabled = enabled
+        self.allowed: Dict[str, int] = {}
+        self.limited: Dict[str, int] = {}
+
+    async def check(self, key: str, scope: str = "http") -> RateLimitResult:
+        """Take one token from the bucket of ``key`` (e.g. ``user:42`` or ``ip:10.0.0.1``)"""
+        if not self.enabled:
+            return RateLimitResult(True, self.capacity, 0.0)
+
+        result = await self.backend.acquire(key, self.capacity, self.refill_rate)
+        counters = self.allowed if result.allowed else self.limited
+        counters[scope] = counters.get(scope, 0) + 1
+        return result
+
+    async def close(self):
+        await self.backend.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend.name,
+            "degraded": getattr(self.backend, "degraded", False),
+            "requests": self.capacity,
+            "refill_per_second": round(self.refill_rate, 4),
+            "allowed": dict(self.allowed),
+            "limited": dict(self.limited)
+        }
+
+
+def retry_after_header(retry_after: float) -> str:
+    return str(max(1, math.ceil(retry_after)))
+
+
+class RateLimitMiddleware:
+    """ASGI middleware enforcing the limiter on HTTP requests.
+
+    Requests with a valid bearer token draw from their user's bucket, so
+    users behind one NAT don't throttle each other; anonymous requests draw
+    from their client IP's bucket. Rejected requests get ``429`` with
+    ``Retry-After``.
+    """
+
+    def __init__(self, app, limiter: RateLimiter, token_verifier=None):
+        self.app = app
+        self.limiter = limiter
+        # Returns the JWT payload for a bearer token, or None
+        self.token_verifier = token_verifier
+
+    def _key(self, scope) -> str:
+        if self.token_verifier is not None:
+            for name, value in scope.get("headers", ()):
+                if name == b"authorization":
+                    scheme, _, token = value.decode("latin-1").partition(" ")
+                    if scheme.lower() == "bearer" and token:
+                        payload = self.token_verifier(token)
+                        if payload and payload.get("sub"):
+                            return f"user:{payload['sub']}"
+                    break
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.limiter.enabled or scope["path"].startswith(EXEMPT_PATH_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        result = await self.limiter.check(self._key(scope), scope="http")
+        if result.allowed:
+            await self.app(scope, receive, send)
+            return
+
+        body = json.dumps({"detail": "Too many requests"}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", retry_after_header(result.retry_after).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+rate_limiter = RateLimiter(
+    create_rate_limit_backend(settings.RATE_LIMIT_BACKEND, redis_url=settings.REDIS_URL),
+    requests=settings.RATE_LIMIT_REQUESTS,
+    window=settings.RATE_LIMIT_WINDOW,
+    enabled=settings.RATE_LIMIT_ENABLED
+)
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# classify(exc) -> (transient, retry_after): transient errors are retried and count
+# against the circuit breaker; retry_after is the server's requested delay, if any
+Classifier = Callable[[BaseException], Tuple[bool, Optional[float]]]
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After ``failure_threshold`` transient failures in a row the circuit opens
+    and calls fail immediately for ``reset_timeout`` seconds. Then a single
+    trial call is let through (half-open): success closes the circuit, failure
+    opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self.rejected = 0
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError("upstream circuit is open")
+
+    def record_success(self):
+        self.failures = 0
+        self._trial_in_flight = False
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning("Upstream circuit opened after %s consecutive failures", self.failures)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def record_neutral(self):
+        """The call ended without telling us anything (cancelled, 4xx): free the trial slot"""
+        self._trial_in_flight = False
+
+
+class LatencyWindow:
+    """Recent successful latencies, for percentile-based hedging delays"""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self._samples) < 20:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def _cancel(task: asyncio.Future):
+    if not task.done():
+        task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+
+
+class UpstreamPolicy:
+    """Retries, hedging and circuit breaking for the calls to one model.
+
+    ``call`` retries transient failures with full-jitter exponential backoff
+    (or the server's ``Retry-After``) as long as the next attempt can start
+    before ``deadline`` seconds have passed since the first one. With
+    ``hedge`` enabled, an attempt still running after the ``hedge_percentile``
+    latency of recent calls gets a second identical request; whichever
+    succeeds first wins and the other is cancelled.
+    """
+
+    def __init__(
+        self,
+        classify: Classifier,
+        max_attempts: int = 3,
+        base_delay: float = 0.2,
+        max_delay: float = 2.0,
+        deadline: float = 30.0,
+        hedge: bool = False,
+        hedge_percentile: float = 0.95,
+        hedge_min_delay: float = 0.5,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0
+    ):
+        self.classify = classify
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latencies = LatencyWindow()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def backoff(self, attempt: int) -> float:
+        """Full jitter: uniform in [0, min(max_delay, base_delay * 2**attempt)]"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def retry_delay(self, exc: BaseException, attempt: int, started: float) -> Optional[float]:
+        """Seconds to wait before retrying after ``exc``, or None when we should give up"""
+        transient, retry_after = self.classify(exc)
+        if not transient or attempt + 1 >= self.max_attempts:
+            return None
+        delay = retry_after if retry_after is not None else self.backoff(attempt)
+        if time.monotonic() + delay >= started + self.deadline:
+            return None
+        return delay
+
+    def record(self, exc: Optional[BaseException], latency: Optional[float] = None):
+        """Feed the outcome of one attempt to the breaker and latency window"""
+        if exc is None:
+            self.breaker.record_success()
+            if latency is not None:
+                self.latencies.observe(latency)
+        elif isinstance(exc, Exception) and self.classify(exc)[0]:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_neutral()
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        p = self.latencies.percentile(self.hedge_percentile)
+        return None if p is None else max(p, self.hedge_min_delay)
+
+    async def call(self, attempt: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.monotonic()
+        for n in range(self.max_attempts):
+            self.breaker.allow()
+            attempt_started = time.monotonic()
+            try:
+                result = await self._attempt(attempt, started + self.deadline)
+            except Exception as exc:
+                self.record(exc)
+                delay = self.retry_delay(exc, n, started)
+                if delay is None:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException as exc:
+                self.record(exc)
+                raise
+            self.record(None, time.monotonic() - attempt_started)
+            return result
+
+    async def _attempt(self, attempt: Callable[[], Awaitable[Any]], deadline: float) -> Any:
+        """One attempt, possibly hedged, bounded by the overall deadline"""
+        tasks = [asyncio.ensure_future(attempt())]
+        try:
+            hedge_delay = self.hedge_delay()
+            if hedge_delay is not None and time.monotonic() + hedge_delay < deadline:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    self.hedges += 1
+                    tasks.append(asyncio.ensure_future(attempt()))
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise asyncio.TimeoutError("upstream deadline exceeded")
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError("upstream deadline exceeded")
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1 and task is tasks[1]:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                await _cancel(task)
+
+    def stats(self) -> Dict[str, Any]:
+        p = self.latencies.percentile(self.hedge_percentile)
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "rejected_while_open": self.breaker.rejected,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency_p%d_ms" % int(self.hedge_percentile * 100): None if p is None else int(p * 1000)
+        }
+
+
+class UpstreamPolicies:
+    """One ``UpstreamPolicy`` per model: shared defaults plus per-model overrides"""
+
+    def __init__(self, classify: Classifier, defaults: Dict[str, Any], overrides: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.classify = classify
+        self.defaults = defaults
+        self.overrides = overrides or {}
+        self._policies: Dict[str, UpstreamPolicy] = {}
+
+    def for_model(self, model: str) -> UpstreamPolicy:
+        policy = self._policies.get(model)
+        if policy is None:
+            options = {**self.defaults, **self.overrides.get(model, {})}
+            policy = self._policies[model] = UpstreamPolicy(self.classify, **options)
+        return policy
+
+    def stats(self) -> Dict[str, Any]:
+        return {model: policy.stats() for model, policy in self._policies.items()}
@@ -1,18 +1,29 @@
+import asyncio
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from typing import Optional
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
 # Configure password hashing context with bcrypt
 pwd_context = CryptContext(
     schemes=["bcrypt"],
     deprecated="auto",
-    bcrypt__rounds=12,
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
     bcrypt__ident="2b"
 )
 
 
+class PasswordHasherBusy(Exception):
+    """Raised when too many password hash operations are already queued"""
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash."""
     try:
@@ -30,6 +41,101 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    """Whether a stored hash uses different parameters than the current context."""
+    try:
+        return pwd_context.needs_update(hashed_password)
+    except Exception:
+        return False
+
+
+class PasswordHashPool:
+    """Bounded worker pool running bcrypt off the event loop.
+
+    bcrypt releases the GIL while hashing, so a small thread pool gives real
+    parallelism. At most ``max_pending`` operations may be running or queued;
+    further requests are rejected with ``PasswordHasherBusy`` instead of piling up.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+password_hash_pool = PasswordHashPool(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING
+)
+
+
+async def async_verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password on the hashing pool."""
+    return await password_hash_pool.run(verify_password, plain_password, hashed_password)
+
+
+async def async_get_password_hash(password: str) -> str:
+    """Hash a password on the hashing pool."""
+    return await password_hash_pool.run(get_password_hash, password)
+
+
+def calibrate_bcrypt_rounds(
+    target_ms: float,
+    min_rounds: int = 10,
+    max_rounds: int = 14
+) -> int:
+    """Pick the bcrypt cost whose hash time is closest to ``target_ms`` on this machine.
+
+    Each extra round doubles the work, so a single timing at ``min_rounds`` is
+    enough to extrapolate.
+    """
+    sample = CryptContext(schemes=["bcrypt"], bcrypt__rounds=min_rounds, bcrypt__ident="2b")
+    start = time.perf_counter()
+    sample.hash("calibration-password")
+    elapsed_ms = max((time.perf_counter() - start) * 1000, 0.001)
+
+    rounds = min_rounds + round(math.log2(target_ms / elapsed_ms))
+    return max(min_rounds, min(max_rounds, rounds))
+
+
+async def calibrate_password_hashing():
+    """Apply startup-time cost calibration when BCRYPT_TARGET_MS is set."""
+    if settings.BCRYPT_TARGET_MS <= 0:
+        return
+    rounds = await password_hash_pool.run(
+        calibrate_bcrypt_rounds,
+        settings.BCRYPT_TARGET_MS,
+        settings.BCRYPT_MIN_ROUNDS,
+        settings.BCRYPT_MAX_ROUNDS
+    )
+    pwd_context.update(bcrypt__rounds=rounds)
+    logger.info("bcrypt cost calibrated to %s rounds (target %sms)", rounds, settings.BCRYPT_TARGET_MS)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create JWT access token."""
     to_encode = data.copy()
@@ -0,0 +1,122 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Optional, Union
+from uuid import UUID
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# WebSocket subprotocols; clients that ask for none get JSON text frames
+JSON_SUBPROTOCOL = "json"
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+Encoded = Union[str, bytes]
+
+
+def _default(obj: Any) -> Any:
+    """Types neither encoder handles natively"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (UUID, Decimal)):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode("utf-8")
+
+    loads = orjson.loads
+else:  # pragma: no cover
+    def dumps_bytes(obj: Any) -> bytes:
+        return dumps(obj).encode("utf-8")
+
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False)
+
+    loads = json.loads
+
+
+def packb(obj: Any) -> bytes:
+    return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+
+def unpackb(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+def available_subprotocols() -> tuple:
+    if msgpack is None:
+        return (JSON_SUBPROTOCOL,)
+    return (MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL)
+
+
+def negotiate_subprotocol(requested: Iterable[str]) -> Optional[str]:
+    """First subprotocol offered by the client that we speak, in the client's order"""
+    supported = available_subprotocols()
+    for protocol in requested:
+        if protocol in supported:
+            return protocol
+    return None
+
+
+def encode_frame(message: Any, protocol: Optional[str]) -> Encoded:
+    """One WebSocket frame: bytes for msgpack, text otherwise"""
+    if protocol == MSGPACK_SUBPROTOCOL:
+        return packb(message)
+    return dumps(message)
+
+
+def decode_frame(data: Encoded, protocol: Optional[str]) -> Any:
+    if protocol == MSGPACK_SUBPROTOCOL and isinstance(data, (bytes, bytearray)):
+        return unpackb(data)
+    return loads(data)
+
+
+class SharedFrame:
+    """A room message encoded at most once per protocol, however many sockets receive it.
+
+    Created from the JSON text that travels over pub/sub; the msgpack
+    encoding (if any recipient wants it) is derived on first use.
+    """
+
+    __slots__ = ("text", "_message", "_encoded")
+
+    def __init__(self, text: str):
+        self.text = text
+        self._message: Any = None
+        self._encoded: Dict[str, bytes] = {}
+
+    def encode(self, protocol: Optional[str]) -> Encoded:
+        if protocol != MSGPACK_SUBPROTOCOL:
+            return self.text
+        encoded = self._encoded.get(protocol)
+        if encoded is None:
+            if self._message is None:
+                self._message = loads(self.text)
+            encoded = self._encoded[protocol] = packb(self._message)
+        return encoded
+
+
+class FastJSONResponse(JSONResponse):
+    """Default response class: orjson rendering, with the same type support as ``dumps``"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
@@ -1,37 +1,257 @@
-from typing import Dict, List
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Union
 from fastapi import WebSocket
-import json
+from .config import settings
+from .serialization import Encoded, SharedFrame, dumps, encode_frame
+from .pubsub import InMemoryBroker, create_pubsub
+from .metrics import (
+    registry, ws_broadcast_fanout, ws_dropped_messages, ws_evicted_connections, ws_send_duration
+)
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DISCONNECT = "disconnect"
+
+# "Try again later": the client fell too far behind the room
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class Connection:
+    """One socket with its own bounded outbound queue and writer task.
+
+    ``offer`` never blocks: when the queue is full the oldest frame is dropped,
+    or the connection is evicted, depending on ``overflow_policy``. A send that
+    takes longer than ``send_timeout`` also evicts the connection. Frames are
+    text, or bytes for sockets that negotiated the msgpack ``protocol``.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        room_id: str,
+        manager: "ConnectionManager",
+        max_queue: int,
+        overflow_policy: str,
+        send_timeout: float,
+        protocol: Optional[str] = None
+    ):
+        self.websocket = websocket
+        self.room_id = room_id
+        self.manager = manager
+        self.overflow_policy = overflow_policy
+        self.send_timeout = send_timeout
+        self.protocol = protocol
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.closed = False
+        self.task = asyncio.create_task(self._write())
+
+    def offer(self, message: Encoded) -> bool:
+        """Queue ``message`` for sending; returns False if it was not accepted"""
+        if self.closed:
+            return False
+        if self.queue.full():
+            if self.overflow_policy == OVERFLOW_DISCONNECT:
+                self.manager.evict(self, "send queue full")
+                return False
+            self.queue.get_nowait()
+            self.manager.dropped_messages += 1
+            ws_dropped_messages.inc()
+        self.queue.put_nowait((message, time.perf_counter()))
+        return True
+
+    async def _write(self):
+        while True:
+            message, enqueued_at = await self.queue.get()
+            # asyncio.wait rather than wait_for: wait_for can swallow our own cancellation
+            # when the send completes at the same moment
+            if isinstance(message, bytes):
+                send = asyncio.ensure_future(self.websocket.send_bytes(message))
+            else:
+                send = asyncio.ensure_future(self.websocket.send_text(message))
+            try:
+                done, _ = await asyncio.wait({send}, timeout=self.send_timeout)
+            except asyncio.CancelledError:
+                send.cancel()
+                raise
+            if not done:
+                send.cancel()
+                self.manager.evict(self, "send timed out")
+                return
+            try:
+                send.result()
+            except Exception:
+                # The socket is gone; the receive loop will notice and disconnect
+                self.manager.evict(self, "send failed", close=False)
+                return
+            ws_send_duration.observe(time.perf_counter() - enqueued_at)
+
+    async def close(self):
+        self.closed = True
+        if self.task is not asyncio.current_task() and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
 
 
 class ConnectionManager:
-    def __init__(self):
-        # Store active connections: {room_id: [websockets]}
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-    
-    async def connect(self, websocket: WebSocket, room_id: str):
+    """Room membership for the sockets of this process.
+
+    Broadcasts are published once on the pub/sub backend; every worker that
+    has sockets in the room is subscribed to it and fans the message out to
+    its local connections. Fan-out only enqueues to each connection's writer,
+    so one slow socket never delays the others. A broadcast is serialized once
+    for the pub/sub hop and at most once more per subprotocol on delivery.
+
+    Subscribing and unsubscribing a room are serialized by a per-room lock, so
+    a socket joining while the last one leaves never ends up in a room this
+    worker is no longer subscribed to.
+    """
+
+    def __init__(
+        self,
+        pubsub_backend: Optional[str] = None,
+        broker: Optional[InMemoryBroker] = None,
+        max_queue: Optional[int] = None,
+        overflow_policy: Optional[str] = None,
+        send_timeout: Optional[float] = None
+    ):
+        # Store active connections: {room_id: {websocket: connection}}
+        self.active_connections: Dict[str, Dict[WebSocket, Connection]] = {}
+        # Same connections by socket, for personal messages
+        self.connections: Dict[WebSocket, Connection] = {}
+        # room_id -> [lock, holders and waiters]; dropped when nobody uses it
+        self._room_locks: Dict[str, List[Any]] = {}
+        self.pubsub = create_pubsub(
+            pubsub_backend or settings.WS_PUBSUB_BACKEND,
+            self._deliver,
+            redis_url=settings.REDIS_URL,
+            broker=broker
+        )
+        self.max_queue = max_queue or settings.WS_SEND_QUEUE_SIZE
+        self.overflow_policy = overflow_policy or settings.WS_OVERFLOW_POLICY
+        self.send_timeout = send_timeout or settings.WS_SEND_TIMEOUT
+        self.dropped_messages = 0
+        self.evicted_connections = 0
+
+    async def connect(self, websocket: WebSocket, room_id: str, subprotocol: Optional[str] = None):
         """Accept WebSocket connection and add to room"""
-        await websocket.accept()
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-        self.active_connections[room_id].append(websocket)
-    
-    def disconnect(self, websocket: WebSocket, room_id: str):
+        if subprotocol:
+            await websocket.accept(subprotocol=subprotocol)
+        else:
+            await websocket.accept()
+        async with self._room_lock(room_id):
+            room = self.active_connections.get(room_id)
+            if room is None:
+                # First local socket in the room: start receiving its messages
+                await self.pubsub.subscribe(room_id)
+                room = self.active_connections[room_id] = {}
+            room[websocket] = self.connections[websocket] = Connection(
+                websocket, room_id, self, self.max_queue, self.overflow_policy, self.send_timeout, subprotocol
+            )
+
+    async def disconnect(self, websocket: WebSocket, room_id: str):
         """Remove WebSocket connection from room"""
-        if room_id in self.active_connections:
-            self.active_connections[room_id].remove(websocket)
-            if not self.active_connections[room_id]:
-                del self.active_connections[room_id]
-    
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        """Send message to specific WebSocket"""
-        await websocket.send_text(message)
-    
+        room = self.active_connections.get(room_id)
+        if room is None:
+            return
+        connection = room.pop(websocket, None)
+        if connection is not None and self.connections.get(websocket) is connection:
+            del self.connections[websocket]
+        if not room:
+            async with self._room_lock(room_id):
+                # A socket may have joined while we waited for the lock
+                if room_id in self.active_connections and not self.active_connections[room_id]:
+                    del self.active_connections[room_id]
+                    await self.pubsub.unsubscribe(room_id)
+        if connection is not None:
+            await connection.close()
+
+    @asynccontextmanager
+    async def _room_lock(self, room_id: str):
+        entry = self._room_locks.get(room_id)
+        if entry is None:
+            entry = self._room_locks[room_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._room_locks[room_id]
+
+    def evict(self, connection: Connection, reason: str, close: bool = True):
+        """Drop a slow or broken connection without waiting on it"""
+        if connection.closed:
+            return
+        connection.closed = True
+        self.evicted_connections += 1
+        ws_evicted_connections.inc()
+        logger.info("Evicting WebSocket in room %s: %s", connection.room_id, reason)
+        asyncio.create_task(self._evict(connection, close))
+
+    async def _evict(self, connection: Connection, close: bool):
+        await self.disconnect(connection.websocket, connection.room_id)
+        if close:
+            try:
+                await connection.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+            except Exception:
+                pass
+
+    async def send_personal_message(self, message: Union[str, Dict[str, Any]], websocket: WebSocket):
+        """Send message to specific WebSocket, in order with its room's broadcasts.
+
+        Dicts are encoded for the socket's subprotocol; strings are sent as given.
+        """
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.offer(message if isinstance(message, str) else encode_frame(message, connection.protocol))
+            return
+        await websocket.send_text(message if isinstance(message, str) else dumps(message))
+
     async def broadcast_to_room(self, message: dict, room_id: str):
-        """Send message to all connections in a room"""
-        if room_id in self.active_connections:
-            message_str = json.dumps(message)
-            for connection in self.active_connections[room_id]:
-                await connection.send_text(message_str)
+        """Send message to all connections in a room, on every worker"""
+        await self.pubsub.publish(room_id, dumps(message))
+
+    async def _deliver(self, room_id: str, message_str: str):
+        """Fan a published message out to this process's sockets in the room"""
+        room = self.active_connections.get(room_id)
+        if room is None:
+            return
+        # Snapshot: evictions may change the room while we enqueue
+        connections = list(room.values())
+        ws_broadcast_fanout.observe(len(connections))
+        frame = SharedFrame(message_str)
+        for connection in connections:
+            connection.offer(frame.encode(connection.protocol))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "rooms": len(self.active_connections),
+            "connections": sum(len(room) for room in self.active_connections.values()),
+            "queued": sum(c.queue.qsize() for room in self.active_connections.values() for c in room.values()),
+            "dropped_messages": self.dropped_messages,
+            "evicted_connections": self.evicted_connections
+        }
+
+    async def shutdown(self):
+        for room_id, room in list(self.active_connections.items()):
+            for websocket in list(room):
+                await self.disconnect(websocket, room_id)
+        await self.pubsub.close()
 
 
 manager = ConnectionManager()
+
+registry.gauge(
+    "ws_active_connections",
+    "WebSocket connections open on this worker",
+    lambda: sum(len(room) for room in manager.active_connections.values())
+)
+registry.gauge("ws_active_rooms", "Rooms with at least one socket on this worker", lambda: len(manager.active_connections))
@@ -1,4 +1,4 @@
-from .user import user
-from .chat import chat_session, chat_message
+from .user import user, async_user
+from .chat import chat_session, chat_message, async_chat_session, async_chat_message
 
-__all__ = ["user", "chat_session", "chat_message"]
+__all__ = ["user", "chat_session", "chat_message", "async_user", "async_chat_session", "async_chat_message"]
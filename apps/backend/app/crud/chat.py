@@ -1,4 +1,7 @@
-from typing import List, Optional
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncResult, AsyncSession
 from sqlalchemy.orm import Session
 from ..models.chat import ChatSession, ChatMessage
 from ..schemas.chat import ChatSessionCreate, ChatMessageCreate
@@ -43,5 +46,106 @@ class CRUDChatMessage:
         return db.query(ChatMessage).filter(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at).all()
 
 
+class AsyncCRUDChatSession:
+    async def get(self, db: AsyncSession, id: int) -> Optional[ChatSession]:
+        return await db.get(ChatSession, id)
+    
+    async def get_by_room_id(self, db: AsyncSession, room_id: str) -> Optional[ChatSession]:
+        result = await db.execute(select(ChatSession).where(ChatSession.room_id == room_id).limit(1))
+        return result.scalars().first()
+    
+    async def get_by_room_ids(self, db: AsyncSession, room_ids: List[str]) -> List[ChatSession]:
+        if not room_ids:
+            return []
+        result = await db.execute(select(ChatSession).where(ChatSession.room_id.in_(room_ids)))
+        return list(result.scalars().all())
+    
+    async def get_user_sessions(self, db: AsyncSession, user_id: int) -> List[ChatSession]:
+        """Get all chat sessions (rooms) for a user"""
+        result = await db.execute(
+            select(ChatSession).where(ChatSession.user_id == user_id).order_by(ChatSession.updated_at.desc())
+        )
+        return list(result.scalars().all())
+    
+    async def get_user_sessions_page(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        limit: int,
+        before: Optional[Tuple[datetime, int]] = None
+    ) -> List[ChatSession]:
+        """Newest-first page of a user's rooms, keyset on (created_at, id); fetches limit + 1 rows"""
+        query = select(ChatSession).where(ChatSession.user_id == user_id)
+        if before is not None:
+            query = query.where(tuple_(ChatSession.created_at, ChatSession.id) < tuple_(*before))
+        query = query.order_by(ChatSession.created_at.desc(), ChatSession.id.desc()).limit(limit + 1)
+        result = await db.execute(query)
+        return list(result.scalars().all())
+    
+    async def create(self, db: AsyncSession, user_id: int, room_id: str) -> ChatSession:
+        db_obj = ChatSession(user_id=user_id, room_id=room_id)
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+    
+    async def delete(self, db: AsyncSession, id: int) -> bool:
+        obj = await db.get(ChatSession, id)
+        if obj:
+            await db.delete(obj)
+            await db.commit()
+            return True
+        return False
+
+
+class AsyncCRUDChatMessage:
+    async def create(self, db: AsyncSession, obj_in: ChatMessageCreate) -> ChatMessage:
+        db_obj = ChatMessage(**obj_in.dict())
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+    
+    async def get_session_messages(self, db: AsyncSession, session_id: int) -> List[ChatMessage]:
+        result = await db.execute(
+            select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at)
+        )
+        return list(result.scalars().all())
+    
+    async def get_session_messages_page(
+        self,
+        db: AsyncSession,
+        session_id: int,
+        limit: int,
+        before: Optional[Tuple[datetime, int]] = None
+    ) -> List[ChatMessage]:
+        """Newest-first page of a session's messages, keyset on (created_at, id); fetches limit + 1 rows"""
+        query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+        if before is not None:
+            query = query.where(tuple_(ChatMessage.created_at, ChatMessage.id) < tuple_(*before))
+        query = query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(limit + 1)
+        result = await db.execute(query)
+        return list(result.scalars().all())
+    
+    async def stream_session_messages(self, db: AsyncSession, session_id: int, batch_size: int) -> AsyncResult:
+        """Oldest-first rows of a session through a server-side cursor, ``batch_size`` rows per fetch.
+
+        Selects plain columns rather than ORM objects so nothing accumulates in
+        the session's identity map; iterate with ``.partitions()``.
+        """
+        query = (
+            select(
+                ChatMessage.id, ChatMessage.sender, ChatMessage.content, ChatMessage.model,
+                ChatMessage.tokens_used, ChatMessage.response_time_ms, ChatMessage.created_at
+            )
+            .where(ChatMessage.session_id == session_id)
+            .order_by(ChatMessage.created_at, ChatMessage.id)
+            .execution_options(yield_per=batch_size)
+        )
+        return await db.stream(query)
+
+
 chat_session = CRUDChatSession()
 chat_message = CRUDChatMessage()
+async_chat_session = AsyncCRUDChatSession()
+async_chat_message = AsyncCRUDChatMessage()
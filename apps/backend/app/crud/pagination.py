@@ -0,0 +1,50 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+
+def _encode(position: list) -> str:
+    raw = json.dumps(position, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode(cursor: str) -> list:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """Opaque keyset cursor for a (created_at, id) position"""
+    return _encode([created_at.isoformat(), id])
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor produced by ``encode_cursor``; raises ValueError when malformed"""
+    try:
+        created_at, id = _decode(cursor)
+        return datetime.fromisoformat(created_at), int(id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def encode_rank_cursor(rank: float, id: int) -> str:
+    """Opaque keyset cursor for a (rank, id) position of ranked search results"""
+    return _encode([rank, id])
+
+
+def decode_rank_cursor(cursor: str) -> Tuple[float, int]:
+    """Decode a cursor produced by ``encode_rank_cursor``; raises ValueError when malformed"""
+    try:
+        rank, id = _decode(cursor)
+        return float(rank), int(id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def next_cursor(rows: list, limit: int) -> Optional[str]:
+    """Cursor after the last row of a page fetched with ``limit + 1`` rows, or None on the last page"""
+    if len(rows) <= limit:
+        return None
+    last = rows[limit - 1]
+    return encode_cursor(last.created_at, last.id)
@@ -0,0 +1,144 @@
+import html
+import re
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+from sqlalchemy import DateTime, Float, Integer, String, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Text search configuration of the generated ``content_tsv`` column (migration 0003)
+SEARCH_CONFIG = "english"
+
+# Highlight markers chosen so they cannot occur in chat text; replaced by <mark> after escaping
+_HL_START = "\x02"
+_HL_STOP = "\x03"
+SNIPPET_WORDS = 16
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+_RESULT_COLUMNS = dict(
+    id=Integer,
+    session_id=Integer,
+    room_id=String,
+    sender=String,
+    created_at=DateTime(timezone=True),
+    rank=Float,
+    snippet=String
+)
+
+# Rank, then page, then build headlines for the page only: ts_headline re-parses
+# the message text, so it must never run over every match
+_POSTGRES_SEARCH = text("""
+WITH query AS (
+    SELECT websearch_to_tsquery(CAST(:config AS regconfig), :q) AS q
+),
+hits AS (
+    SELECT m.id, CAST(ts_rank(m.content_tsv, query.q) AS float8) AS rank
+    FROM chat_messages m
+    JOIN chat_sessions s ON s.id = m.session_id
+    CROSS JOIN query
+    WHERE s.user_id = :user_id AND m.content_tsv @@ query.q
+),
+page AS (
+    SELECT id, rank FROM hits
+    WHERE CAST(:after_rank AS float8) IS NULL
+       OR rank < CAST(:after_rank AS float8)
+       OR (rank = CAST(:after_rank AS float8) AND id < :after_id)
+    ORDER BY rank DESC, id DESC
+    LIMIT :limit
+)
+SELECT m.id, m.session_id, s.room_id, m.sender, m.created_at, page.rank,
+       ts_headline(CAST(:config AS regconfig), m.content, query.q, :headline_options) AS snippet
+FROM page
+JOIN chat_messages m ON m.id = page.id
+JOIN chat_sessions s ON s.id = m.session_id
+CROSS JOIN query
+ORDER BY page.rank DESC, page.id DESC
+""").columns(**_RESULT_COLUMNS)
+
+# bm25() is "lower is better"; negate it so both backends rank descending
+_SQLITE_SEARCH = text("""
+SELECT id, session_id, room_id, sender, created_at, rank, snippet FROM (
+    SELECT m.id AS id, m.session_id AS session_id, s.room_id AS room_id, m.sender AS sender,
+           m.created_at AS created_at, -bm25(chat_messages_fts) AS rank,
+           snippet(chat_messages_fts, 0, :hl_start, :hl_stop, '…', :snippet_words) AS snippet
+    FROM chat_messages_fts
+    JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+    JOIN chat_sessions s ON s.id = m.session_id
+    WHERE chat_messages_fts MATCH :q AND s.user_id = :user_id
+)
+WHERE :after_rank IS NULL OR rank < :after_rank OR (rank = :after_rank AND id < :after_id)
+ORDER BY rank DESC, id DESC
+LIMIT :limit
+""").columns(**_RESULT_COLUMNS)
+
+
+class SearchHit(NamedTuple):
+    id: int
+    session_id: int
+    room_id: str
+    sender: str
+    created_at: datetime
+    rank: float
+    snippet: str
+
+
+def search_terms(query: str) -> List[str]:
+    """Words of a user query; punctuation and search-syntax characters are dropped"""
+    return _TOKEN.findall(query)
+
+
+def fts5_query(terms: List[str]) -> str:
+    """All terms, each quoted so user input can never be parsed as FTS5 syntax"""
+    return " ".join('"%s"' % term for term in terms)
+
+
+def highlight(snippet: Optional[str]) -> str:
+    """HTML-escape a snippet, then turn the match markers into <mark> tags"""
+    escaped = html.escape(snippet or "", quote=False)
+    return escaped.replace(_HL_START, "<mark>").replace(_HL_STOP, "</mark>")
+
+
+class AsyncCRUDChatSearch:
+    async def search(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        query: str,
+        limit: int,
+        after: Optional[Tuple[float, int]] = None
+    ) -> List[SearchHit]:
+        """Best-first page of the user's messages matching ``query``, keyset on (rank, id); fetches limit + 1 rows"""
+        terms = search_terms(query)
+        if not terms:
+            return []
+        after_rank, after_id = after if after is not None else (None, None)
+        params = {"user_id": user_id, "after_rank": after_rank, "after_id": after_id, "limit": limit + 1}
+
+        if db.get_bind().dialect.name == "postgresql":
+            statement = _POSTGRES_SEARCH
+            params.update(
+                config=SEARCH_CONFIG,
+                # websearch_to_tsquery never raises on user input and adds "phrases", or, -word
+                q=query,
+                headline_options=(
+                    f"StartSel={_HL_START}, StopSel={_HL_STOP}, "
+                    f"MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 3}, MaxFragments=1"
+                )
+            )
+        else:
+            statement = _SQLITE_SEARCH
+            params.update(
+                q=fts5_query(terms),
+                hl_start=_HL_START,
+                hl_stop=_HL_STOP,
+                snippet_words=SNIPPET_WORDS
+            )
+
+        result = await db.execute(statement, params)
+        return [
+            SearchHit(row.id, row.session_id, row.room_id, row.sender, row.created_at, row.rank, highlight(row.snippet))
+            for row in result
+        ]
+
+
+async_chat_search = AsyncCRUDChatSearch()
@@ -1,6 +1,14 @@
 from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from ..core.security import get_password_hash, verify_password
+from ..core.security import (
+    get_password_hash,
+    verify_password,
+    async_get_password_hash,
+    async_verify_password,
+    needs_rehash,
+)
 from ..models.user import User
 from ..schemas.user import UserCreate, UserUpdate
 
@@ -40,4 +48,46 @@ class CRUDUser:
         return user.is_active
 
 
+class AsyncCRUDUser:
+    async def get(self, db: AsyncSession, id: int) -> Optional[User]:
+        return await db.get(User, id)
+    
+    async def get_by_email(self, db: AsyncSession, email: str) -> Optional[User]:
+        result = await db.execute(select(User).where(User.email == email).limit(1))
+        return result.scalars().first()
+    
+    async def get_by_username(self, db: AsyncSession, username: str) -> Optional[User]:
+        result = await db.execute(select(User).where(User.username == username).limit(1))
+        return result.scalars().first()
+    
+    async def create(self, db: AsyncSession, obj_in: UserCreate) -> User:
+        hashed_password = await async_get_password_hash(obj_in.password)
+        db_obj = User(
+            email=obj_in.email,
+            username=obj_in.username,
+            full_name=obj_in.full_name,
+            hashed_password=hashed_password,
+        )
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+    
+    async def authenticate(self, db: AsyncSession, email: str, password: str) -> Optional[User]:
+        user = await self.get_by_email(db, email=email)
+        if not user:
+            return None
+        if not await async_verify_password(password, user.hashed_password):
+            return None
+        if needs_rehash(user.hashed_password):
+            # Upgrade hashes created with other bcrypt parameters while we know the password
+            user.hashed_password = await async_get_password_hash(password)
+            await db.commit()
+        return user
+    
+    def is_active(self, user: User) -> bool:
+        return user.is_active
+
+
 user = CRUDUser()
+async_user = AsyncCRUDUser()
@@ -1,13 +1,114 @@
-from sqlalchemy import create_engine
+import asyncio
+import logging
+from typing import Optional
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from ..core.config import settings
+from ..core.metrics import instrument_engine
 
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Engines are created on first use (normally by the app lifespan), never at import:
+# importing the app, forking a worker or running a CLI does not touch the database
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+
+
+def get_async_database_url(url: str) -> str:
+    """Map a sync DATABASE_URL onto the matching asyncio driver"""
+    scheme, sep, rest = url.partition("://")
+    if scheme in ("postgresql", "postgres", "postgresql+psycopg2"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    if scheme in ("sqlite", "sqlite+pysqlite"):
+        return f"sqlite+aiosqlite{sep}{rest}"
+    return url
+
+
+def get_engine() -> Engine:
+    global _engine
+    if _engine is None:
+        _engine = create_engine(settings.DATABASE_URL)
+        # Query and commit timings for /metrics
+        instrument_engine(_engine)
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """Async engine for async endpoints (asyncpg on Postgres, aiosqlite for tests)"""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(
+            settings.ASYNC_DATABASE_URL or get_async_database_url(settings.DATABASE_URL)
+        )
+        instrument_engine(_async_engine.sync_engine)
+    return _async_engine
+
+
+class _LazySessionmaker(sessionmaker):
+    """sessionmaker that binds to its engine on the first session"""
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=get_engine())
+        return super().__call__(**local_kw)
+
+
+class _LazyAsyncSessionmaker(async_sessionmaker):
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=get_async_engine())
+        return super().__call__(**local_kw)
+
+
+SessionLocal = _LazySessionmaker(autocommit=False, autoflush=False)
+AsyncSessionLocal = _LazyAsyncSessionmaker(
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+
+def __getattr__(name: str):
+    # ``from app.db.database import engine`` keeps working, lazily
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def init_engines():
+    """Create both engines and bind the session factories (called from the app lifespan)"""
+    SessionLocal.configure(bind=get_engine())
+    AsyncSessionLocal.configure(bind=get_async_engine())
+
+
+async def wait_for_database(retry_interval: float = 1.0, max_interval: float = 10.0):
+    """Open a first pooled connection, retrying until the database answers"""
+    delay = retry_interval
+    while True:
+        try:
+            async with get_async_engine().connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            return
+        except Exception as e:
+            logger.warning("Database not reachable yet (%s), retrying in %.1fs", e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_interval)
+
+
+async def dispose_engines():
+    """Close pooled connections (called on shutdown)"""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
+
 
 def get_db():
     db = SessionLocal()
@@ -15,3 +116,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
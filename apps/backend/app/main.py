@@ -1,19 +1,87 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.api import api_router
-from app.db.database import engine, Base
-from app import models
+from app.db.database import dispose_engines, init_engines, wait_for_database
+from app import models  # noqa: F401  (configures every mapper before the first query)
+from app.core.security import calibrate_password_hashing, password_hash_pool
+from app.services.ai_service import ai_service
+from app.services.message_sink import message_sink
+from app.services.retention import message_retention
+from app.core.websocket_manager import manager
+from app.core.rate_limit import RateLimitMiddleware, rate_limiter
+from app.core.auth_cache import auth_cache
+from app.core.metrics import MetricsMiddleware
+from app.core.serialization import FastJSONResponse
+
+logger = logging.getLogger(__name__)
+
+# The schema is managed by Alembic (`alembic upgrade head`), not created at import
+
+
+async def warm_up(app: FastAPI):
+    """Slow startup work, run after the server starts listening; /ready reports 503 until it is done"""
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(
+            wait_for_database(),
+            ai_service.startup(),
+            calibrate_password_hashing()
+        )
+    except Exception:
+        # Stay unready: the orchestrator restarts or never routes to this worker
+        logger.exception("Warmup failed")
+        return
+    app.state.ready = True
+    app.state.warmup_ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("Warmup finished in %sms", app.state.warmup_ms)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop process-wide resources"""
+    app.state.ready = False
+    init_engines()
+    await message_sink.start()
+    await message_retention.start()
+    warmup = asyncio.create_task(warm_up(app))
+    yield
+    # Stop advertising readiness first so load balancers drain this worker
+    app.state.ready = False
+    warmup.cancel()
+    try:
+        await warmup
+    except asyncio.CancelledError:
+        pass
+    await message_retention.stop()
+    # Persist buffered chat messages before anything else goes away
+    await message_sink.stop()
+    await manager.shutdown()
+    await rate_limiter.close()
+    await ai_service.shutdown()
+    password_hash_pool.shutdown()
+    await dispose_engines()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan
+)
+
+# Added before CORS so it runs inside it: rejected requests still carry CORS headers
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=rate_limiter,
+    token_verifier=auth_cache.verify_token
 )
 
 # CORS middleware
@@ -25,6 +93,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so latency includes every other middleware and rejected requests
+app.add_middleware(MetricsMiddleware)
+
 # Include API router
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
@@ -1,21 +1,39 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Float
+from datetime import datetime, timezone
+from sqlalchemy import BigInteger, Column, Integer, String, Text, DateTime, ForeignKey, Float, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from ..db.database import Base
 
 
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     room_id = Column(String, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Set client-side (microsecond precision) so keyset cursors compare against the same format
+    created_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Room summary for the room list, maintained by triggers on chat_messages (migration 0004)
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    total_tokens = Column(BigInteger, nullable=False, default=0, server_default="0")
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    last_message_preview = Column(String(200), nullable=True)
 
     user = relationship("User")
     messages = relationship("ChatMessage", back_populates="session")
 
+    __table_args__ = (
+        # Looked up on every WebSocket connect and room delete
+        Index("ix_chat_sessions_room_id", "room_id", unique=True),
+        # Keyset pagination of a user's rooms
+        Index("ix_chat_sessions_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
@@ -27,6 +45,15 @@ class ChatMessage(Base):
     model = Column(String, nullable=True)
     tokens_used = Column(Integer, nullable=True)
     response_time_ms = Column(Float, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now())
 
     session = relationship("ChatSession", back_populates="messages")
+
+    __table_args__ = (
+        # Keyset pagination of a session's history
+        Index("ix_chat_messages_session_id_created_at_id", "session_id", "created_at", "id"),
+        # Full-text search lives outside the model (migration 0003): a generated
+        # content_tsv column + GIN index on Postgres, an FTS5 table on SQLite.
+        # On Postgres the table is range-partitioned by month on created_at
+        # (migration 0005), so the real primary key there is (id, created_at)
+    )
@@ -1,10 +1,13 @@
-from .user import User, UserCreate, UserUpdate, UserInDB
-from .chat import ChatMessage, ChatMessageCreate, ChatRequest, ChatResponse, ChatSession, ChatSessionCreate
+from .user import User, UserCreate, UserUpdate, UserInDB, CurrentUser
+from .chat import (
+    ChatMessage, ChatMessageCreate, ChatRequest, ChatResponse, ChatSession, ChatSessionCreate,
+    ChatMessagePage, ChatSessionPage
+)
 from .auth import Token, TokenPayload, LoginRequest
 
 __all__ = [
-    "User", "UserCreate", "UserUpdate", "UserInDB",
+    "User", "UserCreate", "UserUpdate", "UserInDB", "CurrentUser",
     "ChatMessage", "ChatMessageCreate", "ChatRequest", "ChatResponse", 
-    "ChatSession", "ChatSessionCreate",
+    "ChatSession", "ChatSessionCreate", "ChatMessagePage", "ChatSessionPage",
     "Token", "TokenPayload", "LoginRequest"
 ]
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 from datetime import datetime
 
 
@@ -15,6 +15,16 @@ class ChatMessageCreate(ChatMessageBase):
     response_time_ms: Optional[float] = None
 
 
+class ChatMessageImport(BaseModel):
+    """One message line of an NDJSON history import"""
+    content: str
+    sender: Literal["user", "ai"]
+    model: Optional[str] = None
+    tokens_used: Optional[int] = None
+    response_time_ms: Optional[float] = None
+    created_at: Optional[datetime] = None
+
+
 class ChatMessage(ChatMessageBase):
     id: int
     session_id: int
@@ -31,6 +41,13 @@ class ChatRequest(BaseModel):
     message: str
     model: str = "mistral-small-latest"
     temperature: float = 0.7
+    cache: Optional[bool] = None  # None: cache only when temperature is 0
+    room_id: Optional[str] = None  # include the room's history and save the exchange
+
+
+class ChatBatchRequest(BaseModel):
+    items: List[ChatRequest] = Field(..., min_length=1)
+    concurrency: Optional[int] = Field(None, ge=1)  # capped by CHAT_BATCH_CONCURRENCY
 
 
 class ChatResponse(BaseModel):
@@ -38,6 +55,7 @@ class ChatResponse(BaseModel):
     model: Optional[str] = None
     tokens_used: Optional[int] = None
     response_time_ms: Optional[float] = None
+    cached: bool = False
 
 
 class ChatSessionCreate(BaseModel):
@@ -50,6 +68,39 @@ class ChatSession(BaseModel):
     room_id: str
     created_at: datetime
     updated_at: Optional[datetime] = None
+    message_count: int = 0
+    total_tokens: int = 0
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
 
     class Config:
         from_attributes = True
+
+
+class ChatMessagePage(BaseModel):
+    items: List[ChatMessage]
+    next_cursor: Optional[str] = None
+
+
+class ChatSessionPage(BaseModel):
+    items: List[ChatSession]
+    next_cursor: Optional[str] = None
+
+
+class ChatSearchHit(BaseModel):
+    message_id: int
+    room_id: str
+    sender: str
+    created_at: datetime
+    snippet: str  # HTML-escaped, matches wrapped in <mark>
+    rank: float
+
+
+class ChatSearchPage(BaseModel):
+    items: List[ChatSearchHit]
+    next_cursor: Optional[str] = None
+
+
+class ChatImportResult(BaseModel):
+    imported: int
+    rooms: List[str]
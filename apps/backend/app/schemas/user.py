@@ -33,3 +33,13 @@ class User(UserInDBBase):
 
 class UserInDB(UserInDBBase):
     hashed_password: str
+
+
+class CurrentUser(BaseModel):
+    """Minimal identity snapshot resolved for authenticated requests"""
+    id: int
+    username: str
+    is_active: bool
+
+    class Config:
+        from_attributes = True
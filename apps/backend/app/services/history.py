@@ -0,0 +1,225 @@
+import zlib
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.config import settings
+from ..core.serialization import dumps_bytes, loads
+from ..crud.chat import async_chat_message, async_chat_session
+from ..db.database import AsyncSessionLocal
+from ..models.chat import ChatMessage, ChatSession
+from ..schemas.chat import ChatMessageImport
+from .archive import message_archive
+from .context_builder import context_builder
+
+# (session id, room_id, created_at) of a room to export
+RoomRef = Tuple[int, str, Optional[datetime]]
+
+# gzip container (not raw deflate) for both directions
+GZIP_WBITS = 31
+GZIP_MAGIC = b"\x1f\x8b"
+# Upper bound on inflated bytes per step, so a tiny upload cannot expand in one go
+INFLATE_CHUNK = 64 * 1024
+
+
+class HistoryImportError(ValueError):
+    """An import line could not be used; nothing from the upload is kept"""
+
+    def __init__(self, line: int, reason: str):
+        super().__init__(f"line {line}: {reason}")
+        self.line = line
+
+
+class RoomAccessError(Exception):
+    """The import names a room owned by another user"""
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def _inflate(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Transparently gunzip ``chunks`` when they start with the gzip magic bytes"""
+    decompressor = None
+    async for chunk in chunks:
+        if decompressor is None:
+            if not chunk:
+                continue
+            if not chunk.startswith(GZIP_MAGIC):
+                yield chunk
+                async for rest in chunks:
+                    yield rest
+                return
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+        data = chunk
+        while data:
+            out = decompressor.decompress(data, INFLATE_CHUNK)
+            data = decompressor.unconsumed_tail
+            if out:
+                yield out
+    if decompressor is not None:
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+
+class HistoryTransfer:
+    """Streaming NDJSON export and import of chat rooms.
+
+    The format is one JSON object per line: a ``{"type": "room", ...}`` line
+    followed by that room's ``{"type": "message", ...}`` lines, oldest first.
+    Exports read through server-side cursors ``export_batch_size`` rows at a
+    time, preceded by any of the room's messages the retention job moved to
+    the cold archive (read one row group at a time), and imports insert
+    ``import_batch_size`` rows at a time, so memory use does not depend on
+    room size. An import runs in one transaction.
+    """
+
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        archive=message_archive,
+        export_batch_size: int = 1000,
+        import_batch_size: int = 1000,
+        max_line_bytes: int = 1024 * 1024
+    ):
+        self.session_factory = session_factory
+        self.archive = archive
+        self.export_batch_size = export_batch_size
+        self.import_batch_size = import_batch_size
+        self.max_line_bytes = max_line_bytes
+
+    async def export_rooms(self, rooms: List[RoomRef]) -> AsyncIterator[bytes]:
+        """NDJSON chunks for ``rooms``, roughly one chunk per fetched batch"""
+        async with self.session_factory() as db:
+            for session_id, room_id, created_at in rooms:
+                yield dumps_bytes({"type": "room", "room_id": room_id, "created_at": created_at}) + b"\n"
+                # Months past retention first: they are older than anything still in the database
+                async for rows in self.archive.session_batches_async(session_id):
+                    yield self._message_lines(room_id, rows)
+                result = await async_chat_message.stream_session_messages(db, session_id, self.export_batch_size)
+                async for rows in result.mappings().partitions():
+                    yield self._message_lines(room_id, rows)
+
+    @staticmethod
+    def _message_lines(room_id: str, rows) -> bytes:
+        return b"".join(
+            dumps_bytes({
+                "type": "message",
+                "room_id": room_id,
+                "id": row["id"],
+                "sender": row["sender"],
+                "content": row["content"],
+                "model": row["model"],
+                "tokens_used": row["tokens_used"],
+                "response_time_ms": row["response_time_ms"],
+                "created_at": row["created_at"]
+            }) + b"\n"
+            for row in rows
+        )
+
+    async def import_ndjson(
+        self,
+        chunks: AsyncIterator[bytes],
+        user_id: int,
+        room_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Insert the messages of an (optionally gzipped) NDJSON upload.
+
+        With ``room_id`` every message goes to that room and room lines are
+        ignored; otherwise each room line selects (or creates) the room for
+        the messages after it. Missing rooms are created for ``user_id``.
+        """
+        rooms: Dict[str, int] = {}
+        imported = 0
+        line_no = 0
+
+        async with self.session_factory() as db:
+            current = await self._room(db, rooms, user_id, room_id) if room_id is not None else None
+            batch: List[Dict[str, Any]] = []
+            buffer = b""
+
+            async def handle(line: bytes):
+                nonlocal current, imported
+                if not line.strip():
+                    return
+                try:
+                    record = loads(line)
+                except ValueError:
+                    raise HistoryImportError(line_no, "invalid JSON")
+                if not isinstance(record, dict):
+                    raise HistoryImportError(line_no, "expected a JSON object")
+
+                kind = record.get("type", "message")
+                if kind == "room":
+                    if room_id is None:
+                        if not isinstance(record.get("room_id"), str) or not record["room_id"]:
+                            raise HistoryImportError(line_no, "room line without room_id")
+                        current = await self._room(db, rooms, user_id, record["room_id"])
+                    return
+                if kind != "message":
+                    raise HistoryImportError(line_no, f"unknown record type {kind!r}")
+                if current is None:
+                    raise HistoryImportError(line_no, "message before any room line")
+                try:
+                    message = ChatMessageImport.model_validate(record)
+                except ValidationError as e:
+                    raise HistoryImportError(line_no, e.errors()[0]["msg"])
+
+                row = message.model_dump()
+                row["session_id"] = current
+                row["created_at"] = row["created_at"] or datetime.now(timezone.utc)
+                batch.append(row)
+                imported += 1
+                if len(batch) >= self.import_batch_size:
+                    await db.execute(insert(ChatMessage), batch)
+                    batch.clear()
+
+            async for chunk in _inflate(chunks):
+                buffer += chunk
+                lines = buffer.split(b"\n")
+                buffer = lines.pop()
+                for line in lines:
+                    line_no += 1
+                    await handle(line)
+                if len(buffer) > self.max_line_bytes:
+                    raise HistoryImportError(line_no + 1, f"line longer than {self.max_line_bytes} bytes")
+            line_no += 1
+            await handle(buffer)
+
+            if batch:
+                await db.execute(insert(ChatMessage), batch)
+            await db.commit()
+
+        # Cached summaries of these rooms no longer cover their history
+        for session_id in rooms.values():
+            context_builder.forget(session_id)
+        return {"imported": imported, "rooms": sorted(rooms)}
+
+    async def _room(self, db: AsyncSession, rooms: Dict[str, int], user_id: int, room_id: str) -> int:
+        """Session id of ``room_id``, created inside the import transaction when missing"""
+        session_id = rooms.get(room_id)
+        if session_id is not None:
+            return session_id
+        room = await async_chat_session.get_by_room_id(db, room_id=room_id)
+        if room is None:
+            room = ChatSession(user_id=user_id, room_id=room_id)
+            db.add(room)
+            await db.flush()
+        elif room.user_id != user_id:
+            raise RoomAccessError(room_id)
+        rooms[room_id] = room.id
+        return room.id
+
+
+history_transfer = HistoryTransfer(
+    export_batch_size=settings.HISTORY_EXPORT_BATCH_SIZE,
+    import_batch_size=settings.HISTORY_IMPORT_BATCH_SIZE,
+    max_line_bytes=settings.HISTORY_IMPORT_MAX_LINE_BYTES
+)
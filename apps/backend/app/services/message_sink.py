@@ -0,0 +1,202 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import insert
+from ..core.config import settings
+from ..db.database import AsyncSessionLocal
+from ..models.chat import ChatMessage
+from ..schemas.chat import ChatMessageCreate
+
+logger = logging.getLogger(__name__)
+
+COPY_COLUMNS = ["session_id", "content", "sender", "model", "tokens_used", "response_time_ms", "created_at"]
+
+
+class MessageSink:
+    """Write-behind buffer that persists chat messages in batches.
+
+    ``submit`` stamps ``created_at`` and enqueues the row; a background task
+    drains the queue and bulk-inserts up to ``batch_size`` rows at once, or
+    whatever arrived within ``flush_interval`` seconds. On Postgres batches go
+    through ``COPY``, elsewhere through an executemany ``INSERT``.
+
+    In ``sync`` mode, or before ``start`` has been called, every submit is
+    written immediately, which keeps tests and scripts deterministic.
+
+    Rows are numbered per session as they are submitted, and because the
+    single writer persists them in order, ``flush_session`` can wait for one
+    session's rows without waiting for the rest of the queue.
+    """
+
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        mode: str = "async",
+        batch_size: int = 200,
+        flush_interval: float = 0.05,
+        max_queue: int = 10000,
+        use_copy: bool = True
+    ):
+        self.session_factory = session_factory
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.use_copy = use_copy
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Per session: rows submitted, rows written, and (target, future) flush waiters
+        self._submitted: Dict[int, int] = {}
+        self._written: Dict[int, int] = {}
+        self._waiters: Dict[int, List[Tuple[int, asyncio.Future]]] = {}
+        self.batches_written = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.mode != "async" or self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the writer task"""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._queue = None
+        for waiters in self._waiters.values():
+            for _, waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+        self._submitted.clear()
+        self._written.clear()
+        self._waiters.clear()
+
+    async def flush(self):
+        """Wait until every message submitted so far has been written"""
+        if self.running:
+            await self._queue.join()
+
+    async def flush_session(self, session_id: int):
+        """Wait until the messages of ``session_id`` submitted so far have been written"""
+        target = self._submitted.get(session_id, 0)
+        if not self.running or self._written.get(session_id, 0) >= target:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(session_id, []).append((target, waiter))
+        await waiter
+
+    async def submit(self, obj_in: ChatMessageCreate):
+        row = obj_in.model_dump()
+        # Stamp now so ordering reflects when the message happened, not when the batch landed
+        row["created_at"] = datetime.now(timezone.utc)
+
+        if not self.running:
+            await self._write([row])
+            return
+        session_id = row["session_id"]
+        seq = self._submitted.get(session_id, 0) + 1
+        self._submitted[session_id] = seq
+        # Bounded queue: a database that can't keep up slows producers down instead of growing memory
+        await self._queue.put((seq, row))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._write_with_fallback([row for _, row in batch])
+            finally:
+                self._mark_written(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _mark_written(self, batch: List[Tuple[int, Dict[str, Any]]]):
+        """Advance the written counters of the batch's sessions and release their flush waiters"""
+        for seq, row in batch:
+            self._written[row["session_id"]] = seq
+        for session_id in {row["session_id"] for _, row in batch}:
+            written = self._written[session_id]
+            waiters = []
+            for target, waiter in self._waiters.pop(session_id, []):
+                if target <= written:
+                    if not waiter.done():
+                        waiter.set_result(None)
+                else:
+                    waiters.append((target, waiter))
+            if waiters:
+                self._waiters[session_id] = waiters
+            elif written >= self._submitted.get(session_id, 0):
+                # Caught up: forget the session so the counters don't grow with every room ever seen
+                del self._submitted[session_id]
+                del self._written[session_id]
+
+    async def _write_with_fallback(self, rows: List[Dict[str, Any]]):
+        try:
+            await self._write(rows)
+        except Exception:
+            logger.exception("Batch insert of %s chat messages failed, retrying row by row", len(rows))
+            for row in rows:
+                try:
+                    await self._write([row])
+                except Exception:
+                    self.rows_dropped += 1
+                    logger.exception("Dropping chat message for session %s", row.get("session_id"))
+
+    async def _write(self, rows: List[Dict[str, Any]]):
+        async with self.session_factory() as db:
+            conn = await db.connection()
+            if self.use_copy and conn.dialect.name == "postgresql" and len(rows) > 1:
+                raw = await conn.get_raw_connection()
+                await raw.driver_connection.copy_records_to_table(
+                    ChatMessage.__tablename__,
+                    records=[tuple(row[c] for c in COPY_COLUMNS) for row in rows],
+                    columns=COPY_COLUMNS
+                )
+            else:
+                await db.execute(insert(ChatMessage), rows)
+            await db.commit()
+
+        self.batches_written += 1
+        self.rows_written += len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches_written": self.batches_written,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped
+        }
+
+
+message_sink = MessageSink(
+    mode=settings.MESSAGE_SINK_MODE,
+    batch_size=settings.MESSAGE_SINK_BATCH_SIZE,
+    flush_interval=settings.MESSAGE_SINK_FLUSH_INTERVAL_MS / 1000,
+    max_queue=settings.MESSAGE_SINK_MAX_QUEUE,
+    use_copy=settings.MESSAGE_SINK_USE_COPY
+)
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from sqlalchemy import and_, column, delete, func, select, table, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from ..core.config import settings
+from ..db.database import get_async_engine
+from ..models.chat import ChatMessage
+from .archive import COLUMNS, MessageArchive, message_archive
+
+logger = logging.getLogger(__name__)
+
+# Held for the length of a run so only one worker maintains chat_messages at a time
+MAINTENANCE_LOCK_ID = 0x63686174
+
+_PARTITIONS = text("""
+SELECT c.relname FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'chat_messages'::regclass AND c.relname ~ '^chat_messages_p[0-9]{6}$'
+ORDER BY c.relname
+""")
+
+
+def month_start(moment: datetime) -> datetime:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    moment = moment.astimezone(timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+class MessageRetention:
+    """Periodic maintenance of chat_messages.
+
+    Creates monthly partitions ``months_ahead`` months in advance (Postgres)
+    and, when ``retention_months`` is set, moves every month older than that
+    into compressed archive files (see ``MessageArchive``) before removing it
+    from the database: expired partitions are detached and dropped on
+    Postgres, rows are deleted month by month elsewhere. Room counters on
+    chat_sessions are reduced by what was archived.
+
+    An archive file is complete on disk before its rows are removed, so a run
+    interrupted in between leaves the month in both places rather than in
+    neither. The next run rewrites that month's file, and rows already in the
+    file replace their old copies instead of being added a second time.
+    """
+
+    def __init__(
+        self,
+        archive: MessageArchive = message_archive,
+        engine_factory=get_async_engine,
+        months_ahead: int = 3,
+        retention_months: int = 0,
+        interval: float = 3600,
+        batch_size: int = 5000
+    ):
+        self.archive = archive
+        self.engine_factory = engine_factory
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("chat_messages maintenance failed")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Create upcoming partitions and archive expired months; returns what was archived"""
+        now = now or datetime.now(timezone.utc)
+        archived: Dict[str, int] = {}
+        async with self.engine_factory().connect() as conn:
+            postgres = conn.dialect.name == "postgresql"
+            if postgres:
+                locked = await conn.scalar(text("SELECT pg_try_advisory_lock(:id)"), {"id": MAINTENANCE_LOCK_ID})
+                await conn.commit()
+                if not locked:
+                    return {"archived": archived}
+            try:
+                if postgres:
+                    await self._ensure_partitions(conn, now)
+                if self.retention_months > 0:
+                    cutoff = add_months(month_start(now), -self.retention_months)
+                    if postgres:
+                        await self._archive_partitions(conn, cutoff, archived)
+                    # Rows outside monthly partitions (default partition, SQLite)
+                    await self._archive_rows(conn, cutoff, archived)
+            finally:
+                if postgres:
+                    await conn.rollback()
+                    await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MAINTENANCE_LOCK_ID})
+                    await conn.commit()
+        if archived:
+            logger.info("Archived chat messages by month: %s", archived)
+        return {"archived": archived}
+
+    async def _ensure_partitions(self, conn: AsyncConnection, now: datetime):
+        first = month_start(now)
+        for offset in range(self.months_ahead + 1):
+            month = add_months(first, offset)
+            await conn.execute(text("SELECT chat_messages_create_partition(:month)"), {"month": month.date()})
+        await conn.commit()
+
+    async def _archive_partitions(self, conn: AsyncConnection, cutoff: datetime, archived: Dict[str, int]):
+        names: List[str] = list(await conn.scalars(_PARTITIONS))
+        await conn.commit()
+        for name in names:
+            month = datetime.strptime(name[-6:], "%Y%m").replace(tzinfo=timezone.utc)
+            if add_months(month, 1) > cutoff:
+                continue
+            partition = table(name, *(column(c) for c in COLUMNS))
+            query = select(*partition.c).order_by(partition.c.session_id, partition.c.created_at, partition.c.id)
+            rows = await self._write_archive(conn, month, query)
+            if rows:
+                archived[f"{month:%Y-%m}"] = archived.get(f"{month:%Y-%m}", 0) + rows
+            # Dropping a partition skips the delete triggers, so settle the room counters here
+            await conn.execute(text(f"""
+                UPDATE chat_sessions s SET
+                    message_count = greatest(s.message_count - agg.n, 0),
+                    total_tokens = greatest(s.total_tokens - agg.tokens, 0)
+                FROM (
+                    SELECT session_id, count(*) AS n, sum(coalesce(tokens_used, 0)) AS tokens
+                    FROM "{name}" GROUP BY session_id
+                ) agg
+                WHERE s.id = agg.session_id
+            """))
+            await conn.execute(text(f'ALTER TABLE chat_messages DETACH PARTITION "{name}"'))
+            await conn.execute(text(f'DROP TABLE "{name}"'))
+            await conn.commit()
+
+    async def _archive_rows(self, conn: AsyncConnection, cutoff: datetime, archived: Dict[str, int]):
+        messages = ChatMessage.__table__
+        start: Optional[datetime] = None
+        while True:
+            # Jump straight to the next month that has rows
+            oldest_query = select(func.min(messages.c.created_at)).where(messages.c.created_at < cutoff)
+            if start is not None:
+                oldest_query = oldest_query.where(messages.c.created_at >= start)
+            oldest = await conn.scalar(oldest_query)
+            if oldest is None:
+                await conn.commit()
+                return
+            month = month_start(oldest)
+            start = add_months(month, 1)
+            in_month = and_(messages.c.created_at >= month, messages.c.created_at < min(start, cutoff))
+            query = (
+                select(*(messages.c[c] for c in COLUMNS))
+                .where(in_month)
+                .order_by(messages.c.session_id, messages.c.created_at, messages.c.id)
+            )
+            rows = await self._write_archive(conn, month, query)
+            if rows:
+                # The delete triggers keep the room counters in step
+                await conn.execute(delete(messages).where(in_month))
+                archived[f"{month:%Y-%m}"] = archived.get(f"{month:%Y-%m}", 0) + rows
+            await conn.commit()
+
+    async def _write_archive(self, conn: AsyncConnection, month: datetime, query) -> int:
+        """Stream ``query`` into ``month``'s archive file; returns the rows it added or replaced"""
+        writer = None
+        try:
+            result = await conn.stream(query.execution_options(yield_per=self.batch_size))
+            async for rows in result.mappings().partitions():
+                if writer is None:
+                    writer = await asyncio.to_thread(self.archive.writer, month)
+                await asyncio.to_thread(writer.write_rows, [dict(row) for row in rows])
+            if writer is not None:
+                await asyncio.to_thread(writer.close)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        return writer.rows_written - writer.rows_kept if writer is not None else 0
+
+
+message_retention = MessageRetention(
+    months_ahead=settings.CHAT_PARTITION_MONTHS_AHEAD,
+    retention_months=settings.CHAT_RETENTION_MONTHS,
+    interval=settings.CHAT_MAINTENANCE_INTERVAL
+)
+
+
+if __name__ == "__main__":
+    # One maintenance pass, e.g. from cron when the in-process job is disabled
+    logging.basicConfig(level=logging.INFO)
+    logger.info("chat_messages maintenance: %s", asyncio.run(message_retention.run_once()))
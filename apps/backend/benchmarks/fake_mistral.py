@@ -0,0 +1,156 @@
+"""
+Local stand-in for the Mistral chat completions API, for load tests.
+
+Serves ``POST /v1/chat/completions`` (plain and SSE streaming) and
+``GET /v1/models`` with configurable latency, error rate and streaming speed,
+so the backend can be benchmarked without network noise or API costs.
+
+    python -m benchmarks.fake_mistral --port 9000 --latency lognormal --latency-ms 400
+    MISTRAL_BASE_URL=http://127.0.0.1:9000/v1 MISTRAL_API_KEY=bench uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+LOREM = (
+    "FastAPI is a modern web framework for building APIs with Python based on standard type hints. "
+    "It is fast, easy to learn and ready for production."
+).split()
+
+
+@dataclass
+class FakeConfig:
+    latency: str = "fixed"  # fixed | uniform | lognormal
+    latency_ms: float = 200.0  # fixed value, uniform midpoint or lognormal median
+    jitter_ms: float = 100.0  # uniform half-width or lognormal spread (~p84 - median)
+    error_rate: float = 0.0
+    error_status: int = 503
+    retry_after: float = 0.0
+    response_words: int = 60
+    stream_chunk_words: int = 3
+    stream_tokens_per_sec: float = 200.0
+
+    def sample_latency(self) -> float:
+        """Seconds until the first byte"""
+        if self.latency == "uniform":
+            ms = random.uniform(self.latency_ms - self.jitter_ms, self.latency_ms + self.jitter_ms)
+        elif self.latency == "lognormal":
+            sigma = math.log1p(self.jitter_ms / self.latency_ms) if self.latency_ms > 0 else 0
+            ms = random.lognormvariate(math.log(max(self.latency_ms, 1e-3)), sigma)
+        else:
+            ms = self.latency_ms
+        return max(ms, 0.0) / 1000
+
+
+def _answer(words: int) -> list:
+    return [LOREM[i % len(LOREM)] for i in range(words)]
+
+
+def create_app(config: FakeConfig) -> Starlette:
+    stats = {"requests": 0, "errors": 0, "streams": 0}
+
+    async def completions(request: Request):
+        payload = await request.json()
+        stats["requests"] += 1
+        await asyncio.sleep(config.sample_latency())
+
+        if random.random() < config.error_rate:
+            stats["errors"] += 1
+            headers = {"Retry-After": str(config.retry_after)} if config.retry_after else None
+            return JSONResponse({"message": "simulated upstream error"}, status_code=config.error_status, headers=headers)
+
+        words = _answer(config.response_words)
+        prompt_tokens = sum(len(m.get("content", "").split()) for m in payload.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words)
+        }
+        completion_id = f"cmpl-{uuid.uuid4().hex[:12]}"
+        model = payload.get("model", "mistral-small-latest")
+
+        if not payload.get("stream"):
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+
+        stats["streams"] += 1
+
+        async def events():
+            step = config.stream_chunk_words
+            delay = step / config.stream_tokens_per_sec if config.stream_tokens_per_sec > 0 else 0
+            for i in range(0, len(words), step):
+                text = " ".join(words[i:i + step]) + (" " if i + step < len(words) else "")
+                chunk = {"id": completion_id, "model": model, "choices": [{"index": 0, "delta": {"content": text}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(delay)
+            final = {"id": completion_id, "model": model, "choices": [], "usage": usage}
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def models(request: Request):
+        return JSONResponse({"object": "list", "data": [{"id": "mistral-small-latest", "object": "model"}]})
+
+    async def fake_stats(request: Request):
+        return JSONResponse(stats)
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", completions, methods=["POST"]),
+        Route("/v1/models", models),
+        Route("/stats", fake_stats)
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="fixed")
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=0.0, help="Retry-After seconds sent with errors")
+    parser.add_argument("--response-words", type=int, default=60)
+    parser.add_argument("--stream-chunk-words", type=int, default=3)
+    parser.add_argument("--stream-tokens-per-sec", type=float, default=200.0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = FakeConfig(
+        latency=args.latency,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        response_words=args.response_words,
+        stream_chunk_words=args.stream_chunk_words,
+        stream_tokens_per_sec=args.stream_tokens_per_sec
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Load drivers for the backend: login, POST /chat/message and WebSocket rooms.
+
+Each scenario reports throughput and latency percentiles; results are written
+as JSON together with the git commit and the run configuration so runs of
+different commits can be compared.
+
+    python -m benchmarks.loadtest login --concurrency 20 --duration 30
+    python -m benchmarks.loadtest message --concurrency 50 --requests 2000
+    python -m benchmarks.loadtest ws --rooms 20 --clients 500 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import websockets
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: Dict[str, int]) -> Dict[str, Any]:
+    """Latencies in seconds -> report in requests/sec and milliseconds"""
+    ms = lambda value: None if value is None else round(value * 1000, 2)
+    total = len(latencies) + sum(errors.values())
+    return {
+        "requests": total,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 0.50)),
+            "p95": ms(percentile(latencies, 0.95)),
+            "p99": ms(percentile(latencies, 0.99)),
+            "max": ms(max(latencies) if latencies else None)
+        }
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+async def run_closed_loop(
+    request: Callable[[], Awaitable[None]],
+    concurrency: int,
+    duration: Optional[float],
+    total: Optional[int]
+) -> Dict[str, Any]:
+    """``concurrency`` workers issue ``request`` back to back until ``total`` or ``duration`` is reached"""
+    recorder = Recorder()
+    remaining = [total]
+    deadline = time.perf_counter() + duration if duration else None
+
+    def more() -> bool:
+        if deadline is not None and time.perf_counter() >= deadline:
+            return False
+        if remaining[0] is not None:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+        return True
+
+    async def worker():
+        while more():
+            started = time.perf_counter()
+            try:
+                await request()
+            except httpx.HTTPStatusError as exc:
+                recorder.error(str(exc.response.status_code))
+                continue
+            except Exception as exc:
+                recorder.error(type(exc).__name__)
+                continue
+            recorder.latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(recorder.latencies, time.perf_counter() - started, recorder.errors)
+
+
+async def ensure_user(client: httpx.AsyncClient, email: str, password: str) -> str:
+    """Register (if needed) and log in; returns a bearer token"""
+    username = email.split("@")[0]
+    response = await client.post("/auth/register", json={"email": email, "username": username, "password": password})
+    if response.status_code not in (201, 400):
+        response.raise_for_status()
+    response = await client.post("/auth/login", json={"email": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def scenario_login(args, client: httpx.AsyncClient) -> Dict[str, Any]:
+    await ensure_user(client, args.email, args.password)
+
+    async def request():
+        response = await client.post("/auth/login", json={"email": args.email, "password": args.password})
+        response.raise_for_status()
+
+    return await run_closed_loop(request, args.concurrency, args.duration, args.requests)
+
+
+async def scenario_message(args, client: httpx.AsyncClient) -> Dict[str, Any]:
+    token = await ensure_user(client, args.email, args.password)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async def request():
+        payload = {"message": f"benchmark {uuid.uuid4().hex[:8]}: {args.prompt}", "model": args.model}
+        if args.room:
+            payload["room_id"] = args.room
+        response = await client.post("/chat/message", json=payload, headers=headers)
+        response.raise_for_status()
+
+    return await run_closed_loop(request, args.concurrency, args.duration, args.requests)
+
+
+async def scenario_ws(args, client: httpx.AsyncClient) -> Dict[str, Any]:
+    """``clients`` sockets spread over ``rooms``; a fraction of them send messages.
+
+    Latency is measured from sending a message to the sender receiving the
+    room broadcast of it; messages/sec counts every frame received by every
+    client, i.e. the fan-out the server sustained.
+    """
+    token = await ensure_user(client, args.email, args.password)
+    ws_base = args.base_url.replace("http://", "ws://", 1).replace("https://", "wss://", 1).rstrip("/")
+    run_id = uuid.uuid4().hex[:6]
+    rooms = [f"bench-{run_id}-{i}" for i in range(args.rooms)]
+    senders = max(1, int(args.clients * args.sender_fraction))
+
+    recorder = Recorder()
+    received = [0]
+    connected = [0]
+    failed = [0]
+    stop = asyncio.Event()
+    ready = asyncio.Event()
+
+    async def client_loop(index: int):
+        room = rooms[index % len(rooms)]
+        pending: Dict[str, float] = {}
+        try:
+            async with websockets.connect(f"{ws_base}/ws/{room}?token={token}", max_queue=None) as ws:
+                connected[0] += 1
+                if connected[0] + failed[0] == args.clients:
+                    ready.set()
+
+                async def reader():
+                    async for frame in ws:
+                        received[0] += 1
+                        data = json.loads(frame)
+                        if data.get("type") == "user":
+                            sent_at = pending.pop(data.get("message", ""), None)
+                            if sent_at is not None:
+                                recorder.latencies.append(time.perf_counter() - sent_at)
+                        elif data.get("type") == "error":
+                            recorder.error("server_error")
+
+                read_task = asyncio.create_task(reader())
+                try:
+                    await ready.wait()
+                    if index < senders:
+                        interval = 1.0 / args.message_rate
+                        while not stop.is_set():
+                            await asyncio.sleep(random.expovariate(1.0 / interval))
+                            text = f"{args.prompt} {uuid.uuid4().hex[:12]}"
+                            pending[text] = time.perf_counter()
+                            await ws.send(json.dumps({"message": text, "model": args.model}))
+                    await stop.wait()
+                finally:
+                    read_task.cancel()
+                    if pending:
+                        recorder.errors["unanswered_at_stop"] = recorder.errors.get("unanswered_at_stop", 0) + len(pending)
+        except Exception as exc:
+            recorder.error(type(exc).__name__)
+            failed[0] += 1
+            if connected[0] + failed[0] == args.clients:
+                ready.set()
+
+    tasks = [asyncio.create_task(client_loop(i)) for i in range(args.clients)]
+    await asyncio.wait_for(ready.wait(), timeout=args.connect_timeout)
+    received_before = received[0]
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration or 30)
+    elapsed = time.perf_counter() - started
+    delivered = received[0] - received_before
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    report = summarize(recorder.latencies, elapsed, recorder.errors)
+    report.update({
+        "connected": connected[0],
+        "frames_received": delivered,
+        "messages_per_sec": round(delivered / elapsed, 2) if elapsed > 0 else None
+    })
+    return report
+
+
+SCENARIOS = {"login": scenario_login, "message": scenario_message, "ws": scenario_ws}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def git_dirty() -> Optional[bool]:
+    try:
+        return bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        result = await SCENARIOS[args.scenario](args, client)
+    return {
+        "scenario": args.scenario,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "git_dirty": git_dirty(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("password", "output")},
+        "result": result
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--base-url", default=os.getenv("BENCH_BASE_URL", "http://127.0.0.1:8000/api/v1"))
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=None, help="seconds to run (ws defaults to 30)")
+    parser.add_argument("--requests", type=int, default=None, help="stop after this many requests")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--email", default="bench@example.com")
+    parser.add_argument("--password", default="bench-password-123")
+    parser.add_argument("--model", default="mistral-small-latest")
+    parser.add_argument("--prompt", default="Say hello in one sentence.")
+    parser.add_argument("--room", default=None, help="message: room_id to send with each request")
+    parser.add_argument("--rooms", type=int, default=10, help="ws: number of rooms")
+    parser.add_argument("--clients", type=int, default=100, help="ws: sockets in total")
+    parser.add_argument("--sender-fraction", type=float, default=0.1, help="ws: share of sockets that send")
+    parser.add_argument("--message-rate", type=float, default=0.5, help="ws: messages/sec per sender")
+    parser.add_argument("--connect-timeout", type=float, default=60.0)
+    parser.add_argument("--output", default=None, help="JSON results file (default benchmarks/results/<scenario>-<time>.json)")
+    args = parser.parse_args()
+    if args.scenario != "ws" and args.duration is None and args.requests is None:
+        args.requests = 1000
+
+    report = asyncio.run(run(args))
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "results",
+        f"{args.scenario}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    json.dump(report["result"], sys.stdout, indent=2)
+    print(f"\nresults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
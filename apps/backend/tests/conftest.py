@@ -0,0 +1,22 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Must be set before app.core.config is imported
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+
+import pytest
+from alembic import command
+from alembic.config import Config
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database_schema():
+    """Create the test schema with the same migrations production runs (the app no longer creates tables)"""
+    # No ini file: alembic.ini's logging config would replace the test run's loggers
+    config = Config()
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "alembic"))
+    command.upgrade(config, "head")
+    yield
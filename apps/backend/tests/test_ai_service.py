@@ -0,0 +1,276 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import json
+import time
+import httpx
+from types import SimpleNamespace
+from app.core.cache import LRUCache, MemoryCacheBackend, ResponseCache
+from app.core.concurrency import AIMDLimiter
+from app.core.metrics import upstream_request_duration
+from app.core.resilience import UpstreamPolicies
+from app.services.ai_service import (
+    MAX_RESPONSE_TOKENS, OVERLOADED_MESSAGE, UNAVAILABLE_MESSAGE, MistralAIService,
+    classify_upstream_error, is_upstream_overload
+)
+from app.services.context_builder import ContextBuilder
+
+
+def _completion(content="Hello!", tokens=12):
+    return {
+        "choices": [{"message": {"role": "assistant", "content": content}}],
+        "usage": {"total_tokens": tokens}
+    }
+
+
+def test_generate_response_reuses_pooled_client():
+    """Test every call goes through the same long-lived client"""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(200, json=_completion())
+
+    service = MistralAIService(transport=httpx.MockTransport(handler))
+
+    async def run():
+        first = await service.generate_response("Hi", temperature=0.7)
+        client = service.client
+        second = await service.generate_response("Hi again", temperature=0.7)
+        assert service.client is client
+        await service.shutdown()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first["response"] == "Hello!"
+    assert second["tokens_used"] == 12
+    assert len(calls) == 2
+    assert calls[0].url.path.endswith("/chat/completions")
+    assert calls[0].headers["Authorization"].startswith("Bearer ")
+
+
+def test_stream_response_yields_deltas_then_done():
+    """Test SSE chunks are forwarded as deltas and assembled in the final event"""
+    chunks = [
+        {"choices": [{"delta": {"role": "assistant", "content": ""}}]},
+        {"choices": [{"delta": {"content": "Hel"}}]},
+        {"choices": [{"delta": {"content": "lo"}}], "usage": {"total_tokens": 7}},
+    ]
+    body = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+
+    service = MistralAIService(transport=httpx.MockTransport(handler))
+
+    async def run():
+        events = [event async for event in service.stream_response("Hi")]
+        await service.shutdown()
+        return events
+
+    events = asyncio.run(run())
+    assert [e["content"] for e in events if e["type"] == "delta"] == ["Hel", "lo"]
+    assert events[-1]["type"] == "done"
+    assert events[-1]["response"] == "Hello"
+    assert events[-1]["tokens_used"] == 7
+
+
+def test_lru_cache_evicts_by_size_and_ttl():
+    """Test the LRU drops least recently used entries past its byte budget and expired ones"""
+    cache = LRUCache(max_entries=10, max_bytes=10)
+    cache.set("a", b"12345")
+    cache.set("b", b"12345")
+    cache.get("a")
+    cache.set("c", b"123")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+    assert cache.current_bytes == 8
+
+    cache.set("d", b"x", ttl=-1)
+    assert cache.get("d") is None
+
+
+def test_deterministic_completions_are_cached():
+    """Test temperature=0 requests hit the cache while sampled ones go upstream"""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(200, json=_completion())
+
+    cache = ResponseCache(MemoryCacheBackend())
+    service = MistralAIService(transport=httpx.MockTransport(handler), cache=cache)
+
+    async def run():
+        first = await service.generate_response("What is FastAPI?", temperature=0)
+        second = await service.generate_response("  What is FastAPI?\n", temperature=0)
+        await service.generate_response("What is FastAPI?", temperature=0.7)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert second["response"] == first["response"]
+    assert second["cached"] is True
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_identical_concurrent_requests_share_one_upstream_call():
+    """Test concurrent identical prompts are coalesced and survive a cancelled waiter"""
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json=_completion("Shared answer"))
+
+    service = MistralAIService(transport=httpx.MockTransport(handler), cache=ResponseCache(MemoryCacheBackend()))
+
+    async def run():
+        tasks = [asyncio.create_task(service.generate_response("Same prompt")) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        tasks[0].cancel()
+        results = await asyncio.gather(*tasks[1:])
+        assert tasks[0].cancelled()
+        await service.shutdown()
+        return results
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(r["response"] == "Shared answer" for r in results)
+    assert service.single_flight.stats()["coalesced"] == 4
+
+
+def test_context_builder_keeps_recent_turns_and_summarizes_the_rest():
+    """Test the context fits the model budget and evicted turns roll into the summary"""
+    builder = ContextBuilder(session_factory=None)
+    builder.summary_budget = 100
+    builder._budgets = {"tiny": MAX_RESPONSE_TOKENS + 100 + 60}
+
+    def row(id, sender, content):
+        return SimpleNamespace(id=id, sender=sender, content=content)
+
+    history = [row(i, "user" if i % 2 else "ai", f"Turn {i}. " + "word " * 20) for i in range(1, 7)]
+    newest_first = list(reversed(history))
+
+    context = builder.fit(1, "tiny", newest_first, "next question")
+    assert context[0]["role"] == "system"
+    assert "User: Turn 1." in context[0]["content"]
+    assert context[-1]["content"].startswith("Turn 6.")
+    assert [m["role"] for m in context[1:]] == ["assistant"]
+
+    # Only turns that newly left the window are folded in
+    history.append(row(7, "user", "Turn 7. " + "word " * 20))
+    context = builder.fit(1, "tiny", list(reversed(history)), "next question")
+    summary = context[0]["content"]
+    assert summary.count("Turn 1.") == 1
+    assert "Assistant: Turn 6." in summary
+    assert [m["content"][:7] for m in context[1:]] == ["Turn 7."]
+
+    # Small conversations are sent whole, without a summary
+    context = builder.fit(2, "mistral-small-latest", newest_first[:2])
+    assert [m["content"] for m in context] == [history[4].content, history[5].content]
+
+
+def test_adaptive_limiter_backs_off_and_sheds_excess_requests():
+    """Test the limit shrinks on upstream 503s, grows on fast successes and sheds a full queue"""
+    status = {"code": 503}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.02)
+        return httpx.Response(status["code"], json=_completion())
+
+    limiter = AIMDLimiter(
+        initial_limit=4, min_limit=1, max_limit=8, cooldown=0, max_queue=1, queue_timeout=1,
+        is_overload=is_upstream_overload
+    )
+    no_retries = UpstreamPolicies(classify_upstream_error, {"max_attempts": 1})
+    service = MistralAIService(transport=httpx.MockTransport(handler), limiter=limiter, policies=no_retries)
+
+    async def run():
+        await service.generate_response("fail", temperature=0.5)
+        assert limiter.limit == 2
+
+        status["code"] = 200
+        for i in range(2):
+            await service.generate_response(f"ok {i}", temperature=0.5)
+        assert 2 < limiter.limit < 3
+
+        # Two in flight, one queued, the rest shed straight away
+        results = await asyncio.gather(*(service.generate_response(f"burst {i}", temperature=0.5) for i in range(5)))
+        await service.shutdown()
+        return results
+
+    results = asyncio.run(run())
+    assert sum(r["response"] == OVERLOADED_MESSAGE for r in results) == 2
+    assert limiter.stats()["shed"] == 2
+    assert limiter.in_flight == 0
+
+
+def test_transient_errors_are_retried_and_the_circuit_opens():
+    """Test 503s honour Retry-After, give up on 4xx and trip the breaker when the provider is down"""
+    responses = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        status = responses.pop(0) if responses else 503
+        return httpx.Response(status, json=_completion(), headers={"Retry-After": "0"})
+
+    policies = UpstreamPolicies(classify_upstream_error, {
+        "max_attempts": 3, "base_delay": 0, "failure_threshold": 4, "reset_timeout": 60
+    })
+    service = MistralAIService(transport=httpx.MockTransport(handler), policies=policies)
+
+    async def run():
+        responses.extend([503, 429, 200])
+        recovered = await service.generate_response("retry me", temperature=0.5)
+
+        responses.extend([400])
+        rejected = await service.generate_response("bad request", temperature=0.5)
+
+        # Provider down: 3 failed attempts, then the 4th failure opens the circuit
+        await service.generate_response("down", temperature=0.5)
+        failed = await service.generate_response("still down", temperature=0.5)
+        fast = await service.generate_response("fail fast", temperature=0.5)
+        await service.shutdown()
+        return recovered, rejected, failed, fast
+
+    recovered, rejected, failed, fast = asyncio.run(run())
+    stats = policies.for_model("mistral-small-latest").stats()
+    assert recovered["response"] == "Hello!"
+    assert rejected["response"] != "Hello!"
+    assert failed["response"] != "Hello!"
+    assert fast["response"] == UNAVAILABLE_MESSAGE
+    assert stats["circuit"] == "open"
+    assert stats["retries"] == 2 + 2 + 1
+    assert upstream_request_duration.count(model="mistral-small-latest", status="503") >= 4
+
+
+def test_slow_attempts_are_hedged():
+    """Test a request slower than the recent p95 gets a second copy and the faster one wins"""
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        # Every 25th request hangs; its hedge answers at normal speed
+        await asyncio.sleep(5 if len(calls) == 25 else 0.001)
+        return httpx.Response(200, json=_completion(f"answer {len(calls)}"))
+
+    policies = UpstreamPolicies(classify_upstream_error, {"hedge": True, "hedge_min_delay": 0.01})
+    service = MistralAIService(transport=httpx.MockTransport(handler), cache=None, policies=policies)
+
+    async def run():
+        for i in range(24):
+            await service.generate_response(f"warm {i}", temperature=0.5)
+        started = time.monotonic()
+        result = await service.generate_response("slow one", temperature=0.5)
+        elapsed = time.monotonic() - started
+        await service.shutdown()
+        return result, elapsed
+
+    result, elapsed = asyncio.run(run())
+    assert result["response"] == "answer 26"
+    assert elapsed < 1
+    assert policies.for_model("mistral-small-latest").stats()["hedge_wins"] == 1
@@ -2,9 +2,17 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import asyncio
+import threading
+import uuid
 import pytest
 from fastapi.testclient import TestClient
+from passlib.context import CryptContext
+from sqlalchemy import event
 from app.main import app
+from app.core.security import calibrate_bcrypt_rounds, needs_rehash, password_hash_pool
+from app.db.database import SessionLocal, async_engine
+from app.models.user import User
 
 client = TestClient(app)
 
@@ -66,3 +74,118 @@ def test_login_nonexistent_user():
         "password": "anypassword"
     })
     assert response.status_code == 401
+
+
+def test_login_rehashes_outdated_password_hash():
+    """Test login transparently upgrades hashes made with other bcrypt parameters"""
+    user = {
+        "email": "rehash@example.com",
+        "username": "rehashuser",
+        "password": "testpassword123"
+    }
+    client.post("/api/v1/auth/register", json=user)
+
+    legacy = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4, bcrypt__ident="2b")
+    db = SessionLocal()
+    try:
+        db_user = db.query(User).filter(User.email == user["email"]).first()
+        db_user.hashed_password = legacy.hash(user["password"])
+        db.commit()
+    finally:
+        db.close()
+
+    response = client.post("/api/v1/auth/login", json={
+        "email": user["email"],
+        "password": user["password"]
+    })
+    assert response.status_code == 200
+
+    db = SessionLocal()
+    try:
+        db_user = db.query(User).filter(User.email == user["email"]).first()
+        assert not needs_rehash(db_user.hashed_password)
+    finally:
+        db.close()
+
+
+def test_saturated_hash_pool_returns_503_with_retry_after():
+    """Test register and login are shed with 503 + Retry-After while the hashing pool is full"""
+    suffix = uuid.uuid4().hex[:8]
+    user = {"email": f"busy_{suffix}@example.com", "username": f"busy_{suffix}", "password": "testpassword123"}
+    assert client.post("/api/v1/auth/register", json=user).status_code == 201
+
+    release = threading.Event()
+    occupied = threading.Event()
+
+    def blocker():
+        occupied.set()
+        release.wait(10)
+
+    # One hash held in the pool from another thread fills it
+    max_pending = password_hash_pool.max_pending
+    password_hash_pool.max_pending = 1
+    holder = threading.Thread(target=lambda: asyncio.run(password_hash_pool.run(blocker)))
+    holder.start()
+    try:
+        assert occupied.wait(5)
+        other = {**user, "email": f"busy2_{suffix}@example.com", "username": f"busy2_{suffix}"}
+        for response in (
+            client.post("/api/v1/auth/register", json=other),
+            client.post("/api/v1/auth/login", json={"email": user["email"], "password": user["password"]})
+        ):
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "1"
+        assert password_hash_pool.rejected >= 2
+    finally:
+        release.set()
+        holder.join(5)
+        password_hash_pool.max_pending = max_pending
+
+    response = client.post("/api/v1/auth/login", json={"email": user["email"], "password": user["password"]})
+    assert response.status_code == 200
+
+
+def test_calibrated_rounds_stay_within_bounds():
+    """Test bcrypt cost calibration is clamped to the configured range"""
+    assert calibrate_bcrypt_rounds(0.001, min_rounds=4, max_rounds=6) == 4
+    assert calibrate_bcrypt_rounds(10 ** 9, min_rounds=4, max_rounds=6) == 6
+
+
+def test_current_user_is_cached_and_invalidated_on_update():
+    """Test authenticated requests skip the users query until the user row changes"""
+    user = {
+        "email": "cached@example.com",
+        "username": "cacheduser",
+        "password": "testpassword123"
+    }
+    client.post("/api/v1/auth/register", json=user)
+    token = client.post("/api/v1/auth/login", json={
+        "email": user["email"],
+        "password": user["password"]
+    }).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.get("/api/v1/chat/rooms", headers=headers)
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = client.get("/api/v1/chat/rooms", headers=headers)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert not any("FROM users" in s for s in statements)
+
+    db = SessionLocal()
+    try:
+        db_user = db.query(User).filter(User.email == user["email"]).first()
+        db_user.is_active = False
+        db.commit()
+    finally:
+        db.close()
+
+    response = client.get("/api/v1/chat/rooms", headers=headers)
+    assert response.status_code == 400
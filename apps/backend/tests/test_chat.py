@@ -2,15 +2,664 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import asyncio
+import gzip
+import json
+import time
+import uuid
+from datetime import datetime
 from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
 from app.main import app
+from app.crud.chat import chat_session, chat_message
+from app.db.database import AsyncSessionLocal, SessionLocal, get_async_db
+from app.models.user import User
+from app.schemas.chat import ChatMessageCreate
+from app.services.message_sink import MessageSink
+from app.services.history import history_transfer
+from app.services.ai_service import ai_service
+from app.core.pubsub import InMemoryBroker
+from app.core.websocket_manager import ConnectionManager, manager
+from app.core.metrics import db_commit_duration, instrument_engine
+from app.core.rate_limit import MemoryRateLimitBackend, RateLimiter, RateLimitMiddleware
+from app.core import serialization
+from app.core.config import settings
 
 client = TestClient(app)
 
 
+class FakeWebSocket:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        self.subprotocol = subprotocol
+
+    async def send_text(self, message):
+        await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    async def send_bytes(self, message):
+        await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
 def test_health_endpoint():
     """Test health check endpoint returns healthy status"""
     response = client.get("/api/v1/health")
     assert response.status_code == 200
     data = response.json()
     assert data.get("status") == "healthy"
+
+
+def _auth_token():
+    suffix = uuid.uuid4().hex[:8]
+    user = {
+        "email": f"chat_{suffix}@example.com",
+        "username": f"chat_{suffix}",
+        "password": "testpassword123"
+    }
+    client.post("/api/v1/auth/register", json=user)
+    response = client.post("/api/v1/auth/login", json={
+        "email": user["email"],
+        "password": user["password"]
+    })
+    return response.json()["access_token"]
+
+
+def test_websocket_connect_creates_room():
+    """Test WebSocket connection greets the user and creates the room session"""
+    token = _auth_token()
+    room_id = f"room-{uuid.uuid4().hex[:8]}"
+    with client.websocket_connect(f"/api/v1/ws/{room_id}?token={token}") as websocket:
+        welcome = websocket.receive_json()
+        assert welcome["type"] == "system"
+        assert room_id in welcome["message"]
+
+    response = client.get("/api/v1/chat/rooms", headers={"Authorization": f"Bearer {token}"})
+    assert room_id in [room["room_id"] for room in response.json()["items"]]
+
+
+def _receive_until(websocket, predicate):
+    """Frames up to and including the first one matching ``predicate``"""
+    frames = []
+    while not frames or not predicate(frames[-1]):
+        frames.append(websocket.receive_json())
+    return frames
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_websocket_keeps_reading_while_generating_and_cancels_turns():
+    """Test pings and follow-ups are handled mid-generation, cancel aborts the upstream call, and so does leaving"""
+    started = []
+    cancelled = []
+
+    async def fake_generate(message, model, temperature=0.7, use_cache=None, context=None):
+        started.append(message)
+        try:
+            await asyncio.sleep(30 if message == "slow" else 0)
+        except asyncio.CancelledError:
+            cancelled.append(message)
+            raise
+        return {"response": f"answer {message}", "model": model, "tokens_used": 1, "response_time_ms": 1}
+
+    token = _auth_token()
+    room_id = f"room-{uuid.uuid4().hex[:8]}"
+    original = ai_service.generate_response
+    ai_service.generate_response = fake_generate
+    try:
+        with client.websocket_connect(f"/api/v1/ws/{room_id}?token={token}") as websocket:
+            websocket.receive_json()
+            websocket.send_json({"message": "slow", "id": "a"})
+            frames = _receive_until(websocket, lambda f: f["type"] == "queued")
+            assert frames[-1]["id"] == "a" and frames[-1]["ahead"] == 0
+
+            # The socket is not deaf while "a" is being answered
+            websocket.send_json({"type": "ping"})
+            assert _receive_until(websocket, lambda f: f["type"] == "pong")
+            websocket.send_json({"message": "fast", "id": "b"})
+            frames = _receive_until(websocket, lambda f: f["type"] == "queued")
+            assert frames[-1]["id"] == "b" and frames[-1]["ahead"] == 1
+
+            assert _wait_for(lambda: started == ["slow"])
+            websocket.send_json({"type": "cancel", "id": "a"})
+            frames = _receive_until(websocket, lambda f: f["type"] == "ai")
+            assert any(f["type"] == "cancelled" and f["id"] == "a" for f in frames)
+            assert frames[-1]["id"] == "b" and frames[-1]["message"] == "answer fast"
+            assert cancelled == ["slow"]
+
+            websocket.send_json({"message": "slow", "id": "c"})
+            assert _wait_for(lambda: len(started) == 3)
+
+        # Leaving the room aborts the reply nobody will read
+        assert _wait_for(lambda: len(cancelled) == 2)
+    finally:
+        ai_service.generate_response = original
+
+
+def test_websocket_answers_bad_frames_and_releases_the_room():
+    """Test malformed and non-object frames get an error frame, and leaving frees the room's subscription"""
+    token = _auth_token()
+    room_id = f"room-{uuid.uuid4().hex[:8]}"
+    with client.websocket_connect(f"/api/v1/ws/{room_id}?token={token}") as websocket:
+        websocket.receive_json()
+        assert room_id in manager.active_connections
+        websocket.send_text("{not json")
+        assert websocket.receive_json()["type"] == "error"
+        websocket.send_json(["message", "hi"])
+        assert websocket.receive_json()["type"] == "error"
+        # Still connected and reading
+        websocket.send_json({"type": "ping"})
+        assert _receive_until(websocket, lambda f: f["type"] == "pong")
+
+    assert _wait_for(lambda: room_id not in manager.active_connections)
+
+
+def test_message_sink_batches_and_flushes_on_stop():
+    """Test write-behind persistence writes queued messages in one batch on shutdown"""
+    suffix = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    try:
+        user = User(email=f"sink_{suffix}@example.com", username=f"sink_{suffix}", hashed_password="x")
+        db.add(user)
+        db.commit()
+        session = chat_session.create(db, user_id=user.id, room_id=f"sink-{suffix}")
+    finally:
+        db.close()
+
+    sink = MessageSink(mode="async", batch_size=50, flush_interval=1.0)
+
+    async def run():
+        await sink.start()
+        for i in range(5):
+            await sink.submit(ChatMessageCreate(session_id=session.id, content=f"msg {i}", sender="user"))
+        await sink.stop()
+
+    asyncio.run(run())
+    assert sink.batches_written == 1
+    assert sink.rows_written == 5
+
+    db = SessionLocal()
+    try:
+        messages = chat_message.get_session_messages(db, session_id=session.id)
+        assert [m.content for m in messages] == [f"msg {i}" for i in range(5)]
+    finally:
+        db.close()
+
+
+def test_message_sink_flushes_one_session_without_waiting_for_others():
+    """Test flush_session waits for that session's rows only, not for the whole queue"""
+    release = asyncio.Event()
+    written = []
+
+    class SlowSink(MessageSink):
+        async def _write(self, rows):
+            if any(row["session_id"] == 1 for row in rows):
+                await release.wait()
+            written.extend(row["session_id"] for row in rows)
+
+    sink = SlowSink(mode="async", batch_size=50, flush_interval=0.01)
+
+    async def run():
+        await sink.start()
+        await sink.submit(ChatMessageCreate(session_id=1, content="stuck", sender="user"))
+        await asyncio.sleep(0.05)
+        # Session 2 has nothing buffered: no waiting behind session 1's stuck batch
+        await asyncio.wait_for(sink.flush_session(2), 1)
+
+        flushed = asyncio.ensure_future(sink.flush_session(1))
+        await asyncio.sleep(0.05)
+        assert not flushed.done()
+        release.set()
+        await asyncio.wait_for(flushed, 1)
+        assert written == [1]
+        # Caught-up sessions are forgotten
+        assert sink._submitted == {} and sink._written == {}
+        await sink.stop()
+
+    asyncio.run(run())
+
+
+def test_room_history_is_paginated_with_cursors():
+    """Test message history pages walk newest to oldest and end with no cursor"""
+    token = _auth_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    room_id = f"history-{uuid.uuid4().hex[:8]}"
+    room = client.post("/api/v1/chat/rooms", json={"room_id": room_id}, headers=headers).json()
+
+    db = SessionLocal()
+    try:
+        for i in range(5):
+            chat_message.create(db, obj_in=ChatMessageCreate(session_id=room["id"], content=f"msg {i}", sender="user"))
+    finally:
+        db.close()
+
+    seen = []
+    cursor = None
+    for _ in range(10):
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get(f"/api/v1/chat/rooms/{room_id}/messages", params=params, headers=headers)
+        assert response.status_code == 200
+        page = response.json()
+        seen.extend(m["content"] for m in page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    else:
+        raise AssertionError("pagination did not terminate")
+
+    assert seen == [f"msg {i}" for i in reversed(range(5))]
+
+    response = client.get(f"/api/v1/chat/rooms/{room_id}/messages", params={"cursor": "bogus"}, headers=headers)
+    assert response.status_code == 400
+
+
+def test_room_list_carries_counters_maintained_on_insert():
+    """Test the room list reports message count, token total and latest preview from every insert path"""
+    token = _auth_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    room_id = f"summary-{uuid.uuid4().hex[:8]}"
+    room = client.post("/api/v1/chat/rooms", json={"room_id": room_id}, headers=headers).json()
+    assert room["message_count"] == 0 and room["last_message_preview"] is None
+
+    db = SessionLocal()
+    try:
+        chat_message.create(db, obj_in=ChatMessageCreate(session_id=room["id"], content="hello", sender="user"))
+    finally:
+        db.close()
+
+    sink = MessageSink(mode="async", batch_size=50, flush_interval=1.0)
+
+    async def run():
+        await sink.start()
+        for i in range(3):
+            await sink.submit(ChatMessageCreate(
+                session_id=room["id"], content=f"reply {i} " + "x" * 300, sender="ai", tokens_used=10
+            ))
+        await sink.stop()
+
+    asyncio.run(run())
+
+    rooms = client.get("/api/v1/chat/rooms", headers=headers).json()["items"]
+    summary = next(r for r in rooms if r["room_id"] == room_id)
+    assert summary["message_count"] == 4
+    assert summary["total_tokens"] == 30
+    assert summary["last_message_preview"].startswith("reply 2 ")
+    assert len(summary["last_message_preview"]) == 200
+    assert summary["last_message_at"] is not None
+
+
+def test_message_endpoints_release_the_db_session_before_calling_the_ai():
+    """Test /message and /message/stream don't hold a transaction open across the upstream call"""
+    headers = {"Authorization": f"Bearer {_auth_token()}"}
+    room_id = f"release-{uuid.uuid4().hex[:8]}"
+    client.post("/api/v1/chat/rooms", json={"room_id": room_id}, headers=headers)
+    sessions = []
+    held = []
+
+    async def tracked_db():
+        async with AsyncSessionLocal() as db:
+            sessions.append(db)
+            yield db
+
+    async def fake_generate(message, model, temperature=0.7, use_cache=None, context=None):
+        held.append(sessions[-1].in_transaction())
+        return {"response": "ok", "model": model, "tokens_used": 1, "response_time_ms": 1}
+
+    async def fake_stream(message, model, temperature=0.7, use_cache=None, context=None):
+        held.append(sessions[-1].in_transaction())
+        yield {"type": "done", "response": "ok", "model": model, "tokens_used": 1, "response_time_ms": 1}
+
+    original_generate, original_stream = ai_service.generate_response, ai_service.stream_response
+    ai_service.generate_response, ai_service.stream_response = fake_generate, fake_stream
+    app.dependency_overrides[get_async_db] = tracked_db
+    try:
+        body = {"message": "hi", "room_id": room_id}
+        assert client.post("/api/v1/chat/message", json=body, headers=headers).status_code == 200
+        assert client.post("/api/v1/chat/message/stream", json=body, headers=headers).status_code == 200
+    finally:
+        app.dependency_overrides.pop(get_async_db, None)
+        ai_service.generate_response, ai_service.stream_response = original_generate, original_stream
+    assert held == [False, False]
+
+
+def test_batch_streams_results_as_they_finish_with_isolated_errors():
+    """Test /chat/batch respects the concurrency cap, streams in completion order and isolates failures"""
+    headers = {"Authorization": f"Bearer {_auth_token()}"}
+    in_flight = 0
+    peak = 0
+
+    async def fake_generate(message, model, temperature=0.7, use_cache=None, context=None):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            await asyncio.sleep(float(message) / 1000)
+            if message == "13":
+                raise RuntimeError("upstream exploded")
+            return {"response": f"answer {message}", "model": model, "tokens_used": 1, "response_time_ms": 1}
+        finally:
+            in_flight -= 1
+
+    delays = [60, 10, 40, 13, 20]
+    items = [{"message": str(delay)} for delay in delays] + [{"message": "5", "room_id": "no-such-room"}]
+    original = ai_service.generate_response
+    ai_service.generate_response = fake_generate
+    try:
+        response = client.post("/api/v1/chat/batch", json={"items": items, "concurrency": 2}, headers=headers)
+    finally:
+        ai_service.generate_response = original
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["index"] for line in lines) == list(range(6))
+    by_index = {line["index"]: line for line in lines}
+    # The missing room fails without waiting for a slot
+    assert lines[0] == {"index": 5, "status": 404, "detail": "Room not found"}
+    assert by_index[3] == {"index": 3, "status": 500, "detail": "upstream exploded"}
+    assert by_index[0]["response"]["response"] == "answer 60"
+    assert peak == 2
+    # Results arrive as they finish, not in request order
+    assert [line["index"] for line in lines] != sorted(by_index)
+
+    too_many = {"items": [{"message": "hi"}] * (settings.CHAT_BATCH_MAX_ITEMS + 1)}
+    assert client.post("/api/v1/chat/batch", json=too_many, headers=headers).status_code == 400
+
+
+def test_search_is_ranked_paginated_and_scoped_to_the_user():
+    """Test full-text search pages best matches first, highlights them and hides other users' rooms"""
+    token = _auth_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    word = f"zebra{uuid.uuid4().hex[:6]}"
+    room = client.post("/api/v1/chat/rooms", json={"room_id": f"search-{word}"}, headers=headers).json()
+    other_headers = {"Authorization": f"Bearer {_auth_token()}"}
+    other = client.post("/api/v1/chat/rooms", json={"room_id": f"other-{word}"}, headers=other_headers).json()
+
+    db = SessionLocal()
+    try:
+        for content in (
+            f"{word} {word} <b>stripes</b>",
+            f"a long message that mentions {word} once among many other unrelated words",
+            f"{word} again",
+            "nothing to see here"
+        ):
+            chat_message.create(db, obj_in=ChatMessageCreate(session_id=room["id"], content=content, sender="user"))
+        chat_message.create(db, obj_in=ChatMessageCreate(session_id=other["id"], content=word, sender="user"))
+    finally:
+        db.close()
+
+    hits, cursor = [], None
+    for _ in range(5):
+        params = {"q": word, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/api/v1/chat/search", params=params, headers=headers).json()
+        hits.extend(page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert len(hits) == 3
+    assert {hit["room_id"] for hit in hits} == {room["room_id"]}
+    ranks = [hit["rank"] for hit in hits]
+    assert ranks == sorted(ranks, reverse=True)
+    assert hits[-1]["snippet"].startswith("a long message")  # one match in many words ranks last
+    snippet = next(hit["snippet"] for hit in hits if "stripes" in hit["snippet"])
+    assert snippet == f"<mark>{word}</mark> <mark>{word}</mark> &lt;b&gt;stripes&lt;/b&gt;"
+
+    # Search syntax characters in user input are ignored rather than parsed
+    response = client.get("/api/v1/chat/search", params={"q": f'{word}* ("^'}, headers=headers)
+    assert response.status_code == 200 and len(response.json()["items"]) == 3
+    response = client.get("/api/v1/chat/search", params={"q": word, "cursor": "bogus"}, headers=headers)
+    assert response.status_code == 400
+
+
+def test_history_export_and_import_round_trip():
+    """Test NDJSON export streams in batches, gzip round-trips, and a bad import keeps nothing"""
+    token = _auth_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    room_id = f"export-{uuid.uuid4().hex[:8]}"
+    room = client.post("/api/v1/chat/rooms", json={"room_id": room_id}, headers=headers).json()
+
+    db = SessionLocal()
+    try:
+        for i in range(5):
+            sender = "user" if i % 2 == 0 else "ai"
+            chat_message.create(db, obj_in=ChatMessageCreate(session_id=room["id"], content=f"msg {i}", sender=sender))
+    finally:
+        db.close()
+
+    batch_size = history_transfer.export_batch_size
+    history_transfer.export_batch_size = 2
+    try:
+        response = client.get(f"/api/v1/chat/rooms/{room_id}/export", headers=headers)
+        compressed = client.get(f"/api/v1/chat/rooms/{room_id}/export", params={"gzip": "true"}, headers=headers)
+    finally:
+        history_transfer.export_batch_size = batch_size
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0] == {"type": "room", "room_id": room_id, "created_at": lines[0]["created_at"]}
+    assert [line["content"] for line in lines[1:]] == [f"msg {i}" for i in range(5)]
+    assert compressed.headers["content-type"] == "application/gzip"
+    assert gzip.decompress(compressed.content).decode() == response.text
+
+    # Import the gzipped export into a new room: room lines are ignored, order is kept
+    copy_id = f"{room_id}-copy"
+    result = client.post(f"/api/v1/chat/rooms/{copy_id}/import", content=compressed.content, headers=headers)
+    assert result.status_code == 200
+    assert result.json() == {"imported": 5, "rooms": [copy_id]}
+    copied = client.get(f"/api/v1/chat/rooms/{copy_id}/messages", headers=headers).json()["items"]
+    assert [m["content"] for m in reversed(copied)] == [f"msg {i}" for i in range(5)]
+    assert [m["sender"] for m in reversed(copied)] == ["user", "ai", "user", "ai", "user"]
+
+    # A bad line rolls back the whole upload, including rooms it created
+    bad = f'{{"type": "room", "room_id": "{room_id}-bad"}}\n{{"content": "ok", "sender": "user"}}\n{{"content": "x", "sender": "bot"}}\n'
+    result = client.post("/api/v1/chat/import", content=bad.encode(), headers=headers)
+    assert result.status_code == 400 and result.json()["detail"].startswith("line 3:")
+    assert client.get(f"/api/v1/chat/rooms/{room_id}-bad/messages", headers=headers).status_code == 404
+
+    # Rooms of other users are off limits
+    other_headers = {"Authorization": f"Bearer {_auth_token()}"}
+    result = client.post(f"/api/v1/chat/rooms/{room_id}/import", content=response.content, headers=other_headers)
+    assert result.status_code == 403
+
+
+def test_room_broadcast_reaches_sockets_on_other_workers():
+    """Test a broadcast is published once and fanned out by every subscribed worker"""
+    broker = InMemoryBroker()
+    # Two managers on one broker stand in for two workers
+    first = ConnectionManager("memory", broker=broker)
+    second = ConnectionManager("memory", broker=broker)
+    alice, bob, carol = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+
+    async def run():
+        await first.connect(alice, "shared")
+        await second.connect(bob, "shared")
+        await second.connect(carol, "other")
+        await first.broadcast_to_room({"type": "user", "message": "hi"}, "shared")
+        await asyncio.sleep(0.01)
+
+        await second.disconnect(bob, "shared")
+        await first.broadcast_to_room({"type": "user", "message": "again"}, "shared")
+        await second.send_personal_message({"type": "system", "message": "just you"}, carol)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert [json.loads(m)["message"] for m in alice.sent] == ["hi", "again"]
+    assert [json.loads(m)["message"] for m in bob.sent] == ["hi"]
+    assert [json.loads(m)["message"] for m in carol.sent] == ["just you"]
+    assert list(second.connections) == [carol]
+    # The worker without local sockets in the room is no longer subscribed to it
+    assert "shared" not in second.active_connections
+    assert first.pubsub.published == 2
+
+
+def test_joining_while_the_last_socket_leaves_keeps_the_room_subscribed():
+    """Test a connect racing the last disconnect's unsubscribe still receives broadcasts"""
+    broker = InMemoryBroker()
+    room_manager = ConnectionManager("memory", broker=broker)
+    leaving, joining = FakeWebSocket(), FakeWebSocket()
+    unsubscribe = room_manager.pubsub.unsubscribe
+
+    async def slow_unsubscribe(room_id):
+        await asyncio.sleep(0.01)
+        await unsubscribe(room_id)
+
+    room_manager.pubsub.unsubscribe = slow_unsubscribe
+
+    async def run():
+        await room_manager.connect(leaving, "room")
+        await asyncio.gather(room_manager.disconnect(leaving, "room"), room_manager.connect(joining, "room"))
+        await room_manager.broadcast_to_room({"message": "still here"}, "room")
+        await asyncio.sleep(0.01)
+        await room_manager.shutdown()
+
+    asyncio.run(run())
+    assert [json.loads(m)["message"] for m in joining.sent] == ["still here"]
+    assert room_manager._room_locks == {}
+
+
+def test_slow_consumers_do_not_delay_the_room():
+    """Test broadcast never waits on a slow socket and overflow policies apply"""
+    async def run():
+        manager = ConnectionManager("memory", broker=InMemoryBroker(), max_queue=2, send_timeout=5)
+        fast, slow = FakeWebSocket(), FakeWebSocket(delay=0.2)
+        await manager.connect(fast, "room")
+        await manager.connect(slow, "room")
+
+        for i in range(5):
+            await manager.broadcast_to_room({"n": i}, "room")
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.05)
+        # The fast socket got everything while the slow one is still on its first frame
+        assert [json.loads(m)["n"] for m in fast.sent] == [0, 1, 2, 3, 4]
+        assert slow.sent == []
+        assert manager.dropped_messages == 2  # frames 1 and 2 made room for 3 and 4
+
+        strict = ConnectionManager(
+            "memory", broker=InMemoryBroker(), max_queue=1, overflow_policy="disconnect", send_timeout=5
+        )
+        stuck = FakeWebSocket(delay=1)
+        await strict.connect(stuck, "room")
+        for i in range(3):
+            await strict.broadcast_to_room({"n": i}, "room")
+        await asyncio.sleep(0.05)
+        assert "room" not in strict.active_connections
+        assert stuck.close_code == 1013
+        assert strict.stats()["evicted_connections"] == 1
+
+        await manager.shutdown()
+        await strict.shutdown()
+
+    asyncio.run(run())
+
+
+def test_broadcast_is_encoded_once_per_subprotocol():
+    """Test room frames are serialized once and shared by every socket of a protocol"""
+    async def run():
+        manager = ConnectionManager("memory", broker=InMemoryBroker())
+        sockets = [FakeWebSocket(), FakeWebSocket()]
+        for websocket in sockets:
+            await manager.connect(websocket, "room")
+        binary = None
+        if serialization.msgpack is not None:
+            binary = FakeWebSocket()
+            await manager.connect(binary, "room", subprotocol=serialization.MSGPACK_SUBPROTOCOL)
+
+        sent_at = datetime(2024, 5, 1, 12, 30)
+        await manager.broadcast_to_room({"type": "user", "message": "hi", "timestamp": sent_at}, "room")
+        await asyncio.sleep(0.01)
+
+        first, second = (websocket.sent[0] for websocket in sockets)
+        assert first is second
+        assert json.loads(first) == {"type": "user", "message": "hi", "timestamp": "2024-05-01T12:30:00"}
+        if binary is not None:
+            assert binary.subprotocol == "msgpack"
+            assert serialization.unpackb(binary.sent[0]) == json.loads(first)
+
+        await manager.shutdown()
+
+    asyncio.run(run())
+    assert serialization.negotiate_subprotocol(["v2.chat", "json"]) == "json"
+    assert serialization.negotiate_subprotocol(["v2.chat"]) is None
+
+
+def test_rate_limiter_returns_429_with_retry_after():
+    """Test the token bucket rejects bursts per client and refills over time"""
+    limiter = RateLimiter(MemoryRateLimitBackend(), requests=2, window=60)
+    inner = Starlette(routes=[Route("/ping", lambda request: PlainTextResponse("pong"))])
+    verifier = lambda token: {"sub": token}
+    limited_client = TestClient(RateLimitMiddleware(inner, limiter=limiter, token_verifier=verifier))
+
+    assert [limited_client.get("/ping").status_code for _ in range(3)] == [200, 200, 429]
+    response = limited_client.get("/ping")
+    assert response.headers["Retry-After"] == "30"
+    assert response.json() == {"detail": "Too many requests"}
+
+    # Authenticated clients get their own bucket
+    assert limited_client.get("/ping", headers={"Authorization": "Bearer 7"}).status_code == 200
+    assert limiter.stats()["limited"] == {"http": 2}
+
+    # A bucket refills at requests/window tokens per second
+    result = asyncio.run(limiter.backend.acquire("ip:other", capacity=1, refill_rate=100))
+    assert result.allowed
+    assert not asyncio.run(limiter.backend.acquire("ip:other", capacity=1, refill_rate=100)).allowed
+    time.sleep(0.02)
+    assert asyncio.run(limiter.backend.acquire("ip:other", capacity=1, refill_rate=100)).allowed
+
+
+def test_metrics_endpoint_exposes_http_db_and_websocket_series():
+    """Test /metrics reports route-templated HTTP latency, DB timings and WebSocket gauges"""
+    token = _auth_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    client.get("/api/v1/chat/rooms/missing-room/messages", headers=headers)
+
+    response = client.get("/api/v1/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/v1/chat/rooms/{room_id}/messages",status="404"}' in body
+    assert 'db_query_duration_seconds_count{operation="select"}' in body
+    assert "db_commit_duration_seconds_count" in body
+    assert "# TYPE ws_active_connections gauge" in body
+    assert "ai_concurrency_limit" in body
+
+
+def test_engine_instrumentation_survives_failed_statements_and_times_commits():
+    """Test a failing statement leaves no timer behind and commits are timed via engine events"""
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    commits = db_commit_duration.count()
+    with engine.connect() as conn:
+        info = conn.info
+        try:
+            conn.execute(text("SELECT * FROM no_such_table"))
+        except Exception:
+            conn.rollback()
+        assert info["query_started"] == []
+        conn.execute(text("CREATE TABLE t (x INTEGER)"))
+        conn.commit()
+        conn.execute(text("INSERT INTO t VALUES (1)"))
+        conn.commit()
+    assert info["query_started"] == []
+    assert "commit_started" not in info
+    assert db_commit_duration.count() == commits + 2
+    engine.dispose()
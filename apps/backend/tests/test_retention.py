@@ -0,0 +1,120 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+from app.crud.chat import chat_session, chat_message
+from app.db.database import SessionLocal
+from app.models.chat import ChatMessage
+from app.models.user import User
+from app.services.archive import ArchiveReader, MessageArchive
+from app.services.history import HistoryTransfer
+from app.services.retention import MessageRetention, add_months, month_start
+
+
+def _room_with_messages(db, user_id, stamps):
+    room = chat_session.create(db, user_id=user_id, room_id=f"retention-{uuid.uuid4().hex[:8]}")
+    for i, stamp in enumerate(stamps):
+        db.add(ChatMessage(session_id=room.id, content=f"msg {i}", sender="user", tokens_used=5, created_at=stamp))
+    room_ref = (room.id, room.room_id)
+    db.commit()
+    return room_ref
+
+
+def test_expired_months_move_to_archive_and_stay_exportable(tmp_path):
+    """Test retention archives whole expired months, settles room counters and keeps archived rows exportable"""
+    now = datetime.now(timezone.utc)
+    old = add_months(month_start(now), -30)
+    older_still = add_months(old, -2)
+    suffix = uuid.uuid4().hex[:8]
+
+    db = SessionLocal()
+    try:
+        user = User(email=f"ret_{suffix}@example.com", username=f"ret_{suffix}", hashed_password="x")
+        db.add(user)
+        db.commit()
+        first = _room_with_messages(
+            db, user.id, [older_still + timedelta(days=1), old + timedelta(days=2), old + timedelta(days=3), now]
+        )
+        second = _room_with_messages(db, user.id, [old + timedelta(days=4), old + timedelta(days=5)])
+    finally:
+        db.close()
+
+    archive = MessageArchive(str(tmp_path), row_group_size=2)
+    retention = MessageRetention(archive=archive, retention_months=12, interval=0)
+    result = asyncio.run(retention.run_once(now))
+    assert result["archived"] == {f"{older_still:%Y-%m}": 1, f"{old:%Y-%m}": 4}
+    assert asyncio.run(retention.run_once(now)) == {"archived": {}}
+
+    db = SessionLocal()
+    try:
+        remaining = chat_message.get_session_messages(db, session_id=first[0])
+        assert [m.content for m in remaining] == ["msg 3"]
+        assert chat_message.get_session_messages(db, session_id=second[0]) == []
+        room = chat_session.get(db, first[0])
+        assert (room.message_count, room.total_tokens) == (1, 5)
+    finally:
+        db.close()
+
+    # One file per month; rows are sorted by room so each row group holds one room here
+    files = archive.files()
+    assert len(files) == 2
+    reader = ArchiveReader(files[1])
+    assert [group["rows"] for group in reader.row_groups] == [2, 2]
+    assert reader.groups_for_session(first[0]) == [0]
+    assert [row["content"] for row in reader.read_group(1)] == ["msg 0", "msg 1"]
+
+    async def export():
+        transfer = HistoryTransfer(archive=archive)
+        return b"".join([chunk async for chunk in transfer.export_rooms([(first[0], first[1], None)])])
+
+    lines = [json.loads(line) for line in asyncio.run(export()).splitlines()]
+    assert [line["content"] for line in lines[1:]] == ["msg 0", "msg 1", "msg 2", "msg 3"]
+
+
+def test_rerunning_an_interrupted_archive_does_not_duplicate_rows(tmp_path):
+    """Test a month archived but not deleted, then archived again, or joined by late rows, keeps one copy per row"""
+    now = datetime.now(timezone.utc)
+    old = add_months(month_start(now), -40)
+    suffix = uuid.uuid4().hex[:8]
+
+    db = SessionLocal()
+    try:
+        user = User(email=f"rerun_{suffix}@example.com", username=f"rerun_{suffix}", hashed_password="x")
+        db.add(user)
+        db.commit()
+        room = _room_with_messages(db, user.id, [old + timedelta(days=1), old + timedelta(days=2)])
+    finally:
+        db.close()
+
+    class Interrupted(MessageRetention):
+        async def _write_archive(self, conn, month, query):
+            await super()._write_archive(conn, month, query)
+            raise RuntimeError("worker killed before the delete")
+
+    archive = MessageArchive(str(tmp_path), row_group_size=10)
+    try:
+        asyncio.run(Interrupted(archive=archive, retention_months=12, interval=0).run_once(now))
+    except RuntimeError:
+        pass
+    assert [len(list(ArchiveReader(path).rows())) for path in archive.files()] == [2]
+
+    retention = MessageRetention(archive=archive, retention_months=12, interval=0)
+    assert asyncio.run(retention.run_once(now)) == {"archived": {f"{old:%Y-%m}": 2}}
+
+    # A late row for the archived month lands in the same file
+    db = SessionLocal()
+    try:
+        db.add(ChatMessage(session_id=room[0], content="late", sender="user", created_at=old + timedelta(days=3)))
+        db.commit()
+    finally:
+        db.close()
+    assert asyncio.run(retention.run_once(now)) == {"archived": {f"{old:%Y-%m}": 1}}
+
+    files = archive.files()
+    assert [os.path.basename(path) for path in files] == [f"chat_messages-{old:%Y-%m}.cma"]
+    assert [row["content"] for row in archive.reader(files[0]).rows()] == ["msg 0", "msg 1", "late"]
+    assert [row["content"] for rows in archive.session_batches(room[0]) for row in rows] == ["msg 0", "msg 1", "late"]